@@ -0,0 +1,245 @@
+#----------------------------------------------------------------------------#
+# JSON API, version 1.
+#
+# Collections are keyset-paginated JSON ({"data": [...], "next": cursor}
+# plus a Link header) by default. With ?format=ndjson, or
+# Accept: application/x-ndjson, the whole collection streams as
+# newline-delimited JSON from a server-side cursor, one row at a time.
+# ?fields=id,name limits the output (and the SELECT) to those fields.
+# JSON responses carry an ETag and answer If-None-Match with 304.
+# Venues and artists take the filters of facets.py (?genre=, ?city=, ...);
+# with ?facets=genres the first page, and every search page, also carries
+# the genre counts of all the matches ({"facets": [{"genre", "count"}]}).
+# /venues/near takes the arguments of geo.near_query().
+#----------------------------------------------------------------------------#
+import hmac
+import io
+import json
+from datetime import datetime
+
+from flask import Blueprint, Response, abort, current_app, request, stream_with_context
+
+from models import db, Venue, Artist, Show
+from facets import TRUE_VALUES, calendar_clauses, filter_clauses, genre_facets, parse_filters
+from geo import near_query, venues_near
+from pagination import keyset_page, link_header, page_size
+from search import search_with_upcoming_counts
+from replicas import read_only
+from importer import KINDS, import_rows, read_rows
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+NDJSON = 'application/x-ndjson'
+
+# rows fetched per round trip when streaming
+STREAM_BATCH_SIZE = 1000
+
+# rejected rows echoed back by POST /import/<kind>; the rest are only counted
+MAX_REPORTED_REJECTS = 1000
+
+
+class Collection(object):
+	def __init__(self, fields, order_by, joins=(), default_fields=None, filtered=None, criteria=None):
+		self.fields = fields
+		self.order_by = order_by
+		self.joins = joins
+		self.default_fields = default_fields or list(fields)
+		# (model, show foreign key) for the filters of facets.py
+		self.filtered = filtered
+		# or a function of request.args returning the clauses to apply
+		self.criteria = criteria
+
+	def query(self, names):
+		# the sort key is always selected: keyset pagination reads it back
+		names = list(names) + [c.key for c in self.order_by if c.key not in names]
+		query = db.session.query(*[self.fields[name].label(name) for name in names])
+		for target, onclause in self.joins:
+			query = query.join(target, onclause)
+		return query
+
+
+VENUES = Collection(
+	fields={
+		'id': Venue.id, 'name': Venue.name, 'city': Venue.city, 'state': Venue.state,
+		'address': Venue.address, 'phone': Venue.phone, 'genres': Venue.genres,
+		'image_link': Venue.image_link, 'facebook_link': Venue.facebook_link,
+		'website_link': Venue.website_link, 'seeking_talent': Venue.seeking_talent,
+		'seeking_description': Venue.seeking_description,
+	},
+	order_by=[Venue.state, Venue.city, Venue.id],
+	filtered=(Venue, Show.venue_id))
+
+ARTISTS = Collection(
+	fields={
+		'id': Artist.id, 'name': Artist.name, 'city': Artist.city, 'state': Artist.state,
+		'phone': Artist.phone, 'genres': Artist.genres, 'image_link': Artist.image_link,
+		'facebook_link': Artist.facebook_link, 'website_link': Artist.website_link,
+		'seeking_venue': Artist.seeking_venue, 'seeking_description': Artist.seeking_description,
+	},
+	order_by=[Artist.name, Artist.id],
+	filtered=(Artist, Show.artist_id))
+
+SHOWS = Collection(
+	fields={
+		'id': Show.id, 'start_time': Show.start_time,
+		'venue_id': Show.venue_id, 'venue_name': Venue.name,
+		'artist_id': Show.artist_id, 'artist_name': Artist.name,
+		'artist_image_link': Artist.image_link,
+	},
+	order_by=[Show.start_time, Show.id],
+	joins=[(Venue, Venue.id == Show.venue_id), (Artist, Artist.id == Show.artist_id)],
+	criteria=calendar_clauses)
+
+
+def _jsonable(value):
+	return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _selected_fields(allowed, default):
+	fields = request.args.get('fields')
+	if not fields:
+		return default
+	names = [name.strip() for name in fields.split(',') if name.strip()]
+	unknown = [name for name in names if name not in allowed]
+	if unknown:
+		abort(400, 'Unknown fields: %s' % ', '.join(unknown))
+	return names
+
+
+def _wants_ndjson():
+	return request.args.get('format') == 'ndjson' or \
+		request.accept_mimetypes.best == NDJSON
+
+
+def _wants_facets():
+	facets = request.args.get('facets')
+	if facets not in (None, '', 'genres'):
+		abort(400, 'facets must be genres')
+	return bool(facets)
+
+
+def _json_response(payload, status=200):
+	response = Response(
+		json.dumps(payload, default=_jsonable, separators=(',', ':')),
+		status=status, mimetype='application/json')
+	response.add_etag()
+	return response.make_conditional(request)
+
+
+def _list(collection):
+	fields = _selected_fields(collection.fields, collection.default_fields)
+	query = collection.query(fields)
+	clauses = []
+	if collection.filtered:
+		clauses = filter_clauses(*collection.filtered, parse_filters(request.args))
+		query = query.filter(*clauses)
+	elif collection.criteria:
+		query = query.filter(*collection.criteria(request.args))
+
+	if _wants_ndjson():
+		rows = query.order_by(*collection.order_by).yield_per(STREAM_BATCH_SIZE)
+
+		def generate():
+			for row in rows:
+				yield json.dumps({name: getattr(row, name) for name in fields},
+					default=_jsonable, separators=(',', ':')) + '\n'
+
+		return Response(stream_with_context(generate()), mimetype=NDJSON)
+
+	cursor = request.args.get('after')
+	facets = collection.filtered and cursor is None and _wants_facets()
+	rows, next_cursor = keyset_page(query, collection.order_by, cursor, page_size())
+	payload = {
+		"data": [{name: getattr(row, name) for name in fields} for row in rows],
+		"next": next_cursor
+	}
+	if facets:
+		payload["facets"] = genre_facets(collection.filtered[0], clauses)
+	response = _json_response(payload)
+	response.headers['Link'] = link_header(next_cursor)
+	return response
+
+
+def _search(model, show_fk):
+	page = search_with_upcoming_counts(model, show_fk,
+		request.args.get('search_term', ''),
+		request.args.get('page', 1, type=int),
+		current_app.config['SEARCH_PAGE_SIZE'],
+		filters=parse_filters(request.args),
+		facets=_wants_facets())
+	fields = _selected_fields(('id', 'name', 'num_upcoming_shows'), None)
+	if fields:
+		page['data'] = [{name: item[name] for name in fields} for item in page['data']]
+	return _json_response(page)
+
+
+@api.route('/venues')
+@read_only
+def venues():
+	return _list(VENUES)
+
+
+@api.route('/artists')
+@read_only
+def artists():
+	return _list(ARTISTS)
+
+
+@api.route('/shows')
+@read_only
+def shows():
+	return _list(SHOWS)
+
+
+@api.route('/venues/near')
+@read_only
+def near_venues():
+	query = near_query(request.args)
+	if query is None:
+		abort(400, 'Give lat and lng, city and state, or bbox')
+	return _json_response({"data": venues_near(*query, limit=page_size())})
+
+
+@api.route('/venues/search')
+@read_only
+def search_venues():
+	return _search(Venue, Show.venue_id)
+
+
+@api.route('/artists/search')
+@read_only
+def search_artists():
+	return _search(Artist, Show.artist_id)
+
+
+@api.route('/import/<kind>', methods=['POST'])
+def bulk_import(kind):
+	# disabled unless IMPORT_API_TOKEN is configured
+	token = current_app.config.get('IMPORT_API_TOKEN')
+	if not token:
+		abort(404)
+	if not hmac.compare_digest(request.headers.get('Authorization', ''), 'Bearer ' + token):
+		abort(401)
+	if kind not in KINDS:
+		abort(404, 'Unknown kind %s' % kind)
+
+	fmt = 'ndjson' if request.mimetype in (NDJSON, 'application/json') else 'csv'
+	stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+	rejected = []
+
+	def on_reject(line, row, errors):
+		if len(rejected) < MAX_REPORTED_REJECTS:
+			rejected.append({"line": line, "errors": errors, "row": row})
+
+	# ?check=1 validates (shows: booking conflicts included) and keeps nothing
+	check = request.args.get('check', '').lower() in TRUE_VALUES
+	stats = import_rows(kind, read_rows(stream, fmt), on_reject, check=check)
+	stats['rejected_rows'] = rejected
+	return Response(json.dumps(stats, default=_jsonable), mimetype='application/json')
+
+
+@api.errorhandler(400)
+@api.errorhandler(401)
+@api.errorhandler(404)
+def api_error(error):
+	return Response(json.dumps({"error": error.description}), status=error.code, mimetype='application/json')
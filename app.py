@@ -2,28 +2,48 @@
 # Imports
 #----------------------------------------------------------------------------#
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func
+from sqlalchemy.orm import selectinload
 import logging
 from logging import Formatter, FileHandler
-from flask_wtf import Form
-from forms import *
-from datetime import datetime
+from forms import ArtistForm, ShowForm, VenueForm
+from itertools import groupby
+from operator import itemgetter
 from flask_migrate import Migrate
 import sys
-import json
 import dateutil.parser
 import babel
+from babel.dates import parse_pattern
+from functools import lru_cache
 from flask import (
 	Flask, 
 	render_template, 
 	request, 
-	Response, 
+	abort, 
 	flash, 
+	make_response, 
 	redirect, 
 	url_for)
 
-from models import db, Venue, Artist, Show    
+from models import db, Venue, Artist, Show, DEFAULT_SHOW_MINUTES, enable_raiseload
+from search import search_with_upcoming_counts
+from facets import (
+	GENRES, calendar_clauses, filter_args, filter_clauses, genre_facets, genre_options, parse_filters)
+from pagination import keyset_page, link_header, page_size, page_url
+from queries import (
+	ARTIST_PAGE_COLUMNS, SHOW_LIST_ORDER, artist_statement, artist_timeline, show_list_statement,
+	venue_page)
+from cache import FragmentCache
+from replicas import ReplicaRouter, read_only
+from counters import counters_command, recount, show_added
+from bookings import BookingConflict, add_show
+from geo import geocode_command, locate, near_query, venues_near
+from partitions import partitions_command
+from jobs import JobQueue, emit, jobs_command
+from sqltiming import QueryTimer
+from api import api
+from metrics import RequestMetrics
+from importer import import_command
+from exporter import export_command
 
 
 app = Flask(__name__)
@@ -31,21 +51,45 @@ app.config.from_object('config')
 moment = Moment(app)
 db.init_app(app)
 migrate = Migrate(app, db)
+replicas = ReplicaRouter(app)
+page_cache = FragmentCache(app)
+job_queue = JobQueue(app)
+query_timer = QueryTimer(app)
+app_metrics = RequestMetrics(app)
+app.register_blueprint(api)
+app.cli.add_command(import_command)
+app.cli.add_command(export_command)
+app.cli.add_command(counters_command)
+app.cli.add_command(geocode_command)
+app.cli.add_command(partitions_command)
+app.cli.add_command(jobs_command)
+
+if app.config.get('SQLALCHEMY_RAISELOAD'):
+	enable_raiseload(db.session)
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-	date = dateutil.parser.parse(value)
+DATETIME_LOCALE = babel.Locale.parse('en')
+# Babel patterns compiled once instead of on every call.
+DATETIME_PATTERNS = {
+	'full': parse_pattern("EEEE MMMM, d, y 'at' h:mma"),
+	'medium': parse_pattern("EE MM, dd, y h:mma"),
+	'day': parse_pattern("EEEE MMMM d, y"),
+}
+
+# A page lists the same few hundred start times on every render; keep the
+# formatted strings around (bounded, least recently used go first).
+@lru_cache(maxsize=4096)
+def _format_datetime(date, format):
+	pattern = DATETIME_PATTERNS.get(format, DATETIME_PATTERNS['full'])
+	return pattern.apply(date, DATETIME_LOCALE)
 
-	if format == 'full':
-			format="EEEE MMMM, d, y 'at' h:mma"
-	elif format == 'medium':
-			format="EE MM, dd, y h:mma"
-	else:
-		format="EEEE MMMM, d, y 'at' h:mma"
-	return babel.dates.format_datetime(date, format, locale='en')
+def format_datetime(value, format='medium'):
+	# views pass datetimes; strings are still accepted for older callers
+	date = dateutil.parser.parse(value) if isinstance(value, str) else value
+	return _format_datetime(date, format)
 
 app.jinja_env.filters['datetime'] = format_datetime
 
@@ -62,58 +106,80 @@ def index():
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@read_only
 def venues():
-	data1 = Venue.query.all()
+	# One ordered query per page; consecutive rows of the same area are
+	# folded into one heading, so nothing is grouped in memory beyond a page.
+	filters = parse_filters(request.args)
+	clauses = filter_clauses(Venue, Show.venue_id, filters)
+	cursor = request.args.get('after')
+	rows, next_cursor = keyset_page(
+		db.session.query(Venue.state, Venue.city, Venue.id, Venue.name).filter(*clauses),
+		[Venue.state, Venue.city, Venue.id],
+		cursor,
+		page_size())
+	# genre counts over every page, shown with the first one
+	facets = genre_facets(Venue, clauses) if cursor is None else None
+
+	areas = []
+	for (state, city), area_venues in groupby(rows, key=itemgetter(0, 1)):
+		areas.append({
+			"city": city,
+			"state": state,
+			"venues": [{"id": venue.id, "name": venue.name} for venue in area_venues]
+		})
 
-	return render_template('pages/venues.html', areas=data1);
+	response = make_response(render_template('pages/venues.html', areas=areas,
+		next_url=page_url(next_cursor) if next_cursor else None,
+		filters=filters, genre_options=genre_options(facets, filters)))
+	response.headers['Link'] = link_header(next_cursor)
+	return response
 
 @app.route('/venues/search', methods=['POST'])
+@read_only
 def search_venues():
 	search_term = request.form.get('search_term', '')
-	search_result = Venue.query.filter(Venue.name.ilike(f'%{search_term}%')).all()
-	info = []
-
-	for result in search_result:
-		info.append({
-			"id": result.id,
-			"name": result.name,
-			"num_upcoming_shows": len(db.session.query(Show).filter(Show.venue_id == result.id).filter(Show.start_time > datetime.now()).all())
-			})
-
-	response={
-		"count": len(search_result),
-		"data": info
+	page = request.form.get('page', 1, type=int)
+	filters = parse_filters(request.form)
+	response = search_with_upcoming_counts(Venue, Show.venue_id, search_term,
+		page, app.config['SEARCH_PAGE_SIZE'], filters=filters, facets=page == 1)
+
+	return search_page('pages/search_venues.html', response, search_term, filters)
+
+def search_page(template, results, search_term, filters):
+	# facets come with the first page only; later pages carry the filters
+	# in hidden fields
+	return render_template(template, results=results, search_term=search_term, filters=filters,
+		filter_args=filter_args(filters), genre_options=genre_options(results.get('facets'), filters))
+
+@app.route('/venues/near')
+@read_only
+def venues_near_page():
+	query = near_query(request.args)
+	venues = venues_near(*query, limit=page_size()) if query else None
+	return render_template('pages/venues_near.html', venues=venues, query=query)
+
+def venue_detail(venue):
+	"""Render and cache the detail fragment of a VenuePage."""
+	detail = {
+		"name": venue.name,
+		"html": render_template('fragments/venue_detail.html', venue=venue)
 	}
-	return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
+	page_cache.set('venue:%d' % venue.id, detail,
+		next_change=venue.upcoming_shows[0].start_time if venue.upcoming_shows else None)
+	return detail
 
 @app.route('/venues/<int:venue_id>')
+@read_only
 def show_venue(venue_id):
-	venue = Venue.query.get_or_404(venue_id)
-
-	past_shows = []
-	upcoming_shows = []
-
-	for show in venue.shows:
-			temp_show = {
-					'artist_id': show.artist_id,
-					'artist_name': show.artist.name,
-					'artist_image_link': show.artist.image_link,
-					'start_time': show.start_time.strftime("%m/%d/%Y, %H:%M")
-			}
-			if show.start_time <= datetime.now():
-					past_shows.append(temp_show)
-			else:
-					upcoming_shows.append(temp_show)
-
-	# object class to dict
-	data = vars(venue)
-
-	data['past_shows'] = past_shows
-	data['upcoming_shows'] = upcoming_shows
-	data['past_shows_count'] = len(past_shows)
-	data['upcoming_shows_count'] = len(upcoming_shows)
-
-	return render_template('pages/show_venue.html', venue=data)
+	detail = page_cache.get('venue:%d' % venue_id)
+	if detail is None:
+		venue = venue_page(venue_id)
+		if venue is None:
+			abort(404)
+		detail = venue_detail(venue)
+
+	return render_template('pages/show_venue.html', detail=detail['html'])
  
 #  Create Venue
 #  ----------------------------------------------------------------
@@ -123,10 +189,22 @@ def create_venue_form():
 	form = VenueForm(request.form)
 	return render_template('forms/new_venue.html', form=form)
 
+def coordinate_errors(form):
+	"""Errors of the venue form's latitude / longitude, checked before locate()."""
+	errors = []
+	for field in (form.latitude, form.longitude):
+		if not field.validate(form):
+			errors.append('%s: %s' % (field.name, '; '.join(field.errors)))
+	return errors
+
 @app.route('/venues/create', methods=['POST', 'GET'])
 def create_venue_submission():
+	form = VenueForm(request.form)
+	errors = coordinate_errors(form)
+	if errors:
+		flash('Venue can not be listed, %s' % ', '.join(errors))
+		return render_template('forms/new_venue.html', form=form), 400
 	try:
-		form = VenueForm(request.form)
 		venue = Venue(
 			name=form.name.data,
 			city=form.city.data,
@@ -139,8 +217,11 @@ def create_venue_submission():
 			website_link=form.website_link.data,
 			seeking_talent=form.seeking_talent.data,
 			seeking_description=form.seeking_description.data)
+		locate(venue, form.latitude.data, form.longitude.data)
 		# on successful db insert, flash success
 		db.session.add(venue)
+		db.session.flush()
+		emit('venue.created', venue_id=venue.id)
 		db.session.commit()
 		flash('Venue ' + request.form['name'] + ' was successfully listed!')
 
@@ -154,9 +235,15 @@ def create_venue_submission():
 def delete_venue(venue_id):
 	error = False
 	try:
-		venue = Venue.query.get(venue_id)
+		# the delete cascade needs the shows; fetch them in one query
+		venue = Venue.query.options(selectinload(Venue.shows)).get(venue_id)
+		stale = page_cache.venue_keys(venue_id)
+		artist_ids = {show.artist_id for show in venue.shows}
 		db.session.delete(venue)
+		db.session.flush()
+		recount(artist_ids=artist_ids)
 		db.session.commit()
+		page_cache.delete(*stale)
 	except:
 		error = True
 		db.session.rollback()
@@ -171,79 +258,61 @@ def delete_venue(venue_id):
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@read_only
 def artists():
-	data = Artist.query.all()
-	
-	return render_template('pages/artists.html', artists=data)
+	filters = parse_filters(request.args)
+	clauses = filter_clauses(Artist, Show.artist_id, filters)
+	cursor = request.args.get('after')
+	data, next_cursor = keyset_page(
+		db.session.query(Artist.id, Artist.name).filter(*clauses),
+		[Artist.name, Artist.id],
+		cursor,
+		page_size())
+	facets = genre_facets(Artist, clauses) if cursor is None else None
+
+	response = make_response(render_template('pages/artists.html', artists=data,
+		next_url=page_url(next_cursor) if next_cursor else None,
+		filters=filters, genre_options=genre_options(facets, filters)))
+	response.headers['Link'] = link_header(next_cursor)
+	return response
 
 @app.route('/artists/search', methods=['POST'])
+@read_only
 def search_artists():
 	search_term = request.form.get('search_term', '')
-	search_result = Artist.query.filter(Artist.name.ilike(f'%{search_term}%')).all()
-	info = []
-
-	for result in search_result:
-		info.append({
-			"id": result.id,
-			"name": result.name,
-			"num_upcoming_shows": len(db.session.query(Show).filter(Show.artist_id == result.id).filter(Show.start_time > datetime.now()).all())
-			})
-
-	response={
-		"count": len(search_result),
-		"data": info
-	}
-	return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
+	page = request.form.get('page', 1, type=int)
+	filters = parse_filters(request.form)
+	response = search_with_upcoming_counts(Artist, Show.artist_id, search_term,
+		page, app.config['SEARCH_PAGE_SIZE'], filters=filters, facets=page == 1)
 
-@app.route('/artists/<int:artist_id>')
-def show_artist(artist_id):
-	artist_query = db.session.query(Artist).get(artist_id)
-
-	if not artist_query: 
-		return render_template('errors/404.html')
+	return search_page('pages/search_artists.html', response, search_term, filters)
 
-	past_shows_query = db.session.query(Show).join(Venue).filter(Show.artist_id==artist_id).filter(Show.start_time<datetime.now()).all()
-	past_shows = []
-
-	for show in past_shows_query:
-		past_shows.append({
-			"venue_id": show.venue_id,
-			"venue_name": show.venue.name,
-			"artist_image_link": show.venue.image_link,
-			"start_time": show.start_time.strftime('%Y-%m-%d %H:%M:%S')
-		})
+def artist_detail(artist, timeline):
+	"""Render and cache the detail fragment from an artist_statement row."""
+	data = dict(zip((column.key for column in ARTIST_PAGE_COLUMNS), artist))
+	data.update(timeline)
 
-	upcoming_shows_query = db.session.query(Show).join(Venue).filter(Show.artist_id==artist_id).filter(Show.start_time>datetime.now()).all()
-	upcoming_shows = []
+	detail = {
+		"name": artist.name,
+		"html": render_template('fragments/artist_detail.html', artist=data)
+	}
+	page_cache.set('artist:%d' % artist.id, detail,
+		next_change=timeline["upcoming_shows"][0]["start_time"] if timeline["upcoming_shows"] else None)
+	return detail
 
-	for show in upcoming_shows_query:
-		upcoming_shows.append({
-			"venue_id": show.venue_id,
-			"venue_name": show.venue.name,
-			"venue_image_link": show.venue.image_link,
-			"start_time": show.start_time.strftime('%Y-%m-%d %H:%M:%S')
-		})
+@app.route('/artists/<int:artist_id>')
+@read_only
+def show_artist(artist_id):
+	detail = page_cache.get('artist:%d' % artist_id)
+	if detail is None:
+		artist = db.session.execute(artist_statement(artist_id)).first()
 
+		if not artist:
+			return render_template('errors/404.html')
 
-	data = {
-		"id": artist_query.id,
-		"name": artist_query.name,
-		"genres": artist_query.genres,
-		"city": artist_query.city,
-		"state": artist_query.state,
-		"phone": artist_query.phone,
-		"website_link": artist_query.website_link,
-		"facebook_link": artist_query.facebook_link,
-		"seeking_venue": artist_query.seeking_venue,
-		"seeking_description": artist_query.seeking_description,
-		"image_link": artist_query.image_link,
-		"past_shows": past_shows,
-		"upcoming_shows": upcoming_shows,
-		"past_shows_count": len(past_shows),
-		"upcoming_shows_count": len(upcoming_shows),
-	}
+		detail = artist_detail(artist, artist_timeline(artist_id))
 
-	return render_template('pages/show_artist.html', artist=data)
+	return render_template('pages/show_artist.html', artist_name=detail['name'], detail=detail['html'])
 
 #  Update
 #  ----------------------------------------------------------------
@@ -280,7 +349,10 @@ def edit_artist_submission(artist_id):
 		artist.seeking_venue = True if 'seeking_venue' in request.form else False 
 		artist.seeking_description = request.form['seeking_description']
 
+		# the venue pages listing the artist are dropped in a job
+		emit('artist.edited', artist_id=artist_id)
 		db.session.commit()
+		page_cache.delete('artist:%d' % artist_id)
 		flash('Artist ' + request.form['name'] + ' was successfully edited!')
 		return redirect(url_for('show_artist', artist_id=artist_id))
 	except:
@@ -300,6 +372,8 @@ def edit_venue(venue_id):
 		form.state.data = venue.state
 		form.phone.data = venue.phone
 		form.address.data = venue.address
+		form.latitude.data = venue.latitude
+		form.longitude.data = venue.longitude
 		form.genres.data = venue.genres
 		form.facebook_link.data = venue.facebook_link
 		form.image_link.data = venue.image_link
@@ -311,6 +385,11 @@ def edit_venue(venue_id):
 
 @app.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
+	form = VenueForm(request.form)
+	errors = coordinate_errors(form)
+	if errors:
+		flash('Venue can not be edited, %s' % ', '.join(errors))
+		return render_template('forms/edit_venue.html', form=form, venue=db.session.get(Venue, venue_id)), 400
 	try:
 		venue = Venue.query.get(venue_id)
 		venue.name = request.form['name']
@@ -324,8 +403,12 @@ def edit_venue_submission(venue_id):
 		venue.website_link = request.form['website_link']
 		venue.seeking_talent = True if 'seeking_talent' in request.form else False 
 		venue.seeking_description = request.form['seeking_description']
+		locate(venue, form.latitude.data, form.longitude.data)
 
+		# the artist pages listing the venue are dropped in a job
+		emit('venue.edited', venue_id=venue_id)
 		db.session.commit()
+		page_cache.delete('venue:%d' % venue_id)
 		flash('Venue ' + request.form['name'] + ' was successfully edited!')
 
 		return redirect(url_for('show_venue', venue_id=venue_id))
@@ -361,6 +444,8 @@ def create_artist_submission():
 		seeking_description=form.seeking_description.data)
 
 	db.session.add(artist)
+	db.session.flush()
+	emit('artist.created', artist_id=artist.id)
 	db.session.commit()
 	flash('Artist ' + request.form['name'] + ' was successfully listed!')
 
@@ -371,23 +456,33 @@ def create_artist_submission():
 #  Shows
 #  ----------------------------------------------------------------
 
-@app.route('/shows')
-def shows():
-
-	shows_query = db.session.query(Show).join(Artist).join(Venue).all()
-
+def shows_response(shows_page, next_cursor):
 	data = []
-	for show in shows_query: 
+	for show in shows_page:
 		data.append({
 			"venue_id": show.venue_id,
-			"venue_name": show.venue.name,
+			"venue_name": show.venue_name,
 			"artist_id": show.artist_id,
-			"artist_name": show.artist.name, 
-			"artist_image_link": show.artist.image_link,
-			"start_time": show.start_time.strftime('%Y-%m-%d %H:%M:%S')
+			"artist_name": show.artist_name,
+			"artist_image_link": show.artist_image_link,
+			"start_time": show.start_time
 		})
 
-	return render_template('pages/shows.html', shows=data)
+	response = make_response(render_template('pages/shows.html', shows=data,
+		genres=GENRES.values(), filters=parse_filters(request.args),
+		next_url=page_url(next_cursor) if next_cursor else None))
+	response.headers['Link'] = link_header(next_cursor)
+	return response
+
+@app.route('/shows')
+@read_only
+def shows():
+	shows_page, next_cursor = keyset_page(
+		show_list_statement(calendar_clauses(request.args)),
+		SHOW_LIST_ORDER,
+		request.args.get('after'),
+		page_size())
+	return shows_response(shows_page, next_cursor)
 
 @app.route('/shows/create')
 def create_shows():
@@ -397,19 +492,30 @@ def create_shows():
 
 @app.route('/shows/create', methods=['POST'])
 def create_show_submission():
+	form = ShowForm(request.form)
+	if not form.duration_minutes.validate(form):
+		flash('Show can not be listed, duration: %s' % '; '.join(form.duration_minutes.errors))
+		return render_template('forms/new_show.html', form=form), 400
 	try:
-		form = ShowForm(request.form)
 		show = Show(
 			artist_id=form.artist_id.data,
 			venue_id=form.venue_id.data,
-			start_time=form.start_time.data)
-		db.session.add(show)
+			start_time=form.start_time.data,
+			duration_minutes=form.duration_minutes.data or DEFAULT_SHOW_MINUTES)
+		add_show(show)
+		show_added(show)
+		emit('show.created', show_id=show.id, venue_id=show.venue_id, artist_id=show.artist_id)
 		db.session.commit()
+		page_cache.delete(*page_cache.show_keys(show.venue_id, show.artist_id))
 		flash('Show was successfully listed!')
+	except BookingConflict as conflict:
+		db.session.rollback()
+		flash('Show can not be listed: %s' % conflict)
+		return render_template('forms/new_show.html', form=form), 409
 	except:
+		db.session.rollback()
 		flash('Error, show can not be created!')
-	finally:
-		return render_template('pages/home.html')
+	return render_template('pages/home.html')
 
 @app.errorhandler(404)
 def not_found_error(error):
@@ -0,0 +1,263 @@
+#----------------------------------------------------------------------------#
+# ASGI entry point with async read views.
+#
+#   uvicorn asgi:application --workers 4
+#
+# The read endpoints below run as coroutines on an AsyncSession (asyncpg on
+# PostgreSQL, aiosqlite on SQLite), so a slow query parks the request
+# instead of a worker thread. They build their statements with the same
+# functions as the sync views in app.py and render through the same
+# helpers, inside a regular Flask request context: before/after request
+# hooks, Server-Timing, /metrics, the fragment cache and error pages behave
+# as under WSGI, and reads go to a replica when replicas.py picks one.
+# Every other route is served by the WSGI app in a thread.
+#----------------------------------------------------------------------------#
+import io
+import sys
+from datetime import datetime
+
+from asgiref.wsgi import WsgiToAsgi
+from flask import abort, render_template, request
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from werkzeug.exceptions import HTTPException
+
+from app import app, artist_detail, page_cache, search_page, shows_response, venue_detail
+from dbpool import TimedAsyncQueuePool, pool_options
+from facets import calendar_clauses, facet_list, parse_filters
+from models import Venue, Artist, Show
+from pagination import keyset_rows, keyset_statement, page_size
+from queries import (
+	SHOW_LIST_ORDER, artist_statement, artist_timeline_from_rows, artist_timeline_statement,
+	show_list_statement, venue_page_from_rows, venue_page_statement)
+from search import search_facets_statement, search_results, search_statement
+
+ASYNC_DRIVERS = {
+	'postgresql': 'postgresql+asyncpg',
+	'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def async_database_url(config, bind=None):
+	"""URL of the primary, or of the replica with bind key ``bind``."""
+	if bind is None and config.get('ASYNC_DATABASE_URL'):
+		return make_url(config['ASYNC_DATABASE_URL'])
+	url = make_url(config['SQLALCHEMY_BINDS'][bind] if bind else config['SQLALCHEMY_DATABASE_URI'])
+	return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+
+def create_engine(config, bind=None):
+	url = async_database_url(config, bind)
+	return create_async_engine(url, **pool_options(config, url.drivername, TimedAsyncQueuePool))
+
+
+#  Views
+#  ----------------------------------------------------------------
+
+async def shows(session):
+	per_page = page_size()
+	statement = keyset_statement(show_list_statement(calendar_clauses(request.args)), SHOW_LIST_ORDER,
+		request.args.get('after'), per_page)
+	rows = (await session.execute(statement)).all()
+	return shows_response(*keyset_rows(rows, SHOW_LIST_ORDER, per_page))
+
+
+async def show_venue(session, venue_id):
+	detail = page_cache.get('venue:%d' % venue_id)
+	if detail is None:
+		rows = (await session.execute(venue_page_statement(venue_id))).all()
+		venue = venue_page_from_rows(rows, datetime.now())
+		if venue is None:
+			abort(404)
+		detail = venue_detail(venue)
+
+	return render_template('pages/show_venue.html', detail=detail['html'])
+
+
+async def show_artist(session, artist_id):
+	detail = page_cache.get('artist:%d' % artist_id)
+	if detail is None:
+		artist = (await session.execute(artist_statement(artist_id))).first()
+
+		if not artist:
+			return render_template('errors/404.html')
+
+		rows = await session.execute(artist_timeline_statement(artist_id, datetime.now()))
+		detail = artist_detail(artist, artist_timeline_from_rows(rows))
+
+	return render_template('pages/show_artist.html', artist_name=detail['name'], detail=detail['html'])
+
+
+async def _search(session, model, show_fk, template):
+	search_term = request.form.get('search_term', '')
+	page = request.form.get('page', 1, type=int)
+	per_page = app.config['SEARCH_PAGE_SIZE']
+	filters = parse_filters(request.form)
+	rows = (await session.execute(
+		search_statement(model, show_fk, search_term, page, per_page, filters=filters))).all()
+	results = search_results(rows, page, per_page)
+	if page == 1:
+		results['facets'] = facet_list(await session.execute(
+			search_facets_statement(model, show_fk, search_term, filters)))
+	return search_page(template, results, search_term, filters)
+
+
+async def search_venues(session):
+	return await _search(session, Venue, Show.venue_id, 'pages/search_venues.html')
+
+
+async def search_artists(session):
+	return await _search(session, Artist, Show.artist_id, 'pages/search_artists.html')
+
+
+# endpoint (as in app.url_map) -> async view
+ASYNC_VIEWS = {
+	'shows': shows,
+	'show_venue': show_venue,
+	'show_artist': show_artist,
+	'search_venues': search_venues,
+	'search_artists': search_artists,
+}
+
+
+#  ASGI application
+#  ----------------------------------------------------------------
+
+def build_environ(scope, body):
+	"""A WSGI environ for an ASGI HTTP scope (as asgiref's WsgiToAsgi does)."""
+	server = scope.get('server') or ('localhost', 80)
+	client = scope.get('client') or ('', 0)
+	environ = {
+		'REQUEST_METHOD': scope['method'],
+		'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+		'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+		'QUERY_STRING': scope['query_string'].decode('ascii'),
+		'SERVER_PROTOCOL': 'HTTP/%s' % scope['http_version'],
+		'SERVER_NAME': server[0],
+		'SERVER_PORT': str(server[1] or 80),
+		'REMOTE_ADDR': client[0],
+		'REMOTE_PORT': str(client[1]),
+		'wsgi.version': (1, 0),
+		'wsgi.url_scheme': scope.get('scheme', 'http'),
+		'wsgi.input': io.BytesIO(body),
+		'wsgi.errors': sys.stderr,
+		'wsgi.multithread': True,
+		'wsgi.multiprocess': True,
+		'wsgi.run_once': False,
+	}
+	for name, value in scope.get('headers', []):
+		name = name.decode('latin1')
+		value = value.decode('latin1')
+		if name == 'content-length':
+			key = 'CONTENT_LENGTH'
+		elif name == 'content-type':
+			key = 'CONTENT_TYPE'
+		else:
+			key = 'HTTP_' + name.upper().replace('-', '_')
+		if key in environ:
+			value = environ[key] + ',' + value
+		environ[key] = value
+	return environ
+
+
+async def read_body(receive):
+	body = []
+	while True:
+		message = await receive()
+		if message['type'] == 'http.disconnect':
+			break
+		body.append(message.get('body', b''))
+		if not message.get('more_body', False):
+			break
+	return b''.join(body)
+
+
+class AsyncReads(object):
+	"""Serves ASYNC_VIEWS itself and hands every other request to ``app``."""
+
+	def __init__(self, app):
+		self.app = app
+		self.wsgi = WsgiToAsgi(app)
+		# bind key (None: the primary) -> engine / session factory
+		self.engines = {}
+		self.session_factories = {}
+
+	def _sessions(self, bind):
+		if bind not in self.session_factories:
+			self.engines[bind] = create_engine(self.app.config, bind)
+			self.session_factories[bind] = sessionmaker(self.engines[bind], class_=AsyncSession,
+				expire_on_commit=False)
+		return self.session_factories[bind]
+
+	async def _run(self, view, bind):
+		async with self._sessions(bind)() as session:
+			return await view(session, **request.view_args)
+
+	async def _read(self, view):
+		router = self.app.extensions.get('replica_router')
+		bind = router.choose() if router is not None else None
+		if bind is None:
+			return await self._run(view, None)
+		try:
+			return await self._run(view, bind)
+		except OperationalError:
+			self.app.logger.warning('replica %s failed; reading from the primary', bind)
+			router.mark_down(bind)
+			return await self._run(view, None)
+
+	async def __call__(self, scope, receive, send):
+		if scope['type'] == 'lifespan':
+			return await self._lifespan(receive, send)
+		if scope['type'] != 'http':
+			raise ValueError('Unsupported ASGI scope type %r' % scope['type'])
+
+		view = None
+		adapter = self.app.url_map.bind('localhost', script_name=scope.get('root_path') or None)
+		try:
+			endpoint, _ = adapter.match(scope['path'], scope['method'])
+			view = ASYNC_VIEWS.get(endpoint)
+		except HTTPException:
+			pass
+		if view is None:
+			return await self.wsgi(scope, receive, send)
+
+		environ = build_environ(scope, await read_body(receive))
+		response = await self._dispatch(environ, view)
+		app_iter, status, headers = response.get_wsgi_response(environ)
+		await send({
+			'type': 'http.response.start',
+			'status': int(status.split(' ', 1)[0]),
+			'headers': [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers],
+		})
+		await send({'type': 'http.response.body', 'body': b''.join(app_iter)})
+
+	async def _dispatch(self, environ, view):
+		# Flask's full_dispatch_request, awaiting the view
+		app = self.app
+		with app.request_context(environ):
+			try:
+				try:
+					response = app.preprocess_request()
+					if response is None:
+						response = await self._read(view)
+				except Exception as e:
+					response = app.handle_user_exception(e)
+				return app.finalize_request(response)
+			except Exception as e:
+				return app.handle_exception(e)
+
+	async def _lifespan(self, receive, send):
+		while True:
+			message = await receive()
+			if message['type'] == 'lifespan.startup':
+				await send({'type': 'lifespan.startup.complete'})
+			elif message['type'] == 'lifespan.shutdown':
+				for engine in self.engines.values():
+					await engine.dispose()
+				await send({'type': 'lifespan.shutdown.complete'})
+				return
+
+
+application = AsyncReads(app)
@@ -0,0 +1,201 @@
+#----------------------------------------------------------------------------#
+# Throughput of the read endpoints under concurrent clients: the WSGI app
+# on a fixed pool of threads (like gunicorn --threads) against the async
+# views of asgi.py under uvicorn. One server process each, fed the same mix
+# of /shows, venue and artist pages and both searches.
+#
+#   python -m benchmarks.async_reads --database-url postgresql://... \
+#       [--concurrency 1 8 32 64] [--threads 8] [--seconds 10]
+#
+# The database is reseeded with benchmarks.seed first. The fragment cache is
+# off so that every detail page reaches the database. Point it at a remote
+# Postgres (or one with slow queries) to see what the async path is for:
+# under WSGI each waiting query holds one of the --threads threads.
+#----------------------------------------------------------------------------#
+import argparse
+import http.client
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from werkzeug.serving import BaseWSGIServer
+
+from benchmarks.seed import reset
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class PooledWSGIServer(BaseWSGIServer):
+	"""werkzeug's server handling requests on a fixed number of threads."""
+
+	def __init__(self, host, port, app, threads):
+		BaseWSGIServer.__init__(self, host, port, app)
+		self.pool = ThreadPoolExecutor(threads)
+
+	def process_request(self, request, client_address):
+		self.pool.submit(self._handle, request, client_address)
+
+	def _handle(self, request, client_address):
+		try:
+			self.finish_request(request, client_address)
+		except Exception:
+			self.handle_error(request, client_address)
+		finally:
+			self.shutdown_request(request)
+
+
+def serve_wsgi(port, threads):
+	from app import app
+	logging.getLogger('werkzeug').setLevel(logging.ERROR)
+	PooledWSGIServer('127.0.0.1', port, app, threads).serve_forever()
+
+
+ENDPOINTS = ('shows', 'show_venue', 'show_artist', 'search_venues', 'search_artists')
+
+
+def requests_mix(endpoints, venues, artists):
+	"""(method, path, form) tuples, round robin over ``endpoints``, random ids."""
+	rng = random.Random(1)
+	requests = {
+		'shows': lambda: ('GET', '/shows', None),
+		'show_venue': lambda: ('GET', '/venues/%d' % rng.randint(1, venues), None),
+		'show_artist': lambda: ('GET', '/artists/%d' % rng.randint(1, artists), None),
+		'search_venues': lambda: ('POST', '/venues/search',
+			{'search_term': rng.choice(['an', 'New', 'Jazz', 'park'])}),
+		'search_artists': lambda: ('POST', '/artists/search',
+			{'search_term': rng.choice(['the', 'Rock n Roll', 'Guns', 'a'])}),
+	}
+	while True:
+		for endpoint in endpoints:
+			yield requests[endpoint]()
+
+
+def free_port():
+	with socket.socket() as s:
+		s.bind(('127.0.0.1', 0))
+		return s.getsockname()[1]
+
+
+def start_server(kind, port, threads, env):
+	if kind == 'wsgi':
+		command = [sys.executable, '-m', 'benchmarks.async_reads', '--serve', str(port), '--threads', str(threads)]
+	else:
+		command = [sys.executable, '-m', 'uvicorn', 'asgi:application', '--port', str(port),
+			'--log-level', 'warning', '--no-access-log']
+	process = subprocess.Popen(command, cwd=ROOT, env=env)
+	deadline = time.time() + 30
+	while time.time() < deadline:
+		try:
+			connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+			connection.request('GET', '/shows?limit=1')
+			connection.getresponse().read()
+			connection.close()
+			return process
+		except OSError:
+			if process.poll() is not None:
+				break
+			time.sleep(0.2)
+	process.kill()
+	raise RuntimeError('%s server did not start' % kind)
+
+
+def load(port, concurrency, seconds, mix):
+	"""Run ``concurrency`` clients for ``seconds``; (latencies ms, errors)."""
+	lock = threading.Lock()
+	latencies = []
+	errors = [0]
+	deadline = time.perf_counter() + seconds
+
+	def client():
+		own = []
+		failed = 0
+		while time.perf_counter() < deadline:
+			with lock:
+				method, path, form = next(mix)
+			body = urlencode(form) if form else None
+			headers = {'Content-Type': 'application/x-www-form-urlencoded'} if form else {}
+			start = time.perf_counter()
+			try:
+				connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+				connection.request(method, path, body=body, headers=headers)
+				response = connection.getresponse()
+				response.read()
+				connection.close()
+				if response.status >= 500:
+					failed += 1
+			except OSError:
+				failed += 1
+			own.append((time.perf_counter() - start) * 1000)
+		with lock:
+			latencies.extend(own)
+			errors[0] += failed
+
+	workers = [threading.Thread(target=client) for _ in range(concurrency)]
+	for worker in workers:
+		worker.start()
+	for worker in workers:
+		worker.join()
+	return sorted(latencies), errors[0]
+
+
+def percentile(sorted_values, fraction):
+	index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+	return sorted_values[index]
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--database-url')
+	parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 64])
+	parser.add_argument('--endpoint', choices=ENDPOINTS, action='append',
+		help='Endpoints in the mix (repeatable; all by default).')
+	parser.add_argument('--threads', type=int, default=8, help='Threads of the WSGI server.')
+	parser.add_argument('--seconds', type=float, default=10)
+	parser.add_argument('--venues', type=int, default=200)
+	parser.add_argument('--artists', type=int, default=500)
+	parser.add_argument('--shows', type=int, default=20000)
+	parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.serve:
+		return serve_wsgi(args.serve, args.threads)
+	if not args.database_url:
+		parser.error('--database-url is required')
+
+	env = dict(os.environ,
+		FYYUR_DATABASE_URL=args.database_url,
+		FYYUR_CACHE_BACKEND='null',
+		FYYUR_SQL_REQUEST_LOG='0',
+		FYYUR_SLOW_QUERY_EXPLAIN='0')
+	os.environ.update(env)
+	from app import app
+	app.config['SQLALCHEMY_DATABASE_URI'] = args.database_url
+	with app.app_context():
+		reset(venues=args.venues, artists=args.artists, shows=args.shows)
+
+	print('%-5s %11s %9s %9s %9s %7s' % ('path', 'concurrency', 'req/s', 'p50 ms', 'p95 ms', 'errors'))
+	for kind in ('wsgi', 'asgi'):
+		port = free_port()
+		server = start_server(kind, port, args.threads, env)
+		try:
+			for concurrency in args.concurrency:
+				mix = requests_mix(args.endpoint or ENDPOINTS, args.venues, args.artists)
+				load(port, concurrency, min(args.seconds, 1), mix)
+				latencies, errors = load(port, concurrency, args.seconds, mix)
+				print('%-5s %11d %9.1f %9.2f %9.2f %7d' % (
+					kind, concurrency, len(latencies) / args.seconds,
+					percentile(latencies, 0.5), percentile(latencies, 0.95), errors))
+		finally:
+			server.terminate()
+			server.wait()
+
+
+if __name__ == '__main__':
+	main()
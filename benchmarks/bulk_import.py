@@ -0,0 +1,58 @@
+#----------------------------------------------------------------------------#
+# Throughput of the bulk importer: writes a CSV of generated shows (with a
+# sprinkling of bad rows) and loads it through importer.import_rows.
+#
+#   python -m benchmarks.bulk_import --database-url postgresql://.../fyyur_bench --rows 200000
+#
+# The target database is dropped and reseeded.
+#----------------------------------------------------------------------------#
+import argparse
+import csv
+import io
+import random
+import time
+from datetime import datetime, timedelta
+
+from app import app
+from importer import import_rows, read_rows
+from benchmarks.seed import reset
+
+
+def show_csv(rows, venues, artists, seed=1):
+	rng = random.Random(seed)
+	start = datetime(2027, 1, 1, 18, 0)
+	out = io.StringIO()
+	writer = csv.writer(out)
+	writer.writerow(['venue_id', 'artist_id', 'start_time', 'duration_minutes'])
+	for i in range(rows):
+		# one row in a thousand points at a venue that does not exist
+		venue_id = venues + 1 if i % 1000 == 999 else rng.randint(1, venues)
+		# half-hour shows back to back, so none overlap
+		writer.writerow([venue_id, rng.randint(1, artists),
+			(start + timedelta(minutes=30 * i)).strftime('%Y-%m-%d %H:%M:%S'), 30])
+	out.seek(0)
+	return out
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--database-url', required=True)
+	parser.add_argument('--rows', type=int, default=200000)
+	parser.add_argument('--batch-size', type=int, default=5000)
+	args = parser.parse_args()
+
+	app.config['SQLALCHEMY_DATABASE_URI'] = args.database_url
+	with app.app_context():
+		reset(venues=1000, artists=1000, shows=0)
+		source = show_csv(args.rows, 1000, 1000)
+		rejected = []
+		start = time.perf_counter()
+		stats = import_rows('shows', read_rows(source, 'csv'),
+			lambda line, row, errors: rejected.append(line), args.batch_size)
+		seconds = time.perf_counter() - start
+		print('%d inserted, %d rejected in %.2fs: %d rows/s' % (
+			stats['inserted'], stats['rejected'], seconds, args.rows / seconds))
+
+
+if __name__ == '__main__':
+	main()
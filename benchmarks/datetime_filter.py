@@ -0,0 +1,61 @@
+#----------------------------------------------------------------------------#
+# Micro-benchmark of the jinja `datetime` filter: the old strftime ->
+# dateutil -> babel.dates.format_datetime round trip against the current
+# filter with precompiled patterns and the LRU memo, cold and warm.
+#
+#   python -m benchmarks.datetime_filter
+#----------------------------------------------------------------------------#
+import argparse
+import timeit
+from datetime import datetime, timedelta
+
+import babel.dates
+import dateutil.parser
+
+from app import format_datetime, _format_datetime
+
+
+def old_format_datetime(value, format='medium'):
+	date = dateutil.parser.parse(value)
+	if format == 'full':
+		format = "EEEE MMMM, d, y 'at' h:mma"
+	elif format == 'medium':
+		format = "EE MM, dd, y h:mma"
+	else:
+		format = "EEEE MMMM, d, y 'at' h:mma"
+	return babel.dates.format_datetime(date, format, locale='en')
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--shows', type=int, default=500, help='start times on one page')
+	parser.add_argument('--renders', type=int, default=20)
+	args = parser.parse_args()
+
+	start = datetime(2026, 1, 1, 20, 0)
+	times = [start + timedelta(hours=7 * i) for i in range(args.shows)]
+	strings = [t.strftime('%Y-%m-%d %H:%M:%S') for t in times]
+
+	def old():
+		for value in strings:
+			old_format_datetime(value, 'full')
+
+	def cold():
+		_format_datetime.cache_clear()
+		for value in times:
+			format_datetime(value, 'full')
+
+	def warm():
+		for value in times:
+			format_datetime(value, 'full')
+
+	print('%d start times per render, %d renders' % (args.shows, args.renders))
+	for name, render in (('old', old), ('cold cache', cold), ('warm cache', warm)):
+		render()
+		seconds = min(timeit.repeat(render, number=args.renders, repeat=3)) / args.renders
+		print('%-12s %10.3f ms/render %8.2f us/value' % (
+			name, seconds * 1000, seconds * 1e6 / args.shows))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,89 @@
+#----------------------------------------------------------------------------#
+# Rows fetched and latency of the list/detail queries with the old
+# lazy='joined' relationships versus the per-query loading strategies.
+#
+#   python -m benchmarks.eager_loading --database-url postgresql://.../fyyur_bench
+#
+# The target database is dropped and reseeded.
+#----------------------------------------------------------------------------#
+import argparse
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload, selectinload
+
+from app import app
+from models import db, Venue, Artist, Show
+from benchmarks.seed import reset
+
+# (label, before, after): each side returns a query ready to run
+CASES = [
+	('/venues',
+		lambda: Venue.query.options(joinedload(Venue.shows)),
+		lambda: Venue.query),
+	('/artists',
+		lambda: Artist.query.options(joinedload(Artist.shows)),
+		lambda: Artist.query),
+	('/venues/<busiest>',
+		lambda: Venue.query.options(
+			joinedload(Venue.shows).joinedload(Show.artist).joinedload(Artist.shows)
+		).filter(Venue.id == 1),
+		lambda: Venue.query.options(
+			selectinload(Venue.shows).joinedload(Show.artist)
+		).filter(Venue.id == 1)),
+]
+
+
+class RowCounter(object):
+	def __init__(self):
+		self.queries = 0
+		self.rows = 0
+
+	def __call__(self, conn, cursor, statement, parameters, context, executemany):
+		self.queries += 1
+		# psycopg2 reports the result size of a SELECT; sqlite reports -1
+		self.rows += max(cursor.rowcount, 0)
+
+
+def measure(make_query, repeat):
+	counter = RowCounter()
+	timings = []
+	event.listen(db.engine, 'after_cursor_execute', counter)
+	try:
+		for _ in range(repeat):
+			db.session.expunge_all()
+			start = time.perf_counter()
+			make_query().all()
+			timings.append(time.perf_counter() - start)
+	finally:
+		event.remove(db.engine, 'after_cursor_execute', counter)
+	timings.sort()
+	return {
+		'queries': counter.queries // repeat,
+		'rows': counter.rows // repeat,
+		'median_ms': timings[len(timings) // 2] * 1000,
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('--database-url', required=True)
+	parser.add_argument('--venues', type=int, default=200)
+	parser.add_argument('--artists', type=int, default=500)
+	parser.add_argument('--shows', type=int, default=20000)
+	parser.add_argument('--repeat', type=int, default=5)
+	args = parser.parse_args()
+
+	app.config['SQLALCHEMY_DATABASE_URI'] = args.database_url
+	with app.app_context():
+		reset(venues=args.venues, artists=args.artists, shows=args.shows)
+		print('%-20s %-9s %8s %10s %10s' % ('query', 'loading', 'queries', 'rows', 'median ms'))
+		for label, before, after in CASES:
+			for name, make_query in (('joined', before), ('per-query', after)):
+				result = measure(make_query, args.repeat)
+				print('%-20s %-9s %8d %10d %10.2f' % (
+					label, name, result['queries'], result['rows'], result['median_ms']))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,55 @@
+#----------------------------------------------------------------------------#
+# Cost of the /metrics instrumentation on the request path: one histogram
+# observation, and each of the before/after request hooks RequestMetrics
+# adds (the after hook records six metrics), with the in-memory store and
+# the mmap'd multi-process store.
+#
+#   python -m benchmarks.metrics_overhead
+#----------------------------------------------------------------------------#
+import argparse
+import tempfile
+import timeit
+
+from flask import Response, request
+
+from app import app, app_metrics
+from metrics import STORES, DictStore, MmapStore, LATENCY
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--number', type=int, default=100000)
+	args = parser.parse_args()
+
+	response = Response('x' * 1000)
+	print('%-8s %-22s %10s' % ('store', 'operation', 'us/call'))
+	with tempfile.TemporaryDirectory() as directory:
+		for name, values, live in (
+				('memory', DictStore(), DictStore()),
+				('mmap', MmapStore(directory, 'values'), MmapStore(directory, 'live'))):
+			STORES['values'], STORES['live'] = values, live
+
+			def observe():
+				LATENCY.observe(('show_venue',), 0.042)
+
+			with app.test_request_context('/venues/1'):
+				app.preprocess_request()
+				req = request._get_current_object()
+
+				def before():
+					app_metrics._start()
+
+				def after():
+					# includes setting the start time back on the request
+					req.metrics_started = 0.0
+					app_metrics._finish(response)
+
+				for operation, run in (('histogram observe', observe), ('before_request hook', before),
+						('after_request hook', after)):
+					run()
+					seconds = min(timeit.repeat(run, number=args.number, repeat=3)) / args.number
+					print('%-8s %-22s %10.2f' % (name, operation, seconds * 1e6))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,116 @@
+#----------------------------------------------------------------------------#
+# Query-plan regression check: every statement that reads the show table on
+# the detail and search pages must go through an index.
+#
+#   python -m benchmarks.query_plans --database-url postgresql://.../fyyur_bench
+#
+# Exits 1 and prints the offending plans when a statement scans show. The
+# target database is dropped and reseeded. tests/test_query_plans.py runs
+# the same check on the test database.
+#----------------------------------------------------------------------------#
+import argparse
+import re
+import sys
+
+from sqlalchemy import event, text
+
+from app import app
+from models import db, Venue, Artist
+from benchmarks.seed import reset
+
+# a mid-popularity venue and artist: the busiest ones legitimately scan
+ENTITY_ID = 50
+
+SHOW_TABLE = re.compile(r'\bshow\b')
+
+
+def capture(client, method, url, data=None):
+	statements = []
+
+	def record(conn, cursor, statement, parameters, context, executemany):
+		statements.append((statement, parameters))
+
+	event.listen(db.engine, 'before_cursor_execute', record)
+	try:
+		response = client.open(url, method=method, data=data)
+	finally:
+		event.remove(db.engine, 'before_cursor_execute', record)
+	assert response.status_code == 200, (url, response.status_code)
+	return [(s, p) for s, p in statements if SHOW_TABLE.search(s)]
+
+
+def explain(statement, parameters):
+	connection = db.engine.raw_connection()
+	try:
+		cursor = connection.cursor()
+		if db.engine.dialect.name == 'sqlite':
+			cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+			return '\n'.join(row[-1] for row in cursor.fetchall())
+		cursor.execute('EXPLAIN ' + statement, parameters)
+		return '\n'.join(row[0] for row in cursor.fetchall())
+	finally:
+		connection.close()
+
+
+def scans_show(plan):
+	if db.engine.dialect.name == 'sqlite':
+		return re.search(r'^SCAN show\b(?! USING)', plan, re.M) is not None
+	return re.search(r'Seq Scan on show\b', plan) is not None
+
+
+def pages():
+	"""(name, method, url, form) of the pages checked, for ENTITY_ID."""
+	venue_name = db.session.get(Venue, ENTITY_ID).name
+	artist_name = db.session.get(Artist, ENTITY_ID).name
+	db.session.remove()
+	return [
+		('show_venue', 'GET', '/venues/%d' % ENTITY_ID, None),
+		('show_artist', 'GET', '/artists/%d' % ENTITY_ID, None),
+		('search_venues', 'POST', '/venues/search', {'search_term': venue_name}),
+		('search_artists', 'POST', '/artists/search', {'search_term': artist_name}),
+	]
+
+
+def check(client, method, url, data=None):
+	"""[(statement, plan)] of the page's statements that scan show; None when none reads it."""
+	statements = capture(client, method, url, data)
+	if not statements:
+		return None
+	plans = [(statement, explain(statement, parameters)) for statement, parameters in statements]
+	return [(statement, plan) for statement, plan in plans if scans_show(plan)]
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--database-url', required=True)
+	parser.add_argument('--venues', type=int, default=2000)
+	parser.add_argument('--artists', type=int, default=5000)
+	parser.add_argument('--shows', type=int, default=200000)
+	args = parser.parse_args()
+
+	app.config['SQLALCHEMY_DATABASE_URI'] = args.database_url
+	app.config['WTF_CSRF_ENABLED'] = False
+	with app.app_context():
+		reset(venues=args.venues, artists=args.artists, shows=args.shows)
+		if db.engine.dialect.name == 'postgresql':
+			db.session.execute(text('ANALYZE'))
+			db.session.commit()
+
+		client = app.test_client()
+		failures = 0
+		for name, method, url, data in pages():
+			scans = check(client, method, url, data)
+			if scans is None:
+				print('%-16s no statement reads show' % name)
+				failures += 1
+				continue
+			for statement, plan in scans:
+				failures += 1
+				print('%-16s SCAN\n%s\n%s\n' % (name, statement, plan))
+			if not scans:
+				print('%-16s index' % name)
+	sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+	main()
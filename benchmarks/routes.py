@@ -0,0 +1,307 @@
+#----------------------------------------------------------------------------#
+# Latency, queries and memory of every route, against JSON baselines.
+#
+#   python -m benchmarks.routes --database-url sqlite:////tmp/fyyur_bench.db \
+#       --baseline benchmarks/baselines/routes.json [--client wsgi]
+#
+# The target database is dropped and reseeded with benchmarks.seed (same
+# counts and seed, same data). Each case runs through the Flask test client
+# or, with --client wsgi, over HTTP against a threaded werkzeug server in
+# this process. Queries per request are read back from the Server-Timing
+# header (sqltiming.py); peak memory per request comes from a separate,
+# traced pass.
+#
+# --baseline compares the run with a saved one and exits 1 on a
+# regression: a median more than --tolerance slower (and by more than
+# --min-delta-ms), more queries, a memory peak beyond the tolerance, or a
+# different status. The tails (p95/p99) are reported but too noisy on
+# shared machines to gate on. When the file does not exist yet, or with --update-baseline,
+# the run is saved there instead. Every URL rule must have a case below;
+# a new route without one fails the run.
+#----------------------------------------------------------------------------#
+import argparse
+import gc
+import http.client
+import json
+import logging
+import os
+import platform
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+from urllib.parse import urlencode
+
+from werkzeug.serving import make_server
+
+from app import app, page_cache
+from sqltiming import request_log
+from benchmarks.seed import reset
+
+QUERIES = re.compile(r'db;dur=[\d.]+;desc="(\d+) queries"')
+
+VENUE_FORM = {
+	'name': 'Bench Hall', 'city': 'Austin', 'state': 'TX', 'address': '1 Bench St',
+	'phone': '512-555-0100', 'image_link': 'https://images.example.com/bench.jpg',
+	'genres': ['Jazz', 'Blues'], 'facebook_link': 'https://www.facebook.com/bench',
+	'website_link': 'https://bench.example.com', 'seeking_talent': 'y',
+	'seeking_description': 'Benchmarks welcome.',
+}
+ARTIST_FORM = dict(VENUE_FORM, name='The Benchmarks', seeking_venue='y')
+del ARTIST_FORM['address'], ARTIST_FORM['seeking_talent']
+
+
+class Case(object):
+	"""One request; ``path`` and ``data`` may be functions of the iteration number.
+
+	``before`` runs, untimed, ahead of every request of the case.
+	"""
+
+	def __init__(self, name, endpoint, method, path, data=None, before=None):
+		self.name = name
+		self.endpoint = endpoint
+		self.method = method
+		self.path = path
+		self.data = data
+		self.before = before
+
+	def url(self, i):
+		return self.path(i) if callable(self.path) else self.path
+
+	def form(self, i):
+		return self.data(i) if callable(self.data) else self.data
+
+
+def cases(venues, artists):
+	# venue / artist 1 are the busiest (Zipf), the last ones the quietest
+	quiet_venue, quiet_artist = venues, artists
+	week = '/shows?from=%s&to=%s' % (date.today(), date.today() + timedelta(days=6))
+	return [
+		Case('home', 'index', 'GET', '/'),
+		Case('venues', 'venues', 'GET', '/venues'),
+		Case('venues page 2', 'venues', 'GET', '/venues?limit=200'),
+		Case('search venues', 'search_venues', 'POST', '/venues/search', {'search_term': 'blue'}),
+		Case('venues near', 'venues_near_page', 'GET', '/venues/near?lat=37.7749&lng=-122.4194&radius_km=10'),
+		Case('venue busiest', 'show_venue', 'GET', '/venues/1'),
+		Case('venue busiest uncached', 'show_venue', 'GET', '/venues/1',
+			before=lambda: page_cache.delete('venue:1')),
+		Case('venue quiet', 'show_venue', 'GET', '/venues/%d' % quiet_venue),
+		Case('venue create form', 'create_venue_form', 'GET', '/venues/create'),
+		Case('venue edit form', 'edit_venue', 'GET', '/venues/1/edit'),
+		Case('artists', 'artists', 'GET', '/artists'),
+		Case('search artists', 'search_artists', 'POST', '/artists/search', {'search_term': 'moon'}),
+		Case('artist busiest', 'show_artist', 'GET', '/artists/1'),
+		Case('artist busiest uncached', 'show_artist', 'GET', '/artists/1',
+			before=lambda: page_cache.delete('artist:1')),
+		Case('artist quiet', 'show_artist', 'GET', '/artists/%d' % quiet_artist),
+		Case('artist create form', 'create_artist_form', 'GET', '/artists/create'),
+		Case('artist edit form', 'edit_artist', 'GET', '/artists/1/edit'),
+		Case('shows', 'shows', 'GET', '/shows'),
+		Case('shows calendar week', 'shows', 'GET', week + '&city=Austin&genre=Jazz'),
+		Case('show create form', 'create_shows', 'GET', '/shows/create'),
+		Case('api venues', 'api.venues', 'GET', '/api/v1/venues'),
+		Case('api artists', 'api.artists', 'GET', '/api/v1/artists?fields=id,name'),
+		Case('api shows', 'api.shows', 'GET', '/api/v1/shows'),
+		Case('api shows calendar week', 'api.shows', 'GET', '/api/v1' + week),
+		Case('api shows ndjson', 'api.shows', 'GET', '/api/v1/shows?format=ndjson'),
+		Case('api venues near', 'api.near_venues', 'GET',
+			'/api/v1/venues/near?bbox=-74.05,40.65,-73.9,40.8'),
+		Case('api search venues', 'api.search_venues', 'GET', '/api/v1/venues/search?search_term=blue'),
+		Case('api search artists', 'api.search_artists', 'GET', '/api/v1/artists/search?search_term=moon'),
+		Case('api import (disabled)', 'api.bulk_import', 'POST', '/api/v1/import/shows'),
+		Case('metrics', 'metrics.expose', 'GET', '/metrics'),
+		Case('static', 'static', 'GET', '/static/css/main.css'),
+		# writes last; the deletes take venues from the quiet end
+		Case('venue create', 'create_venue_submission', 'POST', '/venues/create', VENUE_FORM),
+		Case('venue edit', 'edit_venue_submission', 'POST', '/venues/2/edit', VENUE_FORM),
+		Case('artist create', 'create_artist_submission', 'POST', '/artists/create', ARTIST_FORM),
+		Case('artist edit', 'edit_artist_submission', 'POST', '/artists/2/edit', ARTIST_FORM),
+		# a day apart, so the venue and artist are free every time
+		Case('show create', 'create_show_submission', 'POST', '/shows/create',
+			lambda i: {'venue_id': '3', 'artist_id': '3',
+				'start_time': str(datetime(2030, 1, 1, 20) + timedelta(days=i))}),
+		Case('venue delete', 'delete_venue', 'DELETE', lambda i: '/venues/%d' % (quiet_venue - 1 - i)),
+	]
+
+
+def uncovered(case_list):
+	covered = {case.endpoint for case in case_list}
+	return sorted({rule.endpoint for rule in app.url_map.iter_rules()} - covered)
+
+
+class TestClientRunner(object):
+	def __init__(self):
+		self.client = app.test_client()
+
+	def __call__(self, case, i):
+		response = self.client.open(case.url(i), method=case.method, data=case.form(i))
+		response.get_data()
+		return response.status_code, response.headers.get('Server-Timing', '')
+
+	def close(self):
+		pass
+
+
+class WSGIRunner(object):
+	def __init__(self):
+		# no access log line per request
+		logging.getLogger('werkzeug').setLevel(logging.ERROR)
+		self.server = make_server('127.0.0.1', 0, app, threaded=True)
+		self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+		self.thread.start()
+
+	def __call__(self, case, i):
+		connection = http.client.HTTPConnection('127.0.0.1', self.server.server_port)
+		body = headers = None
+		if case.data is not None:
+			body = urlencode(case.form(i), doseq=True)
+			headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+		connection.request(case.method, case.url(i), body=body, headers=headers or {})
+		response = connection.getresponse()
+		response.read()
+		connection.close()
+		return response.status, response.getheader('Server-Timing', '')
+
+	def close(self):
+		self.server.shutdown()
+
+
+def percentile(sorted_values, fraction):
+	index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+	return sorted_values[index]
+
+
+def measure(run, case, iterations, warmup, memory_iterations):
+	before = case.before or (lambda: None)
+	# garbage from earlier cases is not this one's to collect
+	gc.collect()
+	for i in range(warmup):
+		before()
+		run(case, i)
+	timings = []
+	queries = []
+	statuses = set()
+	for i in range(warmup, warmup + iterations):
+		before()
+		start = time.perf_counter()
+		status, server_timing = run(case, i)
+		timings.append((time.perf_counter() - start) * 1000)
+		statuses.add(status)
+		match = QUERIES.search(server_timing)
+		if match:
+			queries.append(int(match.group(1)))
+	peaks = []
+	for i in range(warmup + iterations, warmup + iterations + memory_iterations):
+		before()
+		tracemalloc.start()
+		run(case, i)
+		peaks.append(tracemalloc.get_traced_memory()[1])
+		tracemalloc.stop()
+	timings.sort()
+	return {
+		'status': sorted(statuses),
+		'p50_ms': round(percentile(timings, .50), 3),
+		'p95_ms': round(percentile(timings, .95), 3),
+		'p99_ms': round(percentile(timings, .99), 3),
+		'mean_ms': round(sum(timings) / len(timings), 3),
+		# the most any one request issued; cache hits bring the median down
+		'queries': max(queries) if queries else None,
+		'peak_kib': round(min(peaks) / 1024, 1) if peaks else None,
+	}
+
+
+def regressions(results, baseline, tolerance, min_delta_ms):
+	found = []
+	for name, now in results['routes'].items():
+		before = baseline['routes'].get(name)
+		if before is None:
+			continue
+		if now['p50_ms'] > before['p50_ms'] * (1 + tolerance) and \
+				now['p50_ms'] - before['p50_ms'] > min_delta_ms:
+			found.append('%s: p50 %.2fms, was %.2fms' % (name, now['p50_ms'], before['p50_ms']))
+		if now['queries'] is not None and before['queries'] is not None and \
+				now['queries'] > before['queries']:
+			found.append('%s: %d queries per request, was %d' % (name, now['queries'], before['queries']))
+		if now['peak_kib'] and before['peak_kib'] and now['peak_kib'] > before['peak_kib'] * (1 + tolerance):
+			found.append('%s: peak %.1f KiB, was %.1f KiB' % (name, now['peak_kib'], before['peak_kib']))
+		if now['status'] != before['status']:
+			found.append('%s: status %s, was %s' % (name, now['status'], before['status']))
+	return found
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--database-url', required=True)
+	parser.add_argument('--client', choices=['test', 'wsgi'], default='test')
+	parser.add_argument('--venues', type=int, default=200)
+	parser.add_argument('--artists', type=int, default=500)
+	parser.add_argument('--shows', type=int, default=20000)
+	parser.add_argument('--seed', type=int, default=1)
+	parser.add_argument('--iterations', type=int, default=50)
+	parser.add_argument('--warmup', type=int, default=5)
+	parser.add_argument('--memory-iterations', type=int, default=3)
+	parser.add_argument('--only', help='Run the cases whose name contains this.')
+	parser.add_argument('--baseline', help='JSON baseline to compare with (saved there if missing).')
+	parser.add_argument('--update-baseline', action='store_true')
+	parser.add_argument('--tolerance', type=float, default=0.5)
+	parser.add_argument('--min-delta-ms', type=float, default=1.0)
+	args = parser.parse_args()
+
+	case_list = cases(args.venues, args.artists)
+	missing = uncovered(case_list)
+	if missing:
+		print('routes without a benchmark case: %s' % ', '.join(missing))
+		sys.exit(1)
+	per_case = args.warmup + args.iterations + args.memory_iterations
+	if per_case >= args.venues - 1:
+		parser.error('--venues must exceed warmup + iterations + memory iterations (venue deletes)')
+	if args.only:
+		case_list = [case for case in case_list if args.only in case.name]
+
+	app.config['SQLALCHEMY_DATABASE_URI'] = args.database_url
+	# one log line per request would swamp the table
+	request_log.setLevel(logging.WARNING)
+	with app.app_context():
+		counts = reset(venues=args.venues, artists=args.artists, shows=args.shows, seed=args.seed)
+
+	results = {
+		'meta': dict(counts, seed=args.seed, client=args.client, iterations=args.iterations,
+			dialect=args.database_url.split(':', 1)[0], python=platform.python_version()),
+		'routes': {},
+	}
+	run = WSGIRunner() if args.client == 'wsgi' else TestClientRunner()
+	print('%-24s %-7s %8s %8s %8s %8s %9s' % ('case', 'status', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'peak KiB'))
+	try:
+		for case in case_list:
+			result = measure(run, case, args.iterations, args.warmup, args.memory_iterations)
+			results['routes'][case.name] = result
+			print('%-24s %-7s %8.2f %8.2f %8.2f %8s %9s' % (
+				case.name, ','.join(map(str, result['status'])), result['p50_ms'], result['p95_ms'],
+				result['p99_ms'], result['queries'], result['peak_kib']))
+	finally:
+		run.close()
+
+	if not args.baseline:
+		return
+	if args.update_baseline or not os.path.exists(args.baseline):
+		os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+		with open(args.baseline, 'w') as f:
+			json.dump(results, f, indent=2, sort_keys=True)
+		print('baseline saved to %s' % args.baseline)
+		return
+	with open(args.baseline) as f:
+		baseline = json.load(f)
+	if baseline['meta'] != results['meta']:
+		print('warning: baseline was recorded with %s' % baseline['meta'])
+	found = regressions(results, baseline, args.tolerance, args.min_delta_ms)
+	for line in found:
+		print('REGRESSION %s' % line)
+	if found:
+		sys.exit(1)
+	print('no regressions against %s' % args.baseline)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,64 @@
+#----------------------------------------------------------------------------#
+# Venue search latency with the search indexes (pg_trgm GIN on PostgreSQL,
+# FTS5 on SQLite) against the unindexed ILIKE scan, at several table sizes.
+#
+#   python -m benchmarks.search --database-url postgresql://.../fyyur_bench
+#   python -m benchmarks.search --database-url sqlite:////tmp/bench.db --sizes 10000 100000
+#
+# The target database is dropped and reseeded for every size.
+#----------------------------------------------------------------------------#
+import argparse
+import time
+
+from sqlalchemy import text
+
+from app import app
+from models import db, Venue, Show
+from search import search_with_upcoming_counts
+from benchmarks.seed import reset
+
+TERMS = ['blue', 'Velvet Moon', 'san fran', 'jazz', '12345']
+
+
+def measure(term, backend, repeat):
+	timings = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		search_with_upcoming_counts(Venue, Show.venue_id, term, 1, 20, backend=backend)
+		timings.append(time.perf_counter() - start)
+	timings.sort()
+	return timings[len(timings) // 2] * 1000
+
+
+def drop_search_indexes():
+	for index in ('ix_venue_name_trgm', 'ix_venue_city_trgm'):
+		db.session.execute(text('DROP INDEX IF EXISTS %s' % index))
+	db.session.commit()
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--database-url', required=True)
+	parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+	parser.add_argument('--repeat', type=int, default=5)
+	args = parser.parse_args()
+
+	app.config['SQLALCHEMY_DATABASE_URI'] = args.database_url
+	with app.app_context():
+		dialect = db.engine.dialect.name
+		print('%10s %-14s %12s %12s' % ('venues', 'term', 'indexed ms', 'scan ms'))
+		for size in args.sizes:
+			# no shows: time the name/city match, not the upcoming counts
+			reset(venues=size, artists=10, shows=0)
+			if dialect == 'postgresql':
+				db.session.execute(text('ANALYZE'))
+			indexed = {term: measure(term, None, args.repeat) for term in TERMS}
+			if dialect == 'postgresql':
+				drop_search_indexes()
+			for term in TERMS:
+				print('%10d %-14s %12.2f %12.2f' % (
+					size, term, indexed[term], measure(term, 'like', args.repeat)))
+
+
+if __name__ == '__main__':
+	main()
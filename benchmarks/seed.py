@@ -0,0 +1,169 @@
+#----------------------------------------------------------------------------#
+# Deterministic data generator for benchmarks.
+#
+# Show popularity is skewed (Zipf-like) so a handful of venues and artists
+# carry most of the shows, as on the real site.
+#----------------------------------------------------------------------------#
+import random
+from datetime import datetime, timedelta
+from itertools import accumulate, islice
+
+from sqlalchemy import text
+
+from models import db, Venue, Artist, Show
+from counters import recount_all
+from geo import geohash
+from partitions import add_months, ensure, is_partitioned, month_start
+
+GENRES = [
+	'Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk',
+	'Funk', 'Hip-Hop', 'Heavy Metal', 'Instrumental', 'Jazz',
+	'Musical Theatre', 'Pop', 'Punk', 'R&B', 'Reggae', 'Rock n Roll',
+	'Soul', 'Other',
+]
+AREAS = [
+	('San Francisco', 'CA'), ('Los Angeles', 'CA'), ('New York', 'NY'),
+	('Brooklyn', 'NY'), ('Austin', 'TX'), ('Chicago', 'IL'),
+	('Seattle', 'WA'), ('Nashville', 'TN'), ('New Orleans', 'LA'),
+	('Denver', 'CO'),
+]
+# city centres; venues are scattered up to ~30 km around them
+AREA_CENTRES = {
+	('San Francisco', 'CA'): (37.7749, -122.4194), ('Los Angeles', 'CA'): (34.0522, -118.2437),
+	('New York', 'NY'): (40.7128, -74.0060), ('Brooklyn', 'NY'): (40.6782, -73.9442),
+	('Austin', 'TX'): (30.2672, -97.7431), ('Chicago', 'IL'): (41.8781, -87.6298),
+	('Seattle', 'WA'): (47.6062, -122.3321), ('Nashville', 'TN'): (36.1627, -86.7816),
+	('New Orleans', 'LA'): (29.9511, -90.0715), ('Denver', 'CO'): (39.7392, -104.9903),
+}
+AREA_SPREAD = 0.3
+WORDS = [
+	'Blue', 'Red', 'Golden', 'Velvet', 'Electric', 'Midnight', 'Silver',
+	'Wild', 'Lucky', 'Crystal', 'Hidden', 'Neon', 'Iron', 'Paper',
+	'Moon', 'Fox', 'Owl', 'River', 'Garden', 'Lounge', 'Hall', 'Room',
+	'Band', 'Collective', 'Quartet', 'Project',
+]
+
+BATCH_SIZE = 5000
+
+SHOW_MINUTES = (60, 90, 120, 150, 180)
+
+
+def _name(rng, i):
+	return '%s %s %s' % (rng.choice(WORDS), rng.choice(WORDS), i)
+
+
+def _skewed_weights(n, s=1.1):
+	return list(accumulate(1.0 / (rank ** s) for rank in range(1, n + 1)))
+
+
+def _insert(table, rows):
+	# rows is a generator, so a million-row table never sits in memory
+	while True:
+		batch = list(islice(rows, BATCH_SIZE))
+		if not batch:
+			break
+		db.session.execute(table.insert(), batch)
+
+
+def venue_rows(rng, count):
+	# positions from their own generator, so the rest of the data stays as it was
+	scatter = random.Random(count)
+	for i in range(1, count + 1):
+		city, state = rng.choice(AREAS)
+		centre_lat, centre_lng = AREA_CENTRES[city, state]
+		latitude = round(centre_lat + scatter.uniform(-AREA_SPREAD, AREA_SPREAD), 6)
+		longitude = round(centre_lng + scatter.uniform(-AREA_SPREAD, AREA_SPREAD), 6)
+		yield {
+			'id': i,
+			'name': _name(rng, i),
+			'genres': rng.sample(GENRES, rng.randint(1, 3)),
+			'address': '%d %s St' % (rng.randint(1, 9999), rng.choice(WORDS)),
+			'city': city,
+			'state': state,
+			'phone': '%03d-%03d-%04d' % (rng.randint(200, 999), rng.randint(0, 999), rng.randint(0, 9999)),
+			'image_link': 'https://images.example.com/venue/%d.jpg' % i,
+			'facebook_link': 'https://www.facebook.com/venue%d' % i,
+			'website_link': 'https://venue%d.example.com' % i,
+			'seeking_talent': rng.random() < 0.3,
+			'seeking_description': 'Looking for local acts.',
+			'latitude': latitude,
+			'longitude': longitude,
+			'geohash': geohash(latitude, longitude),
+		}
+
+
+def artist_rows(rng, count):
+	for i in range(1, count + 1):
+		city, state = rng.choice(AREAS)
+		yield {
+			'id': i,
+			'name': _name(rng, i),
+			'genres': rng.sample(GENRES, rng.randint(1, 3)),
+			'city': city,
+			'state': state,
+			'phone': '%03d-%03d-%04d' % (rng.randint(200, 999), rng.randint(0, 999), rng.randint(0, 9999)),
+			'image_link': 'https://images.example.com/artist/%d.jpg' % i,
+			'facebook_link': 'https://www.facebook.com/artist%d' % i,
+			'website_link': 'https://artist%d.example.com' % i,
+			'seeking_venue': rng.random() < 0.3,
+			'seeking_description': 'Looking for places to play.',
+		}
+
+
+def show_rows(rng, count, venues, artists, now):
+	venue_ids = range(1, venues + 1)
+	artist_ids = range(1, artists + 1)
+	venue_weights = _skewed_weights(venues)
+	artist_weights = _skewed_weights(artists)
+	# shows start on the hour; a venue or artist booked for an hour is
+	# redrawn (bookings.py), so the busiest ones fill up rather than overlap
+	booked = set()
+	for i in range(1, count + 1):
+		while True:
+			venue_id = rng.choices(venue_ids, cum_weights=venue_weights)[0]
+			artist_id = rng.choices(artist_ids, cum_weights=artist_weights)[0]
+			# two years back, one year ahead
+			hour = rng.randint(-2 * 365 * 24, 365 * 24)
+			duration = rng.choice(SHOW_MINUTES)
+			hours = range(hour, hour + -(-duration // 60))
+			slots = [(booking, id, h) for booking, id in (('venue', venue_id), ('artist', artist_id)) for h in hours]
+			if booked.isdisjoint(slots):
+				break
+		booked.update(slots)
+		yield {
+			'id': i,
+			'venue_id': venue_id,
+			'artist_id': artist_id,
+			'start_time': now + timedelta(hours=hour),
+			'duration_minutes': duration,
+		}
+
+
+def seed(venues=200, artists=500, shows=20000, seed=1, now=None):
+	"""Fill an empty schema and return the generated row counts."""
+	rng = random.Random(seed)
+	now = now or datetime.now().replace(microsecond=0)
+
+	_insert(Venue.__table__, venue_rows(rng, venues))
+	_insert(Artist.__table__, artist_rows(rng, artists))
+	connection = db.session.connection()
+	if is_partitioned(connection):
+		# months of the shows below, rather than all in show_default
+		ensure(connection, add_months(month_start(now), -25), add_months(month_start(now), 13))
+	_insert(Show.__table__, show_rows(rng, shows, venues, artists, now))
+	recount_all()
+	if db.engine.dialect.name == 'postgresql':
+		for table in ('venue', 'artist', 'show'):
+			db.session.execute(text(
+				"SELECT setval(pg_get_serial_sequence('%s', 'id'), (SELECT max(id) FROM \"%s\"))"
+				% (table, table)))
+	db.session.commit()
+
+	return {'venues': venues, 'artists': artists, 'shows': shows}
+
+
+def reset(**counts):
+	"""Drop and recreate the schema, then seed it."""
+	db.drop_all()
+	db.create_all()
+	return seed(**counts)
@@ -0,0 +1,88 @@
+#----------------------------------------------------------------------------#
+# Allocations and latency of building the venue page context: ORM instances
+# plus vars(venue) (the old show_venue) against the queries.venue_page read
+# model.
+#
+#   python -m benchmarks.venue_page --database-url sqlite:////tmp/fyyur_bench.db
+#
+# The target database is dropped and reseeded.
+#----------------------------------------------------------------------------#
+import argparse
+import time
+import tracemalloc
+from datetime import datetime
+
+from sqlalchemy.orm import selectinload
+
+from app import app
+from models import db, Venue, Show
+from queries import venue_page
+from benchmarks.seed import reset
+
+
+def orm_context(venue_id):
+	venue = Venue.query.options(
+		selectinload(Venue.shows).joinedload(Show.artist)).get(venue_id)
+	past_shows = []
+	upcoming_shows = []
+	for show in venue.shows:
+		temp_show = {
+			'artist_id': show.artist_id,
+			'artist_name': show.artist.name,
+			'artist_image_link': show.artist.image_link,
+			'start_time': show.start_time.strftime("%m/%d/%Y, %H:%M")
+		}
+		if show.start_time <= datetime.now():
+			past_shows.append(temp_show)
+		else:
+			upcoming_shows.append(temp_show)
+	data = vars(venue)
+	data['past_shows'] = past_shows
+	data['upcoming_shows'] = upcoming_shows
+	data['past_shows_count'] = len(past_shows)
+	data['upcoming_shows_count'] = len(upcoming_shows)
+	return data
+
+
+def measure(build, venue_id, repeat):
+	timings = []
+	peaks = []
+	blocks = []
+	for _ in range(repeat):
+		db.session.remove()
+		tracemalloc.start()
+		start = time.perf_counter()
+		context = build(venue_id)
+		timings.append(time.perf_counter() - start)
+		# blocks still held by the finished context, and the peak on the way
+		blocks.append(sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename')))
+		peaks.append(tracemalloc.get_traced_memory()[1])
+		tracemalloc.stop()
+		del context
+	timings.sort()
+	return timings[len(timings) // 2] * 1000, min(peaks) / 1024, min(blocks)
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--database-url', required=True)
+	parser.add_argument('--venues', type=int, default=200)
+	parser.add_argument('--artists', type=int, default=500)
+	parser.add_argument('--shows', type=int, default=20000)
+	parser.add_argument('--repeat', type=int, default=5)
+	args = parser.parse_args()
+
+	app.config['SQLALCHEMY_DATABASE_URI'] = args.database_url
+	with app.app_context():
+		reset(venues=args.venues, artists=args.artists, shows=args.shows)
+		print('%-8s %-10s %8s %12s %10s %10s' % ('venue', 'builder', 'shows', 'median ms', 'peak KiB', 'blocks'))
+		# the busiest venue, a mid one and a quiet one
+		for venue_id in (1, args.venues // 10, args.venues):
+			shows = Show.query.filter(Show.venue_id == venue_id).count()
+			for name, build in (('orm+vars', orm_context), ('read model', venue_page)):
+				ms, peak, blocks = measure(build, venue_id, args.repeat)
+				print('%-8d %-10s %8d %12.2f %10.1f %10d' % (venue_id, name, shows, ms, peak, blocks))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,208 @@
+#----------------------------------------------------------------------------#
+# Booking conflicts: a venue, and an artist, play one show at a time.
+#
+# A show occupies [start_time, start_time + duration_minutes). On
+# PostgreSQL each partition of show (partitions.py) carries two exclusion
+# constraints, <partition>_venue_overlap and <partition>_artist_overlap:
+#
+#   EXCLUDE USING gist (venue_id WITH =, tsrange(start_time, <end>) WITH &&)
+#
+# btree_gist provides the gist equality on the ids. PostgreSQL cannot hold
+# such a constraint on the partitioned table itself, so only conflicts()
+# compares shows of different months: the shows in the last
+# MAX_SHOW_MINUTES of a month. SQLite has no exclusion constraints either;
+# there conflicts() is the whole check.
+#
+# So that no other writer slips a show in between that check and the
+# insert, writers take transaction-scoped advisory locks first: add_show()
+# one per venue and per artist, plus BULK_LOCK shared; an import batch
+# BULK_LOCK alone, exclusively. Always in that order, so they cannot
+# deadlock. SQLite has no such locks; it is for development only.
+#
+# conflicts() takes a batch of new shows as one JSON parameter and finds,
+# in a single query, those overlapping a stored show or an earlier show of
+# the batch with the same venue or artist. Stored shows are looked up per
+# new show, as index ranges on ix_show_venue_id_start_time /
+# ix_show_artist_id_start_time.
+#----------------------------------------------------------------------------#
+import json
+from datetime import timedelta
+
+from sqlalchemy import DateTime, Integer, Interval, and_, func, literal, literal_column, select, text, true, union_all
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Show, MAX_SHOW_MINUTES
+
+BOOKINGS = ('venue', 'artist')
+
+EXCLUSION_VIOLATION = '23P01'
+
+OVERLAP_CONSTRAINT = (
+	'ALTER TABLE %(table)s ADD CONSTRAINT %(table)s_%(booking)s_overlap EXCLUDE USING gist '
+	"(%(booking)s_id WITH =, tsrange(start_time, start_time + duration_minutes * interval '1 minute') WITH &&)")
+
+TIME_FORMAT = '%Y-%m-%d %H:%M'
+
+# pg_advisory_xact_lock(space, id) keys
+LOCK_SPACES = {'venue': 1, 'artist': 2}
+BULK_LOCK = (0, 0)
+
+
+class BookingConflict(Exception):
+	"""The show's venue or artist is booked at that time; ``errors`` as in a form."""
+
+	def __init__(self, errors):
+		super().__init__(' '.join(message for messages in errors.values() for message in messages))
+		self.errors = errors
+
+
+def add_overlap_constraints(connection, table):
+	for booking in BOOKINGS:
+		connection.exec_driver_sql(OVERLAP_CONSTRAINT % {'table': table, 'booking': booking})
+
+
+def overlap_violation(error):
+	"""'venue' or 'artist' when the IntegrityError ``error`` broke an overlap constraint."""
+	orig = getattr(error, 'orig', None)
+	if getattr(orig, 'pgcode', None) != EXCLUSION_VIOLATION:
+		return None
+	name = orig.diag.constraint_name or ''
+	for booking in BOOKINGS:
+		if name.endswith('_%s_overlap' % booking):
+			return booking
+	return None
+
+
+def lock_bookings(venue_id, artist_id):
+	"""Hold off other writers of shows of this venue or artist until the commit."""
+	if db.engine.dialect.name != 'postgresql':
+		return
+	# evaluated left to right: the bulk lock, then the venue, then the artist
+	db.session.execute(text(
+		'SELECT pg_advisory_xact_lock_shared(:bulk_space, :bulk_id), '
+		'pg_advisory_xact_lock(:venue_space, :venue_id), pg_advisory_xact_lock(:artist_space, :artist_id)'),
+		{'bulk_space': BULK_LOCK[0], 'bulk_id': BULK_LOCK[1],
+			'venue_space': LOCK_SPACES['venue'], 'venue_id': venue_id,
+			'artist_space': LOCK_SPACES['artist'], 'artist_id': artist_id})
+
+
+def lock_bulk():
+	"""Hold off every other writer of shows until the commit (an import batch)."""
+	if db.engine.dialect.name != 'postgresql':
+		return
+	db.session.execute(text('SELECT pg_advisory_xact_lock(:space, :id)'),
+		{'space': BULK_LOCK[0], 'id': BULK_LOCK[1]})
+
+
+def _plus_minutes(timestamp, minutes):
+	if db.engine.dialect.name == 'sqlite':
+		return func.datetime(timestamp, '%d minutes' % minutes if isinstance(minutes, int)
+			else minutes.concat(' minutes'))
+	return timestamp + literal_column("interval '1 minute'", Interval) * minutes
+
+
+def _candidates(shows):
+	"""The new shows as a CTE: key, venue_id, artist_id, start_time, duration_minutes, end_time."""
+	payload = json.dumps([{
+		'key': key,
+		'venue_id': values['venue_id'],
+		'artist_id': values['artist_id'],
+		# as SQLAlchemy stores it on SQLite, so text comparisons hold
+		'start_time': values['start_time'].strftime('%Y-%m-%d %H:%M:%S.%f'),
+		'duration_minutes': values['duration_minutes'],
+	} for key, values in shows.items()])
+	if db.engine.dialect.name == 'sqlite':
+		sql = ("SELECT json_extract(value, '$.key') AS key, json_extract(value, '$.venue_id') AS venue_id, "
+			"json_extract(value, '$.artist_id') AS artist_id, json_extract(value, '$.start_time') AS start_time, "
+			"json_extract(value, '$.duration_minutes') AS duration_minutes, "
+			"datetime(json_extract(value, '$.start_time'), json_extract(value, '$.duration_minutes') || ' minutes') "
+			"AS end_time FROM json_each(:shows)")
+	else:
+		sql = ("SELECT c.key, c.venue_id, c.artist_id, c.start_time, c.duration_minutes, "
+			"c.start_time + c.duration_minutes * interval '1 minute' AS end_time "
+			"FROM json_to_recordset(CAST(:shows AS json)) "
+			"AS c(key int, venue_id int, artist_id int, start_time timestamp, duration_minutes int)")
+	return text(sql).bindparams(shows=payload).columns(
+		key=Integer, venue_id=Integer, artist_id=Integer, start_time=DateTime,
+		duration_minutes=Integer, end_time=DateTime).cte('candidate')
+
+
+def conflicts_statement(shows):
+	"""(key, booking, show_id, other_key, start_time, duration_minutes) per overlap."""
+	candidate = _candidates(shows)
+	other = candidate.alias('other')
+	parts = []
+	for booking in BOOKINGS:
+		column = booking + '_id'
+		overlap = and_(
+			getattr(Show, column) == candidate.c[column],
+			# no show lasts longer, so this bounds the index range
+			Show.start_time > _plus_minutes(candidate.c.start_time, -MAX_SHOW_MINUTES),
+			Show.start_time < candidate.c.end_time,
+			_plus_minutes(Show.start_time, Show.duration_minutes) > candidate.c.start_time)
+		if db.engine.dialect.name == 'postgresql':
+			# an index probe per new show, into the partitions of its dates;
+			# pulled up into a join (OFFSET 0 prevents it) the planner would
+			# rather hash every partition
+			booked = select(Show.id, Show.start_time, Show.duration_minutes).where(overlap) \
+				.offset(0).lateral('booked')
+			overlap = true()
+		else:
+			booked = Show.__table__
+		parts.append(select(
+				candidate.c.key, literal(booking).label('booking'), booked.c.id.label('show_id'),
+				literal(None, Integer).label('other_key'), booked.c.start_time, booked.c.duration_minutes)
+			.select_from(candidate)
+			.join(booked, overlap))
+		parts.append(select(
+				candidate.c.key, literal(booking), literal(None, Integer), other.c.key,
+				other.c.start_time, other.c.duration_minutes)
+			.select_from(candidate)
+			.join(other, and_(
+				other.c[column] == candidate.c[column],
+				other.c.key < candidate.c.key,
+				other.c.start_time < candidate.c.end_time,
+				other.c.end_time > candidate.c.start_time)))
+	return union_all(*parts)
+
+
+def _period(start, minutes):
+	end = start + timedelta(minutes=minutes)
+	return '%s to %s' % (start.strftime(TIME_FORMAT), end.strftime('%H:%M' if end.date() == start.date()
+		else TIME_FORMAT))
+
+
+def conflicts(shows):
+	"""{key: {'venue'/'artist': [message]}} for the ``shows`` ({key: values}) that overlap."""
+	if not shows:
+		return {}
+	found = {}
+	for row in db.session.execute(conflicts_statement(shows)):
+		if row.show_id is not None:
+			message = 'The %s is already booked from %s (show %d).' % (
+				row.booking, _period(row.start_time, row.duration_minutes), row.show_id)
+		else:
+			message = 'The %s is also booked from %s by line %d.' % (
+				row.booking, _period(row.start_time, row.duration_minutes), row.other_key)
+		found.setdefault(row.key, {}).setdefault(row.booking, []).append(message)
+	return found
+
+
+def add_show(show):
+	"""Add ``show`` to the session and flush it; BookingConflict when it overlaps."""
+	lock_bookings(show.venue_id, show.artist_id)
+	errors = conflicts({0: {
+		'venue_id': show.venue_id, 'artist_id': show.artist_id,
+		'start_time': show.start_time, 'duration_minutes': show.duration_minutes}})
+	if errors:
+		raise BookingConflict(errors[0])
+	db.session.add(show)
+	try:
+		db.session.flush()
+	except IntegrityError as error:
+		# booked since the check by a writer that took no lock
+		booking = overlap_violation(error)
+		if booking is None:
+			raise
+		db.session.rollback()
+		raise BookingConflict({booking: ['The %s has just been booked at that time.' % booking]})
@@ -0,0 +1,158 @@
+#----------------------------------------------------------------------------#
+# Fragment cache for the venue and artist detail pages.
+#
+# The rendered content block of /venues/<id> and /artists/<id> is cached
+# under "venue:<id>" / "artist:<id>"; the layout (navigation, flashed
+# messages) is rendered per request around it. The write paths in app.py
+# invalidate the affected entries (an edit drops its own page at once, and
+# those of the related venues / artists in a background job, jobs.py), and
+# an entry never outlives the start of the next upcoming show on it, so
+# shows roll over from "upcoming" to "past" on time.
+#
+# With read replicas (replicas.py) an invalidated entry is replaced by a
+# tombstone for REPLICA_MAX_LAG_SECONDS, so a page read from a replica that
+# has not replayed the write yet is not cached again.
+#
+# Backends share a small Redis-like interface (get / set with a timeout in
+# seconds / delete). The in-process LRU is per worker: with several worker
+# processes use the Redis backend so invalidations reach all of them.
+#----------------------------------------------------------------------------#
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from models import db, Show
+
+TOMBSTONE = '__invalidated__'
+
+
+class NullBackend(object):
+	def get(self, key):
+		return None
+
+	def set(self, key, value, timeout=None):
+		pass
+
+	def delete(self, *keys):
+		pass
+
+
+class LRUBackend(object):
+	def __init__(self, maxsize=1024):
+		self.maxsize = maxsize
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key):
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None:
+				return None
+			value, expires = entry
+			if expires is not None and expires <= time.monotonic():
+				del self._entries[key]
+				return None
+			self._entries.move_to_end(key)
+			return value
+
+	def set(self, key, value, timeout=None):
+		expires = time.monotonic() + timeout if timeout else None
+		with self._lock:
+			self._entries[key] = (value, expires)
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.maxsize:
+				self._entries.popitem(last=False)
+
+	def delete(self, *keys):
+		with self._lock:
+			for key in keys:
+				self._entries.pop(key, None)
+
+
+class RedisBackend(object):
+	def __init__(self, client, prefix='fyyur:'):
+		self.client = client
+		self.prefix = prefix
+
+	def get(self, key):
+		raw = self.client.get(self.prefix + key)
+		return None if raw is None else json.loads(raw)
+
+	def set(self, key, value, timeout=None):
+		self.client.set(self.prefix + key, json.dumps(value), ex=max(1, int(math.ceil(timeout))) if timeout else None)
+
+	def delete(self, *keys):
+		if keys:
+			self.client.delete(*[self.prefix + key for key in keys])
+
+
+class FragmentCache(object):
+	def __init__(self, app=None):
+		self.backend = NullBackend()
+		self.default_timeout = None
+		self.tombstone_timeout = None
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		kind = app.config.get('CACHE_BACKEND', 'lru')
+		if kind == 'redis':
+			import redis
+			self.backend = RedisBackend(redis.Redis.from_url(app.config['CACHE_REDIS_URL']))
+		elif kind == 'lru':
+			self.backend = LRUBackend(app.config.get('CACHE_MAXSIZE', 1024))
+		else:
+			self.backend = NullBackend()
+		self.default_timeout = app.config.get('CACHE_DEFAULT_TIMEOUT', 300)
+		if app.config.get('DB_REPLICAS'):
+			self.tombstone_timeout = app.config.get('REPLICA_MAX_LAG_SECONDS', 5)
+		app.extensions['fragment_cache'] = self
+
+	def get(self, key):
+		value = self.backend.get(key)
+		return None if value == TOMBSTONE else value
+
+	def set(self, key, value, next_change=None):
+		"""Cache ``value``; ``next_change`` is when it goes stale on its own."""
+		if self.tombstone_timeout and self.backend.get(key) == TOMBSTONE:
+			return
+		timeout = self.default_timeout
+		if next_change is not None:
+			until_change = (next_change - datetime.now()).total_seconds()
+			if until_change <= 0:
+				return
+			timeout = min(timeout, until_change) if timeout else until_change
+		self.backend.set(key, value, timeout)
+
+	def delete(self, *keys):
+		if self.tombstone_timeout:
+			for key in keys:
+				self.backend.set(key, TOMBSTONE, self.tombstone_timeout)
+		else:
+			self.backend.delete(*keys)
+
+	# Keys to drop when an entity changes. Collect them before a delete
+	# commits (the shows are gone afterwards) and drop them after.
+
+	def venue_keys(self, venue_id):
+		return ['venue:%s' % venue_id] + self.venue_related_keys(venue_id)
+
+	def venue_related_keys(self, venue_id):
+		# artist pages list the venue's name and image next to each show
+		return ['artist:%s' % artist_id for artist_id in _distinct(Show.artist_id, Show.venue_id == venue_id)]
+
+	def artist_keys(self, artist_id):
+		return ['artist:%s' % artist_id] + self.artist_related_keys(artist_id)
+
+	def artist_related_keys(self, artist_id):
+		return ['venue:%s' % venue_id for venue_id in _distinct(Show.venue_id, Show.artist_id == artist_id)]
+
+	def show_keys(self, venue_id, artist_id):
+		return ['venue:%s' % venue_id, 'artist:%s' % artist_id]
+
+
+def _distinct(column, criterion):
+	return [value for value, in db.session.query(column).filter(criterion).distinct()]
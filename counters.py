@@ -0,0 +1,170 @@
+#----------------------------------------------------------------------------#
+# Show counters on venues and artists.
+#
+# upcoming_shows_count, past_shows_count and next_show_time are kept in
+# step with the show table by the write paths, in the writer's transaction:
+# show_added() for a new show, recount() for the venues / artists whose
+# shows were deleted or bulk-loaded. A row's counters are exact while its
+# next_show_time is NULL or still ahead; roll_over() recounts the rows
+# whose next show has started, and is run periodically by
+# `flask counters refresh` (from cron, or with --every). Until it gets to a
+# row, readers use upcoming_count(), which recounts such rows inline.
+#
+# `flask counters check` compares every row with the show table and
+# reports (or, with --fix, recounts) the ones that drifted.
+#----------------------------------------------------------------------------#
+import sys
+import time
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import and_, case, exists, func, or_, select, update
+
+from models import db, Venue, Artist, Show
+
+COUNTED = ((Venue, Show.venue_id), (Artist, Show.artist_id))
+
+# ids per UPDATE ... WHERE id IN (...), within SQLite's bound parameter limit
+RECOUNT_CHUNK = 500
+
+
+def _counts(model, fk, now):
+	"""The three counters of ``model``, computed from the show table."""
+	return {
+		'upcoming_shows_count': select(func.count()).where(fk == model.id, Show.start_time > now)
+			.scalar_subquery(),
+		'past_shows_count': select(func.count()).where(fk == model.id, Show.start_time <= now)
+			.scalar_subquery(),
+		'next_show_time': select(func.min(Show.start_time)).where(fk == model.id, Show.start_time > now)
+			.scalar_subquery(),
+	}
+
+
+def upcoming_count(model, fk, now):
+	"""``model.upcoming_shows_count``, recounted for rows not rolled over yet."""
+	return case(
+		(model.next_show_time <= now,
+			select(func.count()).where(fk == model.id, Show.start_time > now).scalar_subquery()),
+		else_=model.upcoming_shows_count)
+
+
+def has_upcoming(model, fk, now):
+	"""Rows with an upcoming show: exact from next_show_time unless it has started."""
+	return or_(
+		model.next_show_time > now,
+		and_(model.next_show_time <= now,
+			exists().where(fk == model.id, Show.start_time > now)))
+
+
+def show_added(show, now=None):
+	"""Count a new show on its venue and artist (before the commit)."""
+	now = now or datetime.now()
+	start = show.start_time
+	for model, id in ((Venue, show.venue_id), (Artist, show.artist_id)):
+		if start > now:
+			values = {
+				'upcoming_shows_count': model.upcoming_shows_count + 1,
+				'next_show_time': case(
+					(or_(model.next_show_time.is_(None), model.next_show_time > start), start),
+					else_=model.next_show_time),
+			}
+		else:
+			values = {'past_shows_count': model.past_shows_count + 1}
+		db.session.execute(update(model).where(model.id == id).values(values)
+			.execution_options(synchronize_session=False))
+
+
+def recount(venue_ids=(), artist_ids=(), now=None):
+	"""Recount the given venues and artists from the show table."""
+	now = now or datetime.now()
+	for (model, fk), ids in zip(COUNTED, (venue_ids, artist_ids)):
+		ids = sorted(set(ids))
+		for start in range(0, len(ids), RECOUNT_CHUNK):
+			db.session.execute(update(model).where(model.id.in_(ids[start:start + RECOUNT_CHUNK]))
+				.values(_counts(model, fk, now))
+				.execution_options(synchronize_session=False))
+
+
+def recount_all(now=None):
+	"""Recount every venue and artist (after loading a database)."""
+	now = now or datetime.now()
+	for model, fk in COUNTED:
+		db.session.execute(update(model).values(_counts(model, fk, now))
+			.execution_options(synchronize_session=False))
+
+
+def roll_over(now=None):
+	"""Recount the rows whose next show has started; returns how many."""
+	now = now or datetime.now()
+	rows = 0
+	for model, fk in COUNTED:
+		rows += db.session.execute(update(model).where(model.next_show_time <= now)
+			.values(_counts(model, fk, now))
+			.execution_options(synchronize_session=False)).rowcount
+	return rows
+
+
+def drifted(model, fk, now):
+	"""(id, stored, actual) for every row whose counters disagree with the shows."""
+	actual = select(
+			fk.label('id'),
+			func.count().filter(Show.start_time > now).label('upcoming'),
+			func.count().filter(Show.start_time <= now).label('past'),
+			func.min(Show.start_time).filter(Show.start_time > now).label('next')) \
+		.group_by(fk) \
+		.subquery()
+	upcoming = func.coalesce(actual.c.upcoming, 0)
+	past = func.coalesce(actual.c.past, 0)
+	rows = db.session.execute(select(
+			model.id,
+			model.upcoming_shows_count, model.past_shows_count, model.next_show_time,
+			upcoming, past, actual.c.next)
+		.outerjoin(actual, actual.c.id == model.id)
+		.where(or_(
+			model.upcoming_shows_count != upcoming,
+			model.past_shows_count != past,
+			model.next_show_time.is_distinct_from(actual.c.next)))
+		.order_by(model.id))
+	return [(row[0], tuple(row[1:4]), tuple(row[4:7])) for row in rows]
+
+
+#  Commands
+#  ----------------------------------------------------------------
+
+counters_command = AppGroup('counters', help='Maintain the show counters of venues and artists.')
+
+
+@counters_command.command('refresh')
+@click.option('--every', type=float, help='Keep running, refreshing every this many seconds.')
+def refresh_command(every):
+	"""Move started shows from upcoming to past."""
+	while True:
+		rows = roll_over()
+		db.session.commit()
+		if rows or not every:
+			click.echo('%d venues/artists recounted' % rows)
+		if not every:
+			return
+		time.sleep(every)
+
+
+@counters_command.command('check')
+@click.option('--fix', is_flag=True, help='Recount the rows that drifted.')
+def check_command(fix):
+	"""Compare the counters with the show table."""
+	now = datetime.now()
+	# rows whose next show started are due for a refresh, not drift
+	roll_over(now)
+	drift = {}
+	for model, fk in COUNTED:
+		drift[model] = drifted(model, fk, now)
+		for id, stored, actual in drift[model][:20]:
+			click.echo('%s %d: stored upcoming/past/next %s, actual %s' % (
+				model.__tablename__, id, stored, actual))
+		click.echo('%s: %d rows drifted' % (model.__tablename__, len(drift[model])))
+	if fix:
+		recount([id for id, _, _ in drift[Venue]], [id for id, _, _ in drift[Artist]], now)
+	db.session.commit()
+	if any(drift.values()) and not fix:
+		sys.exit(1)
@@ -0,0 +1,137 @@
+#----------------------------------------------------------------------------#
+# Database connection pool: settings and instrumentation.
+#
+# The pool is configured from config.py (DB_POOL_*). With DB_PGBOUNCER the
+# app keeps no pool of its own (NullPool): PgBouncer does the pooling, and a
+# connection is only held for the length of a transaction.
+#
+# Pool events from every engine in the process feed POOL_STATS, which
+# /metrics (metrics.py) reports next to the pool's own gauges.
+#----------------------------------------------------------------------------#
+import threading
+import time
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, exc
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, Pool, QueuePool
+
+from replicas import RoutingSession
+
+
+class PoolStats(object):
+	"""Counters fed by pool events; cumulative since the process started."""
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self.connects = 0
+		self.checkouts = 0
+		self.checkins = 0
+		self.invalidations = 0
+		self.timeouts = 0
+		self.wait_seconds_total = 0.0
+		self.wait_seconds_max = 0.0
+
+	def incr(self, name):
+		with self._lock:
+			setattr(self, name, getattr(self, name) + 1)
+
+	def waited(self, seconds):
+		with self._lock:
+			self.wait_seconds_total += seconds
+			if seconds > self.wait_seconds_max:
+				self.wait_seconds_max = seconds
+
+	def snapshot(self):
+		with self._lock:
+			return {name: value for name, value in vars(self).items() if not name.startswith('_')}
+
+
+POOL_STATS = PoolStats()
+
+
+class TimedQueuePool(QueuePool):
+	"""QueuePool that records how long each checkout waited."""
+
+	def connect(self):
+		start = time.perf_counter()
+		try:
+			return QueuePool.connect(self)
+		except exc.TimeoutError:
+			POOL_STATS.incr('timeouts')
+			raise
+		finally:
+			POOL_STATS.waited(time.perf_counter() - start)
+
+
+@event.listens_for(Pool, 'connect')
+def _on_connect(dbapi_connection, connection_record):
+	POOL_STATS.incr('connects')
+
+
+@event.listens_for(Pool, 'checkout')
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+	POOL_STATS.incr('checkouts')
+
+
+@event.listens_for(Pool, 'checkin')
+def _on_checkin(dbapi_connection, connection_record):
+	POOL_STATS.incr('checkins')
+
+
+@event.listens_for(Pool, 'invalidate')
+@event.listens_for(Pool, 'soft_invalidate')
+def _on_invalidate(dbapi_connection, connection_record, exception):
+	POOL_STATS.incr('invalidations')
+
+
+def pool_status(pool):
+	"""Gauges of one pool; empty for pools that keep no connections."""
+	if not isinstance(pool, QueuePool):
+		return {}
+	return {
+		'size': pool.size(),
+		'checked_in': pool.checkedin(),
+		'checked_out': pool.checkedout(),
+		'overflow': max(pool.overflow(), 0),
+	}
+
+
+class TimedAsyncQueuePool(TimedQueuePool, AsyncAdaptedQueuePool):
+	"""TimedQueuePool for asyncio engines (asgi.py)."""
+
+
+def pool_options(config, drivername, queue_pool=TimedQueuePool):
+	"""Engine options for the DB_POOL_* / DB_PGBOUNCER settings."""
+	options = {}
+	if drivername.startswith('sqlite'):
+		# no server connections to pool; keep the defaults
+		pass
+	elif config.get('DB_PGBOUNCER'):
+		options['poolclass'] = NullPool
+		if drivername.endswith('+asyncpg'):
+			# prepared statements do not survive transaction pooling
+			options['connect_args'] = {'statement_cache_size': 0, 'prepared_statement_cache_size': 0}
+	else:
+		options['poolclass'] = queue_pool
+		options['pool_size'] = config.get('DB_POOL_SIZE', 5)
+		options['max_overflow'] = config.get('DB_MAX_OVERFLOW', 10)
+		options['pool_timeout'] = config.get('DB_POOL_TIMEOUT', 30)
+		options['pool_recycle'] = config.get('DB_POOL_RECYCLE', -1)
+		options['pool_pre_ping'] = config.get('DB_POOL_PRE_PING', True)
+	return options
+
+
+class PooledSQLAlchemy(SQLAlchemy):
+	"""Applies the DB_POOL_* / DB_PGBOUNCER settings when an engine is made.
+
+	Sessions are RoutingSessions, which can send reads to a replica.
+	"""
+
+	def create_session(self, options):
+		return sessionmaker(class_=RoutingSession, db=self, **options)
+
+	def apply_driver_hacks(self, app, sa_url, options):
+		for name, value in pool_options(app.config, sa_url.drivername).items():
+			options.setdefault(name, value)
+		return SQLAlchemy.apply_driver_hacks(self, app, sa_url, options)
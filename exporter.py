@@ -0,0 +1,185 @@
+#----------------------------------------------------------------------------#
+# Snapshot export of venues, artists and shows for analytics feeds.
+#
+# Each table is read in id order through a server-side cursor and written
+# in chunks of at most CHUNK_ROWS rows, as gzip NDJSON or, when pyarrow is
+# installed, Parquet. Memory stays at one fetch batch however large the
+# table is. On PostgreSQL all tables are read in one REPEATABLE READ, READ
+# ONLY transaction: a consistent snapshot that takes no locks writers wait
+# on.
+#
+# Every run writes manifest.json (files, row counts and the last id of each
+# table); pass it back with --after to export only rows added since.
+#----------------------------------------------------------------------------#
+import gzip
+import json
+import os
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import select
+
+from models import db, Venue, Artist, Show, Genres
+
+TABLES = {
+	'venues': Venue.__table__,
+	'artists': Artist.__table__,
+	'shows': Show.__table__,
+}
+
+# rows per output file, and per round trip to the database
+CHUNK_ROWS = 500000
+FETCH_SIZE = 10000
+
+
+def _jsonable(value):
+	return value.isoformat() if isinstance(value, datetime) else value
+
+
+class NDJSONChunk(object):
+	extension = 'ndjson.gz'
+
+	def __init__(self, path, columns):
+		self.columns = columns
+		self.file = gzip.open(path, 'wt', encoding='utf-8', compresslevel=6)
+
+	def write(self, rows):
+		columns = self.columns
+		self.file.writelines(
+			json.dumps(dict(zip(columns, row)), default=_jsonable, separators=(',', ':')) + '\n'
+			for row in rows)
+
+	def close(self):
+		self.file.close()
+
+
+class ParquetChunk(object):
+	extension = 'parquet'
+
+	def __init__(self, path, columns, table):
+		import pyarrow as pa
+		import pyarrow.parquet as pq
+		self.pa = pa
+		self.columns = columns
+		self.schema = pa.schema([(name, self._arrow_type(table.c[name])) for name in columns])
+		self.writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+
+	def _arrow_type(self, column):
+		pa = self.pa
+		if column.type is Genres:
+			return pa.list_(pa.string())
+		if isinstance(column.type, db.Integer):
+			return pa.int64()
+		if isinstance(column.type, db.Float):
+			return pa.float64()
+		if isinstance(column.type, db.Boolean):
+			return pa.bool_()
+		if isinstance(column.type, db.DateTime):
+			return pa.timestamp('us')
+		return pa.string()
+
+	def write(self, rows):
+		# one row group per fetch batch
+		arrays = [self.pa.array(values, type=field.type)
+			for values, field in zip(zip(*rows), self.schema)]
+		self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+
+	def close(self):
+		self.writer.close()
+
+
+def export_table(connection, name, out_dir, fmt='ndjson', after_id=None, since=None,
+		chunk_rows=CHUNK_ROWS):
+	"""Write one table to ``out_dir``; returns its manifest entry."""
+	table = TABLES[name]
+	columns = [column.name for column in table.columns]
+	query = select(table).order_by(table.c.id)
+	if after_id is not None:
+		query = query.where(table.c.id > after_id)
+	if since is not None and 'start_time' in table.c:
+		query = query.where(table.c.start_time >= since)
+
+	result = connection.execution_options(stream_results=True, max_row_buffer=FETCH_SIZE) \
+		.execute(query)
+	entry = {'files': [], 'rows': 0, 'last_id': after_id}
+	chunk = None
+	in_chunk = 0
+	try:
+		for rows in result.partitions(FETCH_SIZE):
+			while rows:
+				if chunk is None:
+					filename = '%s-%05d.%s' % (name, len(entry['files']) + 1,
+						ParquetChunk.extension if fmt == 'parquet' else NDJSONChunk.extension)
+					path = os.path.join(out_dir, filename)
+					chunk = ParquetChunk(path, columns, table) if fmt == 'parquet' \
+						else NDJSONChunk(path, columns)
+					entry['files'].append(filename)
+					in_chunk = 0
+				part, rows = rows[:chunk_rows - in_chunk], rows[chunk_rows - in_chunk:]
+				chunk.write(part)
+				in_chunk += len(part)
+				entry['rows'] += len(part)
+				entry['last_id'] = part[-1].id
+				if in_chunk >= chunk_rows:
+					chunk.close()
+					chunk = None
+	finally:
+		if chunk is not None:
+			chunk.close()
+		result.close()
+	return entry
+
+
+def export_all(out_dir, names=None, fmt='ndjson', after=None, since=None, chunk_rows=CHUNK_ROWS):
+	"""Export ``names`` (default: all tables) from one snapshot; returns the manifest."""
+	os.makedirs(out_dir, exist_ok=True)
+	after = after or {}
+	manifest = {
+		'started_at': datetime.now().isoformat(),
+		'format': fmt,
+		'since': since.isoformat() if since else None,
+		'tables': {},
+	}
+	engine = db.get_engine()
+	with engine.connect() as connection:
+		if connection.dialect.name == 'postgresql':
+			connection = connection.execution_options(isolation_level='REPEATABLE READ')
+		with connection.begin():
+			if connection.dialect.name == 'postgresql':
+				connection.exec_driver_sql('SET TRANSACTION READ ONLY')
+			for name in names or TABLES:
+				manifest['tables'][name] = export_table(connection, name, out_dir, fmt,
+					after.get(name), since, chunk_rows)
+	with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+		json.dump(manifest, f, indent=2)
+	return manifest
+
+
+@click.command('export')
+@click.argument('out_dir', type=click.Path(file_okay=False))
+@click.option('--table', 'names', multiple=True, type=click.Choice(sorted(TABLES)),
+	help='Table to export; repeat for several. All by default.')
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'parquet']), default='ndjson',
+	show_default=True, help='parquet needs pyarrow.')
+@click.option('--after', 'after_manifest', type=click.Path(exists=True, dir_okay=False),
+	help="A previous run's manifest.json; only rows with a higher id are exported.")
+@click.option('--after-id', type=int, help='Only rows with a higher id, in every table.')
+@click.option('--since', type=click.DateTime(), help='Only shows starting at or after this time.')
+@click.option('--chunk-rows', type=int, default=CHUNK_ROWS, show_default=True)
+@with_appcontext
+def export_command(out_dir, names, fmt, after_manifest, after_id, since, chunk_rows):
+	"""Export venues, artists and shows to compressed files in OUT_DIR."""
+	if fmt == 'parquet':
+		try:
+			import pyarrow  # noqa: F401
+		except ImportError:
+			raise click.UsageError('--format parquet needs pyarrow installed.')
+	after = {name: after_id for name in TABLES} if after_id is not None else {}
+	if after_manifest:
+		with open(after_manifest) as f:
+			after.update((name, entry['last_id']) for name, entry in json.load(f)['tables'].items())
+	manifest = export_all(out_dir, names, fmt, after, since, chunk_rows)
+	for name, entry in manifest['tables'].items():
+		click.echo('%-8s %9d rows in %d file(s), last id %s' % (
+			name, entry['rows'], len(entry['files']), entry['last_id']))
@@ -6,10 +6,20 @@ from fabric.contrib.console import confirm
 
 def test():
     with settings(warn_only=True):
+        # the test suite, with the query-plan checks (tests/)
+        result = local("python -m pytest -q", capture=True)
+    if result.failed and not confirm("Tests failed. Continue?"):
+        abort("Aborted at user request.")
+    with settings(warn_only=True):
+        # every route against the saved baseline (benchmarks/routes.py);
+        # the first run records the baseline
         result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
+            "python -m benchmarks.routes"
+            " --database-url sqlite:////tmp/fyyur_bench.db"
+            " --baseline benchmarks/baselines/routes.json",
+            capture=True
         )
-    if result.failed and not confirm("Tests failed. Continue?"):
+    if result.failed and not confirm("Benchmarks regressed. Continue?"):
         abort("Aborted at user request.")
 
 
@@ -0,0 +1,178 @@
+#----------------------------------------------------------------------------#
+# Filters and genre facets for the venue / artist lists and searches.
+#
+#   ?genre=Jazz&genre=Blues   both genres (genres @> ARRAY[...]);
+#                             with genre_match=any, either (genres && ...)
+#   ?city=San Francisco&state=CA
+#   ?upcoming=1               only those with upcoming shows
+#
+# /shows is a calendar over the same filters, applied to each show's
+# artist's genres and venue's city / state, within ?from=2026-10-01&to=
+# 2026-10-31 (both days included). The bounds are start_time ranges, so on
+# PostgreSQL only the show table's partitions for those months are read.
+#
+# On PostgreSQL the genre operators are served by the GIN indexes on the
+# genres arrays (ix_venue_genres / ix_artist_genres). Facet counts come from
+# one grouped query over unnest(genres) of the filtered rows. SQLite stores
+# genres as JSON lists; json_each() stands in for both.
+#----------------------------------------------------------------------------#
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from flask import abort
+from sqlalchemy import bindparam, func, select, text, true
+
+from forms import VenueForm
+from models import db, Venue, Artist, Show
+from counters import has_upcoming
+
+GENRES = {value.lower(): value for value, _ in VenueForm.genres.kwargs['choices']}
+
+GENRE_MATCHES = ('all', 'any')
+
+TRUE_VALUES = frozenset(['1', 'true', 'yes', 'on'])
+
+DATE_FORMAT = '%Y-%m-%d'
+
+Filters = namedtuple('Filters', 'genres genre_match city state upcoming')
+
+NO_FILTERS = Filters((), 'all', None, None, False)
+
+
+def parse_filters(args):
+	"""Filters from request.args or request.form; 400 on an unknown genre."""
+	genres = []
+	for value in args.getlist('genre'):
+		if not value.strip():
+			continue
+		genre = GENRES.get(value.strip().lower())
+		if genre is None:
+			abort(400, 'Unknown genre %s' % value)
+		if genre not in genres:
+			genres.append(genre)
+	genre_match = args.get('genre_match', 'all')
+	if genre_match not in GENRE_MATCHES:
+		abort(400, 'genre_match must be one of %s' % ', '.join(GENRE_MATCHES))
+	return Filters(
+		genres=tuple(genres),
+		genre_match=genre_match,
+		city=args.get('city', '').strip() or None,
+		state=args.get('state', '').strip() or None,
+		upcoming=args.get('upcoming', '').lower() in TRUE_VALUES)
+
+
+def parse_window(args):
+	"""(start, end) of ``?from=&to=`` (YYYY-MM-DD, both days included); 400 on a bad date."""
+	bounds = []
+	for name in ('from', 'to'):
+		value = args.get(name, '').strip()
+		try:
+			bounds.append(datetime.strptime(value, DATE_FORMAT) if value else None)
+		except ValueError:
+			abort(400, '%s must be a date (YYYY-MM-DD)' % name)
+	start, end = bounds
+	if end is not None:
+		end += timedelta(days=1)
+	if start is not None and end is not None and end <= start:
+		abort(400, 'from must not be after to')
+	return start, end
+
+
+def filter_args(filters):
+	"""The request arguments that select ``filters`` (for links and forms)."""
+	args = {}
+	if filters.genres:
+		args['genre'] = list(filters.genres)
+		if filters.genre_match != 'all':
+			args['genre_match'] = filters.genre_match
+	if filters.city:
+		args['city'] = filters.city
+	if filters.state:
+		args['state'] = filters.state
+	if filters.upcoming:
+		args['upcoming'] = '1'
+	return args
+
+
+def genres_clause(model, genres, match_any=False):
+	"""Rows having all of ``genres`` (any of them with ``match_any``)."""
+	genres = list(genres)
+	if db.engine.dialect.name == 'sqlite':
+		if match_any:
+			sql = 'EXISTS (SELECT 1 FROM json_each(%s.genres) WHERE json_each.value IN :genres)'
+		else:
+			sql = ('(SELECT count(DISTINCT json_each.value) FROM json_each(%s.genres) '
+				'WHERE json_each.value IN :genres) = :genre_count')
+		# unique: a statement may hold several of these (a genre search term
+		# and ?genre=), and same-named parameters would share one value
+		clause = text(sql % model.__tablename__).bindparams(
+			bindparam('genres', genres, expanding=True, unique=True))
+		return clause if match_any else clause.bindparams(bindparam('genre_count', len(genres), unique=True))
+	return model.genres.overlap(genres) if match_any else model.genres.contains(genres)
+
+
+def filter_clauses(model, show_fk, filters, now=None):
+	clauses = []
+	if filters.genres:
+		clauses.append(genres_clause(model, filters.genres, filters.genre_match == 'any'))
+	if filters.city:
+		clauses.append(model.city == filters.city)
+	if filters.state:
+		clauses.append(model.state == filters.state)
+	if filters.upcoming:
+		clauses.append(has_upcoming(model, show_fk, now or datetime.now()))
+	return clauses
+
+
+def show_clauses(filters, start=None, end=None):
+	"""Clauses on a select of shows joined to their venue and artist."""
+	clauses = []
+	if start is not None:
+		clauses.append(Show.start_time >= start)
+	if end is not None:
+		clauses.append(Show.start_time < end)
+	if filters.genres:
+		clauses.append(genres_clause(Artist, filters.genres, filters.genre_match == 'any'))
+	if filters.city:
+		clauses.append(Venue.city == filters.city)
+	if filters.state:
+		clauses.append(Venue.state == filters.state)
+	return clauses
+
+
+def calendar_clauses(args):
+	"""show_clauses() of the request's filters and ?from=&to= window."""
+	return show_clauses(parse_filters(args), *parse_window(args))
+
+
+def genre_facets_statement(model, clauses, joins=()):
+	"""(genre, count) over the rows matching ``clauses``, most common first."""
+	if db.engine.dialect.name == 'sqlite':
+		genre = func.json_each(model.genres).table_valued('value').alias('genre')
+	else:
+		genre = func.unnest(model.genres).table_valued('value').render_derived(name='genre')
+	statement = select(genre.c.value.label('genre'), func.count().label('count')).select_from(model)
+	for target, onclause in joins:
+		statement = statement.outerjoin(target, onclause)
+	return statement \
+		.join(genre, true()) \
+		.where(*clauses) \
+		.group_by(genre.c.value) \
+		.order_by(func.count().desc(), genre.c.value)
+
+
+def genre_options(facets, filters):
+	"""(genre, count, selected) for the filter form; selected genres always show."""
+	if facets is None:
+		return None
+	options = [(facet['genre'], facet['count'], facet['genre'] in filters.genres) for facet in facets]
+	listed = {facet['genre'] for facet in facets}
+	return options + [(genre, 0, True) for genre in filters.genres if genre not in listed]
+
+
+def facet_list(rows):
+	return [{"genre": row.genre, "count": row.count} for row in rows]
+
+
+def genre_facets(model, clauses, joins=()):
+	return facet_list(db.session.execute(genre_facets_statement(model, clauses, joins)))
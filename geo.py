@@ -0,0 +1,390 @@
+#----------------------------------------------------------------------------#
+# Venue locations and /venues/near.
+#
+# Venues may carry a latitude / longitude: typed into the venue form,
+# imported, or looked up by city and state in the geocode table. That table
+# is an offline cache filled from a local gazetteer file:
+#
+#   flask geocode load places.csv     # city,state,latitude,longitude
+#   flask geocode venues              # locate venues that have no position
+#
+# Near queries take a radius around a point or a bounding box and return
+# the closest venues first. With PostGIS installed they use a GiST index on
+# the venue's geography point (ST_DWithin, KNN ordering). Otherwise every
+# venue carries the geohash of its position, and the query scans the
+# ix_venue_geohash B-tree for the few geohash prefixes covering the box,
+# then orders the survivors by distance, widening the search in steps
+# (NEAR_STAGES) until a page is full. Boxes do not wrap around the
+# antimeridian.
+#----------------------------------------------------------------------------#
+import csv
+import math
+import time
+from datetime import datetime
+
+import click
+from flask import abort, current_app
+from flask.cli import AppGroup
+from sqlalchemy import DDL, and_, event, exists, func, or_, select, update
+
+from models import db, Venue, Geocode
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 12
+
+# key ranges per near query on the geohash index
+MAX_GEOHASH_CELLS = 16
+
+# Without PostGIS a near query first tries these fractions of its radius
+# and stops at the first that holds a full page: in a dense area the rows
+# of the whole circle are never read.
+NEAR_STAGES = (1 / 64.0, 1 / 16.0, 1 / 4.0)
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# PostGIS expression behind ix_venue_location; queries must repeat it as is
+LOCATION_SQL = 'geography(ST_SetSRID(ST_MakePoint(longitude, latitude), 4326))'
+
+# gazetteer header -> geocode column; Census gazetteer files use the latter names
+GAZETTEER_COLUMNS = {
+	'city': 'city', 'name': 'city', 'place': 'city',
+	'state': 'state', 'usps': 'state', 'state_code': 'state',
+	'latitude': 'latitude', 'lat': 'latitude', 'intptlat': 'latitude',
+	'longitude': 'longitude', 'lng': 'longitude', 'lon': 'longitude', 'intptlong': 'longitude',
+}
+# "Springfield city" in the Census files is "Springfield" on a venue
+PLACE_SUFFIXES = (' city', ' town', ' village', ' borough', ' cdp', ' municipality')
+
+LOAD_BATCH_SIZE = 5000
+
+
+def _postgis_installed(connection):
+	return connection.dialect.name == 'postgresql' and connection.exec_driver_sql(
+		"SELECT 1 FROM pg_extension WHERE extname = 'postgis'").first() is not None
+
+
+event.listen(Venue.__table__, 'after_create',
+	DDL('CREATE INDEX ix_venue_location ON venue USING gist (%s)' % LOCATION_SQL)
+		.execute_if(callable_=lambda ddl, target, bind, **kw: _postgis_installed(bind)))
+
+
+#  Geohashes
+#  ----------------------------------------------------------------
+
+def geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+	lat_range = [-90.0, 90.0]
+	lng_range = [-180.0, 180.0]
+	chars = []
+	bits = bit_count = 0
+	even = True
+	while len(chars) < precision:
+		interval, value = (lng_range, longitude) if even else (lat_range, latitude)
+		middle = (interval[0] + interval[1]) / 2
+		bits <<= 1
+		if value >= middle:
+			bits |= 1
+			interval[0] = middle
+		else:
+			interval[1] = middle
+		even = not even
+		bit_count += 1
+		if bit_count == 5:
+			chars.append(GEOHASH_ALPHABET[bits])
+			bits = bit_count = 0
+	return ''.join(chars)
+
+
+def cell_size(precision):
+	"""(height, width) in degrees of a geohash cell."""
+	return 180.0 / 2 ** (5 * precision // 2), 360.0 / 2 ** ((5 * precision + 1) // 2)
+
+
+def covering_cells(south, west, north, east):
+	"""The geohashes of the smallest cells of which at most MAX_GEOHASH_CELLS cover the box."""
+	for precision in range(GEOHASH_PRECISION, 0, -1):
+		height, width = cell_size(precision)
+		rows = [min(int((lat + 90) / height), int(180 / height) - 1) for lat in (south, north)]
+		columns = [min(int((lng + 180) / width), int(360 / width) - 1) for lng in (west, east)]
+		if (rows[1] - rows[0] + 1) * (columns[1] - columns[0] + 1) <= MAX_GEOHASH_CELLS:
+			break
+	return sorted(
+		geohash(-90 + (row + 0.5) * height, -180 + (column + 0.5) * width, precision)
+		for row in range(rows[0], rows[1] + 1)
+		for column in range(columns[0], columns[1] + 1))
+
+
+#  Distances
+#  ----------------------------------------------------------------
+
+def distance_km(lat1, lng1, lat2, lng2):
+	"""Great-circle (haversine) distance."""
+	lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+	a = math.sin((lat2 - lat1) / 2) ** 2 + \
+		math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+	return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def box_around(latitude, longitude, radius_km):
+	"""(south, west, north, east) of a box holding the circle, clamped to the map."""
+	dlat = radius_km / KM_PER_DEGREE
+	scale = math.cos(math.radians(min(89.0, abs(latitude) + dlat)))
+	dlng = min(180.0, radius_km / (KM_PER_DEGREE * scale))
+	return (max(-90.0, latitude - dlat), max(-180.0, longitude - dlng),
+		min(90.0, latitude + dlat), min(180.0, longitude + dlng))
+
+
+#  Locating venues
+#  ----------------------------------------------------------------
+
+def place_key(city, state):
+	return (city or '').strip().lower(), (state or '').strip().upper()
+
+
+def locate(venue, latitude=None, longitude=None):
+	"""Set ``venue``'s position; without one, its city's from the geocode cache."""
+	if latitude is None or longitude is None:
+		place = db.session.get(Geocode, place_key(venue.city, venue.state))
+		latitude, longitude = (place.latitude, place.longitude) if place else (None, None)
+	venue.latitude = latitude
+	venue.longitude = longitude
+	venue.geohash = geohash(latitude, longitude) if latitude is not None else None
+
+
+def locate_unplaced():
+	"""Give every venue without a position its city's; returns how many."""
+	city = func.lower(func.trim(Venue.city))
+	state = func.upper(func.trim(Venue.state))
+
+	def cached(column):
+		return select(column).where(Geocode.city == city, Geocode.state == state).scalar_subquery()
+
+	return db.session.execute(update(Venue)
+		.where(Venue.latitude.is_(None), exists().where(Geocode.city == city, Geocode.state == state))
+		.values(latitude=cached(Geocode.latitude), longitude=cached(Geocode.longitude),
+			geohash=cached(Geocode.geohash))
+		.execution_options(synchronize_session=False)).rowcount
+
+
+#  Near queries
+#  ----------------------------------------------------------------
+
+def backend():
+	"""'postgis' or 'geohash', per GEO_BACKEND ('auto' picks PostGIS when installed)."""
+	configured = current_app.config.get('GEO_BACKEND', 'auto')
+	if configured != 'auto':
+		return configured
+	engine = db.engine
+	installed = current_app.extensions.setdefault('postgis_installed', {})
+	if engine.url not in installed:
+		with engine.connect() as connection:
+			installed[engine.url] = _postgis_installed(connection)
+	return 'postgis' if installed[engine.url] else 'geohash'
+
+
+def _near_postgis(latitude, longitude, radius_km, box, limit):
+	location = func.geography(func.ST_SetSRID(func.ST_MakePoint(Venue.longitude, Venue.latitude), 4326))
+	center = func.geography(func.ST_SetSRID(func.ST_MakePoint(longitude, latitude), 4326))
+	if box is None:
+		where = func.ST_DWithin(location, center, radius_km * 1000)
+	else:
+		south, west, north, east = box
+		where = location.op('&&')(func.geography(func.ST_MakeEnvelope(west, south, east, north, 4326)))
+	return select(Venue.id, Venue.name, Venue.city, Venue.state, Venue.latitude, Venue.longitude) \
+		.where(where) \
+		.order_by(location.op('<->')(center), Venue.id) \
+		.limit(limit)
+
+
+def _near_geohash(latitude, longitude, radius_km, box, limit):
+	if radius_km is None:
+		south, west, north, east = box
+	else:
+		south, west, north, east = box_around(latitude, longitude, radius_km)
+		if box is not None:
+			south, west, north, east = max(south, box[0]), max(west, box[1]), \
+				min(north, box[2]), min(east, box[3])
+	cells = covering_cells(south, west, north, east)
+	# planar distance, in degrees of latitude, is enough to order by
+	scale = math.cos(math.radians(latitude))
+	planar = (Venue.latitude - latitude) * (Venue.latitude - latitude) + \
+		(Venue.longitude - longitude) * scale * (Venue.longitude - longitude) * scale
+	where = [
+		or_(*[and_(Venue.geohash >= cell, Venue.geohash < cell + '~') for cell in cells]),
+		Venue.latitude.between(south, north),
+		Venue.longitude.between(west, east),
+	]
+	if radius_km is not None:
+		# 1% of slack; the exact cut is made on the haversine distance
+		where.append(planar <= (radius_km * 1.01 / KM_PER_DEGREE) ** 2)
+	return select(Venue.id, Venue.name, Venue.city, Venue.state, Venue.latitude, Venue.longitude) \
+		.where(*where) \
+		.order_by(planar, Venue.id) \
+		.limit(limit)
+
+
+def near_statement(latitude, longitude, radius_km=None, box=None, limit=50, backend_name=None):
+	"""Venues within ``radius_km`` of the point and / or inside ``box``
+	(south, west, north, east), nearest to the point first."""
+	near = _near_postgis if (backend_name or backend()) == 'postgis' else _near_geohash
+	return near(latitude, longitude, radius_km, box, limit)
+
+
+def near_results(rows, latitude, longitude, radius_km=None):
+	# the SQL order is by an approximation (or a spheroid); list by what is shown
+	rows = sorted(((distance_km(latitude, longitude, row.latitude, row.longitude), row.id, row)
+		for row in rows))
+	venues = []
+	for distance, _, row in rows:
+		if radius_km is not None and distance > radius_km:
+			continue
+		venues.append({
+			"id": row.id,
+			"name": row.name,
+			"city": row.city,
+			"state": row.state,
+			"latitude": row.latitude,
+			"longitude": row.longitude,
+			"distance_km": round(distance, 3),
+		})
+	return venues
+
+
+def venues_near(latitude, longitude, radius_km=None, box=None, limit=50):
+	if backend() == 'postgis':
+		rows = db.session.execute(_near_postgis(latitude, longitude, radius_km, box, limit))
+		return near_results(rows, latitude, longitude, radius_km)
+	if radius_km is None:
+		# a box: circles around its centre, then the whole box
+		outer = distance_km(latitude, longitude, box[2], box[3])
+		stages = [outer * fraction for fraction in NEAR_STAGES] + [None]
+	else:
+		stages = [radius_km * fraction for fraction in NEAR_STAGES] + [radius_km]
+	for stage in stages:
+		rows = db.session.execute(_near_geohash(latitude, longitude, stage, box, limit))
+		venues = near_results(rows, latitude, longitude, stage)
+		if len(venues) >= limit:
+			break
+	return venues
+
+
+def _float_arg(args, name, low, high):
+	try:
+		value = float(args[name])
+	except (TypeError, ValueError):
+		abort(400, '%s must be a number' % name)
+	if not low <= value <= high:
+		abort(400, '%s must be between %g and %g' % (name, low, high))
+	return value
+
+
+def near_query(args):
+	"""(latitude, longitude, radius_km, box) from the query string, or None without one.
+
+	?lat=&lng=[&radius_km=], ?city=&state=[&radius_km=] (the city's centroid
+	from the geocode cache) or ?bbox=west,south,east,north.
+	"""
+	config = current_app.config
+	max_radius = config['NEAR_MAX_RADIUS_KM']
+	if args.get('bbox'):
+		try:
+			west, south, east, north = [float(value) for value in args['bbox'].split(',')]
+		except ValueError:
+			abort(400, 'bbox must be west,south,east,north')
+		if not (-90 <= south < north <= 90 and -180 <= west < east <= 180):
+			abort(400, 'bbox must be west,south,east,north, within the map, west of east')
+		latitude, longitude = (south + north) / 2, (west + east) / 2
+		if distance_km(south, west, north, east) > 2 * max_radius:
+			abort(400, 'bbox is too large')
+		return latitude, longitude, None, (south, west, north, east)
+
+	if 'lat' in args or 'lng' in args:
+		latitude = _float_arg(args, 'lat', -90, 90)
+		longitude = _float_arg(args, 'lng', -180, 180)
+	elif args.get('city'):
+		place = db.session.get(Geocode, place_key(args['city'], args.get('state')))
+		if place is None:
+			abort(404, 'Unknown place %s, %s' % (args['city'], args.get('state', '')))
+		latitude, longitude = place.latitude, place.longitude
+	else:
+		return None
+	radius_km = _float_arg(args, 'radius_km', 0, max_radius) if 'radius_km' in args \
+		else config['NEAR_DEFAULT_RADIUS_KM']
+	return latitude, longitude, radius_km, None
+
+
+#  Commands
+#  ----------------------------------------------------------------
+
+geocode_command = AppGroup('geocode', help='Fill the geocoding cache and locate venues.')
+
+
+def read_gazetteer(stream, delimiter):
+	"""Yield (city, state, latitude, longitude) keyed as place_key(); skip bad rows."""
+	reader = csv.reader(stream, delimiter=delimiter)
+	header = [GAZETTEER_COLUMNS.get(name.strip().lower()) for name in next(reader, [])]
+	missing = {'city', 'state', 'latitude', 'longitude'} - set(header)
+	if missing:
+		raise click.ClickException('Gazetteer has no %s column' % ', '.join(sorted(missing)))
+	for values in reader:
+		row = {name: value.strip() for name, value in zip(header, values) if name}
+		city = row.get('city', '')
+		for suffix in PLACE_SUFFIXES:
+			if city.lower().endswith(suffix):
+				city = city[:-len(suffix)]
+				break
+		try:
+			latitude, longitude = float(row['latitude']), float(row['longitude'])
+		except (KeyError, ValueError):
+			continue
+		if city and row.get('state') and -90 <= latitude <= 90 and -180 <= longitude <= 180:
+			yield place_key(city, row['state']) + (latitude, longitude)
+
+
+def _upsert(rows):
+	if db.engine.dialect.name == 'postgresql':
+		from sqlalchemy.dialects.postgresql import insert
+	else:
+		from sqlalchemy.dialects.sqlite import insert
+	statement = insert(Geocode.__table__)
+	db.session.execute(statement.on_conflict_do_update(
+		index_elements=['city', 'state'],
+		set_={name: statement.excluded[name]
+			for name in ('latitude', 'longitude', 'geohash', 'source', 'loaded_at')}), rows)
+
+
+@geocode_command.command('load')
+@click.argument('gazetteer', type=click.Path(exists=True, dir_okay=False))
+@click.option('--delimiter', help='Field separator; tab for .txt / .tsv files, else a comma.')
+def load_command(gazetteer, delimiter):
+	"""Load place centroids from a gazetteer file into the geocode cache."""
+	delimiter = delimiter or ('\t' if gazetteer.endswith(('.txt', '.tsv')) else ',')
+	started = time.time()
+	loaded_at = datetime.now()
+	loaded = 0
+	batch = {}
+	with open(gazetteer, newline='', encoding='utf-8') as stream:
+		for city, state, latitude, longitude in read_gazetteer(stream, delimiter):
+			# a place listed twice keeps its last position
+			batch[city, state] = {
+				'city': city, 'state': state, 'latitude': latitude, 'longitude': longitude,
+				'geohash': geohash(latitude, longitude), 'source': gazetteer, 'loaded_at': loaded_at,
+			}
+			if len(batch) >= LOAD_BATCH_SIZE:
+				_upsert(list(batch.values()))
+				loaded += len(batch)
+				batch = {}
+	if batch:
+		_upsert(list(batch.values()))
+		loaded += len(batch)
+	db.session.commit()
+	click.echo('%d places loaded in %.1fs' % (loaded, time.time() - started))
+
+
+@geocode_command.command('venues')
+def venues_command():
+	"""Locate the venues without a position at their city's centroid."""
+	located = locate_unplaced()
+	db.session.commit()
+	unplaced = db.session.query(func.count(Venue.id)).filter(Venue.latitude.is_(None)).scalar()
+	click.echo('%d venues located, %d not in the geocode cache' % (located, unplaced))
@@ -0,0 +1,373 @@
+#----------------------------------------------------------------------------#
+# Bulk import of venues, artists and shows from CSV or NDJSON.
+#
+# Rows are parsed as a stream, checked in batches against the same rules as
+# VenueForm / ArtistForm / ShowForm (their own validators and choices), and
+# loaded with COPY on PostgreSQL or executemany elsewhere. Shows may name
+# their venue and artist by id or by name; both resolve with one query per
+# batch. Rejected rows are written, with their errors, to an NDJSON error
+# file (or handed back by the API).
+#
+# Shows must not overlap another show of their venue or artist
+# (bookings.py): each batch is checked against the stored shows, and within
+# itself, in one query before it loads. With check=True (--check,
+# ?check=1) the whole file is validated the same way, loaded and rolled
+# back, so nothing is kept but the verdicts.
+#----------------------------------------------------------------------------#
+import csv
+import io
+import json
+import re
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from wtforms.fields import BooleanField, DateTimeField, FloatField, IntegerField, SelectMultipleField
+from wtforms.fields.core import UnboundField
+from wtforms.validators import ValidationError, StopValidation
+
+from forms import VenueForm, ArtistForm, ShowForm
+from models import db, Venue, Artist, Show
+from counters import recount
+from geo import geohash
+from bookings import conflicts, lock_bulk
+
+BATCH_SIZE = 5000
+
+LIST_SEPARATOR = re.compile(r'\s*[;,]\s*')
+
+# what a checkbox column may hold for "unchecked"
+FALSE_VALUES = frozenset(['', '0', 'false', 'no', 'off', 'n', 'f'])
+
+
+class _FieldStub(object):
+	"""Just enough of a bound WTForms field to run its validators."""
+	__slots__ = ('data', 'raw_data', 'errors')
+
+	def __init__(self, data):
+		self.data = data
+		self.raw_data = [] if data is None else [data]
+		self.errors = []
+
+	def gettext(self, string):
+		return string
+
+	def ngettext(self, singular, plural, n):
+		return singular if n == 1 else plural
+
+
+class RowValidator(object):
+	"""Coerces and validates plain dict rows with the rules of a form class."""
+
+	def __init__(self, form_class, skip=()):
+		self.fields = []
+		for name in dir(form_class):
+			unbound = getattr(form_class, name)
+			if not isinstance(unbound, UnboundField) or name in skip:
+				continue
+			field_class = unbound.field_class
+			choices = unbound.kwargs.get('choices')
+			self.fields.append((
+				name,
+				self._coercer(field_class, unbound.kwargs),
+				tuple(unbound.kwargs.get('validators') or ()),
+				frozenset(value for value, _ in choices) if choices else None,
+				issubclass(field_class, SelectMultipleField),
+			))
+
+	@staticmethod
+	def _coercer(field_class, kwargs):
+		if issubclass(field_class, BooleanField):
+			return lambda value: value if isinstance(value, bool) else \
+				value is not None and str(value).strip().lower() not in FALSE_VALUES
+		if issubclass(field_class, IntegerField):
+			default = kwargs.get('default')
+			return lambda value: default if value in (None, '') else value if isinstance(value, int) else int(value)
+		if issubclass(field_class, FloatField):
+			return lambda value: value if value in (None, '') or isinstance(value, float) else float(value)
+		if issubclass(field_class, DateTimeField):
+			fmt = kwargs.get('format', '%Y-%m-%d %H:%M:%S')
+			def coerce_datetime(value):
+				if isinstance(value, datetime) or not value:
+					return value
+				value = value.strip()
+				if fmt == '%Y-%m-%d %H:%M:%S':
+					# the C parser is ~20x faster than strptime for this shape
+					try:
+						return datetime.fromisoformat(value)
+					except ValueError:
+						pass
+				return datetime.strptime(value, fmt)
+			return coerce_datetime
+		if issubclass(field_class, SelectMultipleField):
+			def coerce_list(value):
+				if value is None or isinstance(value, list):
+					return value or []
+				value = value.strip()
+				if value.startswith('['):
+					return json.loads(value)
+				return [item for item in LIST_SEPARATOR.split(value) if item]
+			return coerce_list
+		return lambda value: value if value is None else str(value).strip()
+
+	def __call__(self, row):
+		"""Return (values, errors); errors maps field name to messages."""
+		values = {}
+		errors = {}
+		for name, coerce, validators, choices, multiple in self.fields:
+			try:
+				value = coerce(row.get(name))
+			except (AttributeError, TypeError, ValueError):
+				errors[name] = ['Not a valid value.']
+				continue
+			field = _FieldStub(value)
+			for validator in validators:
+				try:
+					validator(None, field)
+				except StopValidation as e:
+					if e.args and e.args[0]:
+						field.errors.append(e.args[0])
+					break
+				except ValidationError as e:
+					field.errors.append(e.args[0])
+			if choices is not None and value and not field.errors:
+				invalid = [v for v in value if v not in choices] if multiple else \
+					([] if value in choices else [value])
+				if invalid:
+					field.errors.append('Not a valid choice: %s' % ', '.join(map(str, invalid)))
+			if field.errors:
+				errors[name] = field.errors
+			values[name] = value if value != '' else None
+		return values, errors
+
+
+class Kind(object):
+	def __init__(self, model, form_class, skip=()):
+		self.model = model
+		self.validate = RowValidator(form_class, skip)
+		self.columns = [name for name, _, _, _, _ in self.validate.fields]
+		if model is Show:
+			self.columns = ['venue_id', 'artist_id'] + self.columns
+		if model is Venue:
+			self.columns.append('geohash')
+
+
+KINDS = {
+	'venues': Kind(Venue, VenueForm),
+	'artists': Kind(Artist, ArtistForm),
+	# venue / artist references are resolved in bulk, not per row
+	'shows': Kind(Show, ShowForm, skip=('venue_id', 'artist_id')),
+}
+
+
+#  Reading
+#  ----------------------------------------------------------------
+
+def read_rows(stream, fmt):
+	"""Yield (line number, row dict) from a text stream of CSV or NDJSON."""
+	if fmt == 'csv':
+		reader = csv.DictReader(stream)
+		for row in reader:
+			yield reader.line_num, row
+	elif fmt == 'ndjson':
+		for line_num, line in enumerate(stream, 1):
+			if not line.strip():
+				continue
+			try:
+				row = json.loads(line)
+			except ValueError:
+				row = None
+			yield line_num, row if isinstance(row, dict) else {'__invalid__': line}
+	else:
+		raise ValueError('Unknown format %r' % fmt)
+
+
+def _batches(rows, size):
+	batch = []
+	for item in rows:
+		batch.append(item)
+		if len(batch) >= size:
+			yield batch
+			batch = []
+	if batch:
+		yield batch
+
+
+#  Foreign keys
+#  ----------------------------------------------------------------
+
+def _resolve(model, raw_rows, key):
+	"""Map each row's <key>_id / <key>_name to an id, or to an error."""
+	ids = set()
+	names = set()
+	for row in raw_rows:
+		if row.get(key + '_id') not in (None, ''):
+			try:
+				ids.add(int(row[key + '_id']))
+			except (TypeError, ValueError):
+				pass
+		elif row.get(key + '_name'):
+			names.add(row[key + '_name'].strip())
+
+	known_ids = set()
+	if ids:
+		known_ids = {id for id, in db.session.query(model.id).filter(model.id.in_(ids))}
+	by_name = {}
+	if names:
+		for name, id in db.session.query(model.name, model.id).filter(model.name.in_(names)):
+			by_name.setdefault(name, []).append(id)
+
+	def lookup(row):
+		if row.get(key + '_id') not in (None, ''):
+			try:
+				id = int(row[key + '_id'])
+			except (TypeError, ValueError):
+				return None, 'Not a valid id.'
+			return (id, None) if id in known_ids else (None, 'No such %s.' % key)
+		name = (row.get(key + '_name') or '').strip()
+		if not name:
+			return None, 'This field is required.'
+		matches = by_name.get(name, [])
+		if len(matches) != 1:
+			return None, 'No such %s.' % key if not matches else 'Ambiguous %s name.' % key
+		return matches[0], None
+	return lookup
+
+
+#  Loading
+#  ----------------------------------------------------------------
+
+def _copy_value(value):
+	if value is None:
+		return '\\N'
+	if isinstance(value, bool):
+		return 't' if value else 'f'
+	if isinstance(value, list):
+		return '{%s}' % ','.join('"%s"' % item.replace('\\', '\\\\').replace('"', '\\"') for item in value)
+	if isinstance(value, datetime):
+		return value.isoformat(' ')
+	return value
+
+
+def _load(table, columns, rows):
+	connection = db.session.connection()
+	if connection.dialect.name == 'postgresql':
+		buffer = io.StringIO()
+		writer = csv.writer(buffer)
+		for row in rows:
+			writer.writerow([_copy_value(row[column]) for column in columns])
+		buffer.seek(0)
+		cursor = connection.connection.cursor()
+		cursor.copy_expert('COPY "%s" (%s) FROM STDIN WITH (FORMAT csv, NULL \'\\N\')'
+			% (table.name, ', '.join(columns)), buffer)
+	else:
+		connection.execute(table.insert(), rows)
+
+
+def import_rows(kind_name, rows, on_reject, batch_size=BATCH_SIZE, check=False):
+	"""Load ``rows`` ((line, dict) pairs); returns counts per outcome.
+
+	``on_reject(line, row, errors)`` is called for every rejected row. Each
+	batch commits on its own, so a bad row never costs the rest. With
+	``check`` nothing is kept: the counts say what would have loaded.
+	"""
+	kind = KINDS[kind_name]
+	table = kind.model.__table__
+	loaded = 'valid' if check else 'inserted'
+	stats = {loaded: 0, 'rejected': 0}
+	cache = None if check else current_app.extensions.get('fragment_cache')
+
+	for batch in _batches(rows, batch_size):
+		if kind.model is Show:
+			venue_of = _resolve(Venue, [row for _, row in batch], 'venue')
+			artist_of = _resolve(Artist, [row for _, row in batch], 'artist')
+
+		accepted = {}
+		for line, row in batch:
+			if '__invalid__' in row:
+				stats['rejected'] += 1
+				on_reject(line, row, {'__row__': ['Not a JSON object.']})
+				continue
+			values, errors = kind.validate(row)
+			if kind.model is Venue:
+				latitude, longitude = values.get('latitude'), values.get('longitude')
+				if (latitude is None) != (longitude is None):
+					errors.setdefault('latitude', ['Give both latitude and longitude, or neither.'])
+				located = latitude is not None and longitude is not None
+				values['geohash'] = geohash(latitude, longitude) if located else None
+			if kind.model is Show:
+				values['venue_id'], error = venue_of(row)
+				if error:
+					errors['venue'] = [error]
+				values['artist_id'], error = artist_of(row)
+				if error:
+					errors['artist'] = [error]
+			if errors:
+				stats['rejected'] += 1
+				on_reject(line, row, errors)
+			else:
+				accepted[line] = (row, values)
+
+		if kind.model is Show:
+			if not check:
+				# until this batch commits, no show is added that it was not checked against
+				lock_bulk()
+			clashes = conflicts({line: values for line, (_, values) in accepted.items()})
+			for line, errors in sorted(clashes.items()):
+				row, _ = accepted.pop(line)
+				stats['rejected'] += 1
+				on_reject(line, row, errors)
+
+		accepted = [values for _, values in accepted.values()]
+		if accepted:
+			_load(table, kind.columns, accepted)
+			if kind.model is Show:
+				recount([values['venue_id'] for values in accepted], [values['artist_id'] for values in accepted])
+			if check:
+				# later batches are checked against this one
+				db.session.flush()
+			else:
+				db.session.commit()
+			stats[loaded] += len(accepted)
+			if kind.model is Show and cache is not None:
+				cache.delete(*{key for values in accepted
+					for key in cache.show_keys(values['venue_id'], values['artist_id'])})
+	if check:
+		db.session.rollback()
+	return stats
+
+
+def format_for(filename, default='csv'):
+	if filename.endswith(('.ndjson', '.jsonl')):
+		return 'ndjson'
+	if filename.endswith('.csv'):
+		return 'csv'
+	return default
+
+
+@click.command('import')
+@click.argument('kind', type=click.Choice(sorted(KINDS)))
+@click.argument('source', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']),
+	help='Input format; guessed from the file extension by default.')
+@click.option('--errors', 'errors_path', type=click.Path(dir_okay=False),
+	help='Where rejected rows go (NDJSON). Defaults to SOURCE.rejected.ndjson.')
+@click.option('--batch-size', type=int, default=BATCH_SIZE, show_default=True)
+@click.option('--check', is_flag=True, help='Only validate: report the rejected rows, keep nothing.')
+@with_appcontext
+def import_command(kind, source, fmt, errors_path, batch_size, check):
+	"""Bulk-load venues, artists or shows from a CSV or NDJSON file."""
+	fmt = fmt or format_for(source)
+	errors_path = errors_path or source + '.rejected.ndjson'
+	started = datetime.now()
+	with open(source, newline='', encoding='utf-8') as stream, \
+			open(errors_path, 'w', encoding='utf-8') as errors_out:
+		def on_reject(line, row, errors):
+			errors_out.write(json.dumps({'line': line, 'errors': errors, 'row': row}) + '\n')
+		stats = import_rows(kind, read_rows(stream, fmt), on_reject, batch_size, check)
+	seconds = (datetime.now() - started).total_seconds()
+	loaded = stats['valid' if check else 'inserted']
+	click.echo('%d %s %s, %d rejected (%s) in %.1fs, %d rows/s' % (
+		loaded, kind, 'valid' if check else 'imported', stats['rejected'], errors_path, seconds,
+		(loaded + stats['rejected']) / max(seconds, 1e-6)))
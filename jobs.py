@@ -0,0 +1,329 @@
+#----------------------------------------------------------------------------#
+# Background jobs: side effects of the create / edit handlers that need not
+# hold up the response.
+#
+# A handler says what happened before it commits:
+#
+#   emit('venue.edited', venue_id=venue.id)
+#
+# and each task registered for that event (@task(name, on=...)) is queued
+# with those arguments; nothing is queued unless the transaction commits.
+# Where the jobs run depends on JOBS_BACKEND:
+#
+#   thread     a thread pool in the web process, once the commit is done.
+#              Jobs still queued when the process exits are lost.
+#   inline     in the committing request, right after the commit (tests,
+#              debugging); a failed job is logged, not retried.
+#   database   a row in the job table, inserted in the handler's
+#              transaction, run by `flask jobs work`. Workers claim rows
+#              with SELECT ... FOR UPDATE SKIP LOCKED, so any number of
+#              them can share the table. SQLite has no row locks; there
+#              `flask jobs work` runs a single worker thread.
+#
+# A job that raises is retried after JOBS_BACKOFF_SECONDS, doubling per
+# attempt, until it has run JOBS_MAX_ATTEMPTS times; the database backend
+# then keeps its row with failed_at set (`flask jobs list`, `flask jobs
+# retry`). A worker runs each job in a savepoint of the transaction that
+# deletes its row, so the job's own writes commit with it; but a job may
+# still run twice (a worker dying before its commit), keep tasks idempotent.
+#
+# Tasks that act on per-process state, like dropping entries of the LRU
+# page cache, only reach the web processes with the thread and inline
+# backends; with the database backend use the Redis cache.
+#----------------------------------------------------------------------------#
+import multiprocessing
+import threading
+import traceback
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event, func, select, update
+
+from models import db, Venue, Artist, Job
+
+# task name -> function
+TASKS = {}
+# event -> [(task name, config flag or None)]
+HOOKS = {}
+
+# session.info key of the jobs the thread / inline backends start on commit
+PENDING = 'pending_jobs'
+
+
+def task(name, on=(), when=None):
+	"""Register a task, queued by each event in ``on`` while config[``when``] is set."""
+	def register(function):
+		TASKS[name] = function
+		for event_name in on:
+			HOOKS.setdefault(event_name, []).append((name, when))
+		return function
+	return register
+
+
+def run(name, args):
+	function = TASKS.get(name)
+	if function is None:
+		raise LookupError('No task named %r' % name)
+	function(**args)
+
+
+class JobQueue(object):
+	def __init__(self, app=None):
+		self.app = None
+		self.backend = 'thread'
+		self.executor = None
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		self.app = app
+		self.backend = app.config.get('JOBS_BACKEND', 'thread')
+		self.max_attempts = app.config.get('JOBS_MAX_ATTEMPTS', 5)
+		self.backoff = app.config.get('JOBS_BACKOFF_SECONDS', 10)
+		self.backoff_max = app.config.get('JOBS_BACKOFF_MAX_SECONDS', 600)
+		self.poll = app.config.get('JOBS_POLL_SECONDS', 1)
+		if self.backend in ('thread', 'inline'):
+			if self.backend == 'thread':
+				# threads start on the first job, so after a server forks its workers
+				self.executor = ThreadPoolExecutor(app.config.get('JOBS_THREADS', 2), thread_name_prefix='fyyur-job')
+			event.listen(SignallingSession, 'after_commit', self._committed)
+			event.listen(SignallingSession, 'after_soft_rollback', self._rolled_back)
+		elif self.backend != 'database':
+			raise ValueError('Unknown JOBS_BACKEND %r' % self.backend)
+		app.extensions['job_queue'] = self
+
+	def enqueue(self, task_name, **args):
+		"""Queue task ``task_name`` to run once the current transaction commits."""
+		if self.backend == 'database':
+			db.session.add(Job(task=task_name, args=args))
+		else:
+			# begin the transaction, so that rolling it back drops the job
+			db.session.connection()
+			db.session.info.setdefault(PENDING, []).append((task_name, args))
+
+	def emit(self, event_name, **args):
+		"""Queue the tasks registered for ``event_name``."""
+		for name, when in HOOKS.get(event_name, ()):
+			if when is None or self.app.config.get(when):
+				self.enqueue(name, **args)
+
+	def delay(self, attempts):
+		"""Seconds before the next try of a job that failed ``attempts`` times."""
+		return min(self.backoff_max, self.backoff * 2 ** (attempts - 1))
+
+	def _committed(self, session):
+		for name, args in session.info.pop(PENDING, ()):
+			if self.executor is not None:
+				self.executor.submit(self._run, name, args)
+			else:
+				# the committing session emits no more SQL until its commit
+				# returns, so the job gets a thread (and session) of its own
+				worker = threading.Thread(target=self._run, args=(name, args), name='fyyur-job-inline')
+				worker.start()
+				worker.join()
+
+	def _rolled_back(self, session, transaction):
+		if transaction.parent is None:
+			session.info.pop(PENDING, None)
+
+	def _run(self, name, args, attempt=1):
+		"""Try a job once; a timer hands it back to the pool for the next try."""
+		with self.app.app_context():
+			try:
+				run(name, args)
+				db.session.commit()
+				return
+			except Exception:
+				db.session.rollback()
+				if self.executor is None or attempt >= self.max_attempts:
+					self.app.logger.exception('job %s %r failed on attempt %d, giving up', name, args, attempt)
+					return
+				self.app.logger.warning('job %s %r failed, retrying', name, args, exc_info=True)
+		# waiting on a timer keeps the pool's threads free for other jobs
+		retry = threading.Timer(self.delay(attempt), self.executor.submit, (self._run, name, args, attempt + 1))
+		retry.daemon = True
+		retry.start()
+
+
+def emit(event_name, **args):
+	current_app.extensions['job_queue'].emit(event_name, **args)
+
+
+#  Database backend
+#  ----------------------------------------------------------------
+
+def claim(now):
+	"""The earliest due job, locked for this transaction; other workers skip it."""
+	return db.session.execute(select(Job)
+		.where(Job.failed_at.is_(None), Job.run_at <= now)
+		.order_by(Job.run_at, Job.id)
+		.limit(1)
+		.with_for_update(skip_locked=True)).scalar()
+
+
+def work_one(queue):
+	"""Run one due job; False when there was none."""
+	job = claim(datetime.now())
+	if job is None:
+		db.session.rollback()
+		return False
+	try:
+		with db.session.begin_nested():
+			run(job.task, job.args)
+	except Exception:
+		job.attempts += 1
+		job.last_error = traceback.format_exc()
+		if job.attempts >= queue.max_attempts:
+			job.failed_at = datetime.now()
+			current_app.logger.error('job %d (%s) failed %d times, giving up', job.id, job.task, job.attempts)
+		else:
+			job.run_at = datetime.now() + timedelta(seconds=queue.delay(job.attempts))
+	else:
+		db.session.delete(job)
+	db.session.commit()
+	return True
+
+
+def work(app, stop, once):
+	"""Worker thread: run due jobs until ``stop`` is set (or, ``once``, none is due)."""
+	queue = app.extensions['job_queue']
+	with app.app_context():
+		while not stop.is_set():
+			try:
+				ran = work_one(queue)
+			except Exception:
+				# the database is away; keep polling
+				app.logger.exception('job worker failed to claim a job')
+				db.session.rollback()
+				ran = False
+			if not ran:
+				if once:
+					return
+				stop.wait(queue.poll)
+
+
+def work_threads(app, threads, once):
+	stop = threading.Event()
+	workers = [threading.Thread(target=work, args=(app, stop, once), name='fyyur-jobs-%d' % i)
+		for i in range(threads)]
+	for worker in workers:
+		worker.start()
+	try:
+		while any(worker.is_alive() for worker in workers):
+			for worker in workers:
+				worker.join(0.5)
+	except KeyboardInterrupt:
+		# let the running jobs finish
+		stop.set()
+		for worker in workers:
+			worker.join()
+
+
+#  Tasks
+#  ----------------------------------------------------------------
+
+@task('pages.related', on=('venue.edited', 'artist.edited'))
+def drop_related_pages(venue_id=None, artist_id=None):
+	"""Drop the cached pages that list the edited venue / artist next to a show."""
+	cache = current_app.extensions['fragment_cache']
+	if venue_id is not None:
+		cache.delete(*cache.venue_related_keys(venue_id))
+	if artist_id is not None:
+		cache.delete(*cache.artist_related_keys(artist_id))
+
+
+@task('image_link.check', on=('venue.created', 'venue.edited', 'artist.created', 'artist.edited'),
+	when='CHECK_IMAGE_LINKS')
+def check_image_link(venue_id=None, artist_id=None):
+	"""Log the venue's / artist's image_link when it does not lead to an image."""
+	model, id = (Venue, venue_id) if venue_id is not None else (Artist, artist_id)
+	row = db.session.get(model, id)
+	if row is None or not row.image_link:
+		return
+	link = row.image_link
+	if not link.lower().startswith(('http://', 'https://')):
+		problem = 'not an http(s) URL'
+	else:
+		request = urllib.request.Request(link, method='HEAD', headers={'User-Agent': 'fyyur'})
+		try:
+			with urllib.request.urlopen(request, timeout=current_app.config.get('IMAGE_LINK_TIMEOUT', 5)) as response:
+				content_type = response.headers.get('Content-Type', '')
+			problem = None if content_type.startswith('image/') else 'serves %s' % (content_type or 'no Content-Type')
+		except urllib.error.HTTPError as error:
+			# unreachable hosts and timeouts raise, and are tried again later
+			if error.code >= 500 or error.code == 429:
+				raise
+			problem = 'HTTP %d' % error.code
+	if problem:
+		current_app.logger.warning('%s %d: image_link %s is broken (%s)', model.__tablename__, id, link, problem)
+
+
+#  Commands
+#  ----------------------------------------------------------------
+
+jobs_command = AppGroup('jobs', help='Run and inspect the background jobs of the database backend.')
+
+
+@jobs_command.command('work')
+@click.option('--threads', type=int, help='Worker threads per process (default JOBS_THREADS).')
+@click.option('--processes', type=int, default=1, show_default=True, help='Worker processes.')
+@click.option('--once', is_flag=True, help='Stop once no job is due.')
+def work_command(threads, processes, once):
+	"""Run queued jobs."""
+	app = current_app._get_current_object()
+	threads = threads or app.config.get('JOBS_THREADS', 2)
+	if db.engine.dialect.name == 'sqlite' and threads * processes > 1:
+		click.echo('SQLite has no row locks, running a single worker thread', err=True)
+		threads = processes = 1
+	if processes <= 1:
+		work_threads(app, threads, once)
+		return
+	# forked workers must not share the parent's connections
+	db.engine.dispose()
+	context = multiprocessing.get_context('fork')
+	children = [context.Process(target=work_threads, args=(app, threads, once), name='fyyur-jobs-p%d' % i)
+		for i in range(processes)]
+	for child in children:
+		child.start()
+	try:
+		for child in children:
+			child.join()
+	except KeyboardInterrupt:
+		# the children got the interrupt too, and finish their jobs
+		for child in children:
+			child.join()
+
+
+@jobs_command.command('list')
+def list_command():
+	"""Count the queued jobs and show the failed ones."""
+	now = datetime.now()
+	due = db.session.scalar(select(func.count()).where(Job.failed_at.is_(None), Job.run_at <= now))
+	later = db.session.scalar(select(func.count()).where(Job.failed_at.is_(None), Job.run_at > now))
+	click.echo('%d due, %d waiting to retry' % (due, later))
+	failed = db.session.execute(select(Job).where(Job.failed_at.isnot(None)).order_by(Job.failed_at)).scalars().all()
+	for job in failed:
+		error = (job.last_error or '').strip().splitlines()
+		click.echo('job %d %s %s: failed %s after %d attempts: %s' % (
+			job.id, job.task, job.args, job.failed_at, job.attempts, error[-1] if error else ''))
+	click.echo('%d failed' % len(failed))
+
+
+@jobs_command.command('retry')
+@click.argument('ids', type=int, nargs=-1)
+def retry_command(ids):
+	"""Queue failed jobs (all, or those with the given ids) again."""
+	criteria = [Job.failed_at.isnot(None)]
+	if ids:
+		criteria.append(Job.id.in_(ids))
+	rows = db.session.execute(update(Job).where(*criteria)
+		.values(failed_at=None, attempts=0, run_at=datetime.now())
+		.execution_options(synchronize_session=False)).rowcount
+	db.session.commit()
+	click.echo('%d jobs queued again' % rows)
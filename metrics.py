@@ -0,0 +1,462 @@
+#----------------------------------------------------------------------------#
+# /metrics, in the Prometheus text exposition format.
+#
+# Request metrics are labelled by Flask endpoint (show_venue,
+# api.search_artists, ...): request counts by status, latency, response
+# size, DB time and query count per request, server errors and in-flight
+# requests, plus the render time of each top-level template.
+#
+# Values live in a per-process store. With METRICS_DIR set (required under
+# multi-process gunicorn, and the directory must be emptied before the
+# master starts) each process keeps its values in an mmap'd file there and
+# a scrape of any worker adds up the files of all of them. In-flight gauges
+# only count files of processes that are still alive. Without METRICS_DIR
+# values stay in memory and cover the answering process only.
+#
+# Pool values (dbpool.py) always come from the process answering the scrape.
+#----------------------------------------------------------------------------#
+import bisect
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+from flask import Blueprint, Response, _app_ctx_stack, _request_ctx_stack, current_app, request
+from jinja2 import Template
+
+from models import db
+from dbpool import POOL_STATS, pool_status
+
+metrics = Blueprint('metrics', __name__)
+
+
+#  Value stores
+#  ----------------------------------------------------------------
+
+class DictStore(object):
+	"""Values of this process only, in memory."""
+
+	def __init__(self):
+		self._values = {}
+		self._lock = threading.Lock()
+
+	def add(self, updates):
+		"""Apply (key, amount) pairs."""
+		values = self._values
+		with self._lock:
+			for key, amount in updates:
+				values[key] = values.get(key, 0.0) + amount
+
+	def collect(self):
+		with self._lock:
+			return dict(self._values)
+
+
+DOUBLE = struct.Struct('d')
+
+
+def _entries(data, used):
+	"""Yield (key, value, value offset) from an mmap'd store file's bytes."""
+	pos = 8
+	while pos < used:
+		length, = struct.unpack_from('i', data, pos)
+		key = bytes(data[pos + 4:pos + 4 + length]).decode('utf-8')
+		pos += 4 + length
+		pos += -pos % 8
+		yield key, struct.unpack_from('d', data, pos)[0], pos
+		pos += 8
+
+
+class MmapStore(object):
+	"""Values of one process in ``<prefix>_<pid>.db``, readable by all.
+
+	Layout: a 4-byte "bytes used" header padded to 8, then entries of a
+	4-byte key length, the UTF-8 key padded to 8 bytes and a float64.
+	Entries are only appended and the header is written last, so a reader
+	never sees a half-written entry.
+	"""
+	INITIAL_SIZE = 1 << 16
+
+	def __init__(self, directory, prefix):
+		self.directory = directory
+		self.prefix = prefix
+		self._lock = threading.Lock()
+		self._pid = None
+
+	def _open(self):
+		self._pid = os.getpid()
+		self._file = open(os.path.join(self.directory, '%s_%d.db' % (self.prefix, self._pid)), 'a+b')
+		size = os.fstat(self._file.fileno()).st_size
+		if size == 0:
+			size = self.INITIAL_SIZE
+			self._file.truncate(size)
+		self._map = mmap.mmap(self._file.fileno(), size)
+		self._used = struct.unpack_from('i', self._map, 0)[0] or 8
+		self._offsets = {key: pos for key, _, pos in _entries(self._map, self._used)}
+
+	def _append(self, key):
+		encoded = key.encode('utf-8')
+		entry = struct.pack('i', len(encoded)) + encoded
+		entry += b'\0' * (-(self._used + len(entry)) % 8) + struct.pack('d', 0.0)
+		if self._used + len(entry) > len(self._map):
+			size = len(self._map)
+			while self._used + len(entry) > size:
+				size *= 2
+			self._file.truncate(size)
+			self._map.close()
+			self._map = mmap.mmap(self._file.fileno(), size)
+		self._map[self._used:self._used + len(entry)] = entry
+		self._used += len(entry)
+		struct.pack_into('i', self._map, 0, self._used)
+		self._offsets[key] = self._used - 8
+		return self._used - 8
+
+	def add(self, updates):
+		"""Apply (key, amount) pairs."""
+		with self._lock:
+			if self._pid != os.getpid():
+				# first use, or first use after a fork: each process has its own file
+				self._open()
+			offsets = self._offsets
+			for key, amount in updates:
+				pos = offsets.get(key)
+				if pos is None:
+					pos = self._append(key)
+				value, = DOUBLE.unpack_from(self._map, pos)
+				DOUBLE.pack_into(self._map, pos, value + amount)
+
+	def collect(self, live_only=False):
+		values = {}
+		for path in glob.glob(os.path.join(self.directory, '%s_*.db' % self.prefix)):
+			if live_only and not _alive(int(path.rsplit('_', 1)[1][:-3])):
+				continue
+			with open(path, 'rb') as f:
+				data = f.read()
+			if len(data) < 8:
+				continue
+			for key, value, _ in _entries(data, struct.unpack_from('i', data, 0)[0]):
+				values[key] = values.get(key, 0.0) + value
+		return values
+
+
+def _alive(pid):
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return False
+	except PermissionError:
+		pass
+	return True
+
+
+#  Metrics
+#  ----------------------------------------------------------------
+
+class Metric(object):
+	kind = None
+
+	def __init__(self, name, help, labels, live=False):
+		self.name = name
+		self.help = help
+		self.labels = labels
+		self.live = live
+		# label values -> store key, so the hot path never builds strings
+		self._keys = {}
+		REGISTRY.append(self)
+
+	def _key(self, sample, values):
+		key = self._keys.get((sample, values))
+		if key is None:
+			key = self._keys[sample, values] = json.dumps([self.name, sample, values])
+		return key
+
+	def _store(self):
+		return STORES['live' if self.live else 'values']
+
+
+class Counter(Metric):
+	kind = 'counter'
+
+	def updates(self, values, amount=1.0):
+		return ((self._key('', values), amount),)
+
+	def inc(self, values, amount=1.0):
+		self._store().add(self.updates(values, amount))
+
+
+class Gauge(Counter):
+	kind = 'gauge'
+
+	def dec(self, values, amount=1.0):
+		self._store().add(self.updates(values, -amount))
+
+
+class Histogram(Metric):
+	kind = 'histogram'
+
+	def __init__(self, name, help, labels, buckets):
+		Metric.__init__(self, name, help, labels)
+		self.buckets = tuple(buckets)
+		self._bucket_labels = [repr(float(bound)) for bound in self.buckets] + ['+Inf']
+		# label values -> keys()
+		self._series = {}
+
+	def updates(self, values, amount):
+		return self.observed(self.keys(values), amount)
+
+	def keys(self, values):
+		"""Store keys of one series: ([bucket keys], _sum key, _count key)."""
+		keys = self._series.get(values)
+		if keys is None:
+			keys = self._series[values] = ([self._key(index, values) for index in range(len(self.buckets) + 1)],
+				self._key('_sum', values), self._key('_count', values))
+		return keys
+
+	def observed(self, keys, amount):
+		# one bucket per observation; made cumulative when exposed
+		buckets, sum_key, count_key = keys
+		return (
+			(buckets[bisect.bisect_left(self.buckets, amount)], 1.0),
+			(sum_key, amount),
+			(count_key, 1.0),
+		)
+
+	def observe(self, values, amount):
+		self._store().add(self.updates(values, amount))
+
+
+REGISTRY = []
+
+STORES = {'values': DictStore(), 'live': DictStore()}
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+REQUESTS = Counter('fyyur_http_requests_total', 'Requests answered.', ('endpoint', 'method', 'status'))
+ERRORS = Counter('fyyur_http_server_errors_total', 'Requests answered with a 5xx status.', ('endpoint', 'status'))
+IN_PROGRESS = Gauge('fyyur_http_requests_in_progress', 'Requests being handled.', ('endpoint',), live=True)
+LATENCY = Histogram('fyyur_http_request_duration_seconds', 'Time to build the response.', ('endpoint',), LATENCY_BUCKETS)
+RESPONSE_SIZE = Histogram('fyyur_http_response_size_bytes', 'Response body size, when known up front.', ('endpoint',), SIZE_BUCKETS)
+DB_TIME = Histogram('fyyur_http_db_seconds', 'Time spent in SQL per request.', ('endpoint',), LATENCY_BUCKETS)
+DB_QUERIES = Counter('fyyur_http_db_queries_total', 'SQL statements issued.', ('endpoint',))
+RENDER_TIME = Histogram('fyyur_template_render_seconds', 'Time to render a template.', ('template',), LATENCY_BUCKETS)
+
+
+class TimedTemplate(Template):
+	"""Template whose top-level renders are recorded in RENDER_TIME."""
+
+	def render(self, *args, **kwargs):
+		start = time.perf_counter()
+		try:
+			return Template.render(self, *args, **kwargs)
+		finally:
+			RENDER_TIME.observe((self.name or '<string>',), time.perf_counter() - start)
+
+
+class EndpointSeries(object):
+	"""Store keys of one endpoint's request metrics, resolved on its first request."""
+
+	def __init__(self, endpoint):
+		labels = (endpoint,)
+		self.labels = labels
+		self.started = IN_PROGRESS.updates(labels, 1.0)
+		self.finished = IN_PROGRESS.updates(labels, -1.0)
+		self.latency = LATENCY.keys(labels)
+		self.size = RESPONSE_SIZE.keys(labels)
+		self.db_time = DB_TIME.keys(labels)
+		self.db_queries = DB_QUERIES._key('', labels)
+		# (method, status) -> key, and status -> key for the 5xx
+		self.requests = {}
+		self.errors = {}
+
+	def request_key(self, method, status):
+		key = self.requests.get((method, status))
+		if key is None:
+			key = self.requests[method, status] = REQUESTS._key('', self.labels + (method, str(status)))
+		return key
+
+	def error_key(self, status):
+		key = self.errors.get(status)
+		if key is None:
+			key = self.errors[status] = ERRORS._key('', self.labels + (str(status),))
+		return key
+
+
+class RequestMetrics(object):
+	def __init__(self, app=None):
+		# endpoint -> EndpointSeries
+		self._series = {}
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		directory = app.config.get('METRICS_DIR')
+		if directory:
+			os.makedirs(directory, exist_ok=True)
+			STORES['values'] = MmapStore(directory, 'values')
+			STORES['live'] = MmapStore(directory, 'live')
+		app.jinja_env.template_class = TimedTemplate
+		app.before_request(self._start)
+		app.after_request(self._finish)
+		app.teardown_request(self._teardown)
+		app.register_blueprint(metrics)
+
+	def _series_of(self, req):
+		# unmatched URLs share one label instead of one per path
+		endpoint = req.endpoint or 'unmatched'
+		series = self._series.get(endpoint)
+		if series is None:
+			series = self._series[endpoint] = EndpointSeries(endpoint)
+		return series
+
+	# Each context-local lookup (request, g) costs over a microsecond, more
+	# than the rest of a hook: the request is taken once from the context
+	# stack, and carries the start time and series to _finish.
+
+	def _start(self):
+		req = _request_ctx_stack.top.request
+		req.metrics_series = series = self._series_of(req)
+		req.metrics_started = time.perf_counter()
+		STORES['live'].add(series.started)
+
+	def _finish(self, response):
+		req = _request_ctx_stack.top.request
+		started = getattr(req, 'metrics_started', None)
+		if started is None:
+			return response
+		elapsed = time.perf_counter() - started
+		req.metrics_started = None
+		series = req.metrics_series
+		STORES['live'].add(series.finished)
+
+		# everything else in one store update
+		status = response.status_code
+		updates = list(LATENCY.observed(series.latency, elapsed))
+		updates.append((series.request_key(req.method, status), 1.0))
+		if status >= 500:
+			updates.append((series.error_key(status), 1.0))
+		size = response.content_length
+		if size is not None:
+			updates.extend(RESPONSE_SIZE.observed(series.size, size))
+		# still set: sqltiming's after_request hook was registered first, so runs after this one
+		queries = _app_ctx_stack.top.g.get('sql_queries')
+		if queries is not None:
+			updates.extend(DB_TIME.observed(series.db_time, queries.seconds))
+			updates.append((series.db_queries, queries.count))
+		STORES['values'].add(updates)
+		return response
+
+	def _teardown(self, exc):
+		# the response never reached _finish (it raised on the way)
+		if getattr(request, 'metrics_started', None) is not None:
+			request.metrics_started = None
+			STORES['live'].add(request.metrics_series.finished)
+
+
+#  Exposition
+#  ----------------------------------------------------------------
+
+def _label_text(names, values):
+	return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+		for name, value in zip(names, values))
+
+
+def _samples(metric, values):
+	"""Exposition lines of one metric from collected store values."""
+	series = {}
+	for (sample, labels), value in values.items():
+		series.setdefault(labels, {})[sample] = value
+	lines = []
+	for labels in sorted(series):
+		samples = series[labels]
+		text = _label_text(metric.labels, labels)
+		if metric.kind != 'histogram':
+			lines.append('%s{%s} %r' % (metric.name, text, samples.get('', 0.0)))
+			continue
+		cumulative = 0.0
+		for index, bound in enumerate(metric._bucket_labels):
+			cumulative += samples.get(index, 0.0)
+			lines.append('%s_bucket{%s,le="%s"} %r' % (metric.name, text, bound, cumulative))
+		lines.append('%s_sum{%s} %r' % (metric.name, text, samples.get('_sum', 0.0)))
+		lines.append('%s_count{%s} %r' % (metric.name, text, samples.get('_count', 0.0)))
+	return lines
+
+
+def request_metrics():
+	# metric name -> {(sample, label values): value}
+	by_metric = {}
+	for name, store in STORES.items():
+		collected = store.collect(live_only=True) if name == 'live' and isinstance(store, MmapStore) \
+			else store.collect()
+		for key, value in collected.items():
+			metric, sample, labels = json.loads(key)
+			by_metric.setdefault(metric, {})[sample, tuple(labels)] = value
+	lines = []
+	for metric in REGISTRY:
+		values = by_metric.get(metric.name, {})
+		lines.append('# HELP %s %s' % (metric.name, metric.help))
+		lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+		lines.extend(_samples(metric, values))
+	return lines
+
+
+POOL_COUNTERS = [
+	('connects', 'fyyur_db_pool_connects_total', 'New database connections opened.'),
+	('checkouts', 'fyyur_db_pool_checkouts_total', 'Connections checked out of the pool.'),
+	('checkins', 'fyyur_db_pool_checkins_total', 'Connections returned to the pool.'),
+	('invalidations', 'fyyur_db_pool_invalidations_total', 'Connections invalidated (disconnects, failed pings).'),
+	('timeouts', 'fyyur_db_pool_timeouts_total', 'Checkouts that gave up after DB_POOL_TIMEOUT.'),
+	('wait_seconds_total', 'fyyur_db_pool_wait_seconds_total', 'Time spent acquiring connections.'),
+]
+
+POOL_GAUGES = [
+	('wait_seconds_max', 'fyyur_db_pool_wait_seconds_max', 'Longest single checkout wait.'),
+	('size', 'fyyur_db_pool_size', 'Configured pool size.'),
+	('checked_in', 'fyyur_db_pool_checked_in', 'Idle connections in the pool.'),
+	('checked_out', 'fyyur_db_pool_checked_out', 'Connections in use.'),
+	('overflow', 'fyyur_db_pool_overflow', 'Connections open beyond the pool size.'),
+]
+
+
+def _format(families, values):
+	lines = []
+	for key, name, help, kind in families:
+		if key not in values:
+			continue
+		lines.append('# HELP %s %s' % (name, help))
+		lines.append('# TYPE %s %s' % (name, kind))
+		lines.append('%s %s' % (name, repr(values[key])))
+	return lines
+
+
+def pool_metrics():
+	values = POOL_STATS.snapshot()
+	values.update(pool_status(db.engine.pool))
+	return _format([family + ('counter',) for family in POOL_COUNTERS] +
+		[family + ('gauge',) for family in POOL_GAUGES], values)
+
+
+def replica_metrics():
+	router = current_app.extensions.get('replica_router')
+	if router is None or not router.replicas:
+		return []
+	status = sorted(router.status().items())
+	lines = [
+		'# HELP fyyur_db_replica_healthy Whether reads are sent to the replica.',
+		'# TYPE fyyur_db_replica_healthy gauge',
+	]
+	lines.extend('fyyur_db_replica_healthy{replica="%s"} %d' % (key, healthy) for key, (healthy, lag) in status)
+	lines.append('# HELP fyyur_db_replica_lag_seconds Replication lag at the last health check.')
+	lines.append('# TYPE fyyur_db_replica_lag_seconds gauge')
+	lines.extend('fyyur_db_replica_lag_seconds{replica="%s"} %r' % (key, lag)
+		for key, (healthy, lag) in status if lag is not None)
+	return lines
+
+
+@metrics.route('/metrics')
+def expose():
+	return Response('\n'.join(request_metrics() + pool_metrics() + replica_metrics()) + '\n',
+		mimetype='text/plain; version=0.0.4')
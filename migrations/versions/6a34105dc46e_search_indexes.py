@@ -0,0 +1,49 @@
+"""search indexes
+
+Revision ID: 6a34105dc46e
+Revises: 51fcc8cefcff
+Create Date: 2026-10-18 09:12:04.118230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a34105dc46e'
+down_revision = '51fcc8cefcff'
+branch_labels = None
+depends_on = None
+
+
+TRIGRAM_INDEXES = [
+    ('ix_venue_name_trgm', 'venue', 'name'),
+    ('ix_venue_city_trgm', 'venue', 'city'),
+    ('ix_artist_name_trgm', 'artist', 'name'),
+    ('ix_artist_city_trgm', 'artist', 'city'),
+]
+GENRE_INDEXES = [
+    ('ix_venue_genres', 'venue'),
+    ('ix_artist_genres', 'artist'),
+]
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # build without blocking writes on the live tables
+    with op.get_context().autocommit_block():
+        for name, table, column in TRIGRAM_INDEXES:
+            op.create_index(name, table, [column], postgresql_using='gin',
+                            postgresql_ops={column: 'gin_trgm_ops'},
+                            postgresql_concurrently=True)
+        for name, table in GENRE_INDEXES:
+            op.create_index(name, table, ['genres'], postgresql_using='gin',
+                            postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table in GENRE_INDEXES:
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
+        for name, table, column in TRIGRAM_INDEXES:
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
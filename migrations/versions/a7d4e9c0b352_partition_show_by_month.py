@@ -0,0 +1,73 @@
+"""partition show by month of start_time
+
+Revision ID: a7d4e9c0b352
+Revises: f3b8c2d71a06
+Create Date: 2026-10-18 22:03:11.417530
+
+PostgreSQL only. The rows are copied into the new partitioned table, so the
+show table is locked for the length of the copy.
+"""
+from datetime import datetime
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d4e9c0b352'
+down_revision = 'f3b8c2d71a06'
+branch_labels = None
+depends_on = None
+
+# as in config.PARTITION_MONTHS_AHEAD; `flask partitions roll` keeps it up
+MONTHS_AHEAD = 12
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def rebuild(source, partitioned):
+    """Copy ``source`` into a new show table and drop it."""
+    sequence = op.get_bind().exec_driver_sql(
+        "SELECT pg_get_serial_sequence('%s', 'id')" % source).scalar()
+    op.execute('ALTER SEQUENCE %s OWNED BY NONE' % sequence)
+    op.execute('CREATE TABLE show (LIKE %s INCLUDING DEFAULTS)%s'
+        % (source, ' PARTITION BY RANGE (start_time)' if partitioned else ''))
+    if partitioned:
+        op.execute('CREATE TABLE show_default PARTITION OF show DEFAULT')
+        first, last = op.get_bind().exec_driver_sql(
+            "SELECT date_trunc('month', min(start_time)), max(start_time) FROM %s" % source).first()
+        month = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        month, last = min(first or month, month), max(last or month, add_months(month, MONTHS_AHEAD))
+        while month <= last:
+            upper = add_months(month, 1)
+            op.execute("CREATE TABLE show_p%04d_%02d PARTITION OF show FOR VALUES FROM ('%s') TO ('%s')"
+                % (month.year, month.month, month.isoformat(' '), upper.isoformat(' ')))
+            month = upper
+    op.execute('INSERT INTO show SELECT * FROM %s' % source)
+    op.execute('DROP TABLE %s CASCADE' % source)
+    op.execute('ALTER SEQUENCE %s OWNED BY show.id' % sequence)
+
+    # a partitioned table's primary key has to hold the partition key
+    op.create_primary_key('show_pkey', 'show', ['id', 'start_time'] if partitioned else ['id'])
+    op.create_foreign_key('show_artist_id_fkey', 'show', 'artist', ['artist_id'], ['id'])
+    op.create_foreign_key('show_venue_id_fkey', 'show', 'venue', ['venue_id'], ['id'])
+    op.create_index('ix_show_start_time_id', 'show', ['start_time', 'id'])
+    op.create_index('ix_show_venue_id_start_time', 'show', ['venue_id', 'start_time'])
+    op.create_index('ix_show_artist_id_start_time', 'show', ['artist_id', 'start_time'])
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.rename_table('show', 'show_unpartitioned')
+    rebuild('show_unpartitioned', partitioned=True)
+
+
+def downgrade():
+    # archived months (flask partitions archive) stay where they are
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.rename_table('show', 'show_partitioned')
+    rebuild('show_partitioned', partitioned=False)
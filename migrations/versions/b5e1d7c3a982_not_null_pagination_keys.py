@@ -0,0 +1,43 @@
+"""not null keyset pagination keys
+
+Revision ID: b5e1d7c3a982
+Revises: e9a2b6d4f170
+Create Date: 2026-10-19 00:41:27.335810
+
+venue (state, city, id) and artist (name, id) are the keyset pagination
+keys of /venues, /artists and the API; a NULL in one ended the paging at
+that row. Existing NULLs become empty strings, which sort first.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5e1d7c3a982'
+down_revision = 'e9a2b6d4f170'
+branch_labels = None
+depends_on = None
+
+KEYS = (
+    ('venue', 'state', sa.String(length=120)),
+    ('venue', 'city', sa.String(length=120)),
+    ('artist', 'name', sa.String()),
+)
+
+
+def upgrade():
+    for table, column, type_ in KEYS:
+        op.execute("UPDATE %s SET %s = '' WHERE %s IS NULL" % (table, column, column))
+    for table in ('venue', 'artist'):
+        with op.batch_alter_table(table) as batch_op:
+            for key_table, column, type_ in KEYS:
+                if key_table == table:
+                    batch_op.alter_column(column, existing_type=type_, nullable=False)
+
+
+def downgrade():
+    for table in ('venue', 'artist'):
+        with op.batch_alter_table(table) as batch_op:
+            for key_table, column, type_ in KEYS:
+                if key_table == table:
+                    batch_op.alter_column(column, existing_type=type_, nullable=True)
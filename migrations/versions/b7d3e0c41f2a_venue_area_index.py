@@ -0,0 +1,28 @@
+"""venue area index
+
+Revision ID: b7d3e0c41f2a
+Revises: 6a34105dc46e
+Create Date: 2026-10-18 10:03:51.402715
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d3e0c41f2a'
+down_revision = '6a34105dc46e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_venue_state_city_id', 'venue', ['state', 'city', 'id'],
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_venue_state_city_id', table_name='venue',
+                      postgresql_concurrently=True)
@@ -0,0 +1,81 @@
+"""show duration and booking overlap constraints
+
+Revision ID: c4e1f8a29d57
+Revises: a7d4e9c0b352
+Create Date: 2026-10-18 23:26:48.110374
+
+Existing shows get the default duration, cut short where it would run into
+the next show of their venue or artist. Shows of one venue or artist that
+start at the same time cannot be told apart; the upgrade stops and lists
+them.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e1f8a29d57'
+down_revision = 'a7d4e9c0b352'
+branch_labels = None
+depends_on = None
+
+# as in models.DEFAULT_SHOW_MINUTES / MAX_SHOW_MINUTES
+DEFAULT_SHOW_MINUTES = 120
+MAX_SHOW_MINUTES = 24 * 60
+
+# as in bookings.OVERLAP_CONSTRAINT
+OVERLAP_CONSTRAINT = (
+    'ALTER TABLE %(table)s ADD CONSTRAINT %(table)s_%(booking)s_overlap EXCLUDE USING gist '
+    "(%(booking)s_id WITH =, tsrange(start_time, start_time + duration_minutes * interval '1 minute') WITH &&)")
+
+BOOKINGS = ('venue', 'artist')
+
+# minutes from each show to the next show of its venue or artist
+GAPS_SQL = """
+    SELECT id, start_time, floor(extract(epoch FROM least(
+        lead(start_time) OVER (PARTITION BY venue_id ORDER BY start_time, id),
+        lead(start_time) OVER (PARTITION BY artist_id ORDER BY start_time, id)) - start_time) / 60) AS gap
+    FROM show
+"""
+
+
+def tables():
+    """The partitions of show, or show itself when it is not partitioned."""
+    names = [name for name, in op.get_bind().exec_driver_sql(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'show'::regclass")]
+    return names or ['show']
+
+
+def upgrade():
+    op.add_column('show', sa.Column('duration_minutes', sa.Integer(), nullable=False,
+        server_default=str(DEFAULT_SHOW_MINUTES)))
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.create_check_constraint('ck_show_duration_minutes', 'show',
+        'duration_minutes BETWEEN 1 AND %d' % MAX_SHOW_MINUTES)
+
+    clashes = op.get_bind().exec_driver_sql(
+        'SELECT id, start_time FROM (%s) gaps WHERE gap < 1 ORDER BY start_time LIMIT 20' % GAPS_SQL).all()
+    if clashes:
+        raise RuntimeError('Shows starting together with another show of their venue or artist; '
+            'move or delete them first: %s' % ', '.join(
+                'show %d at %s' % (id, start_time) for id, start_time in clashes))
+    op.execute('UPDATE show SET duration_minutes = gaps.gap FROM (%s) gaps '
+        'WHERE show.id = gaps.id AND show.start_time = gaps.start_time AND gaps.gap < show.duration_minutes'
+        % GAPS_SQL)
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    for table in tables():
+        for booking in BOOKINGS:
+            op.execute(OVERLAP_CONSTRAINT % {'table': table, 'booking': booking})
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for table in tables():
+            for booking in BOOKINGS:
+                op.execute('ALTER TABLE %s DROP CONSTRAINT IF EXISTS %s_%s_overlap' % (table, table, booking))
+        op.drop_constraint('ck_show_duration_minutes', 'show', type_='check')
+    with op.batch_alter_table('show') as batch_op:
+        batch_op.drop_column('duration_minutes')
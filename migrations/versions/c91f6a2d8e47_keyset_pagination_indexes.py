@@ -0,0 +1,32 @@
+"""keyset pagination indexes
+
+Revision ID: c91f6a2d8e47
+Revises: b7d3e0c41f2a
+Create Date: 2026-10-18 10:41:17.873902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c91f6a2d8e47'
+down_revision = 'b7d3e0c41f2a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_artist_name_id', 'artist', ['name', 'id'],
+                        postgresql_concurrently=True)
+        op.create_index('ix_show_start_time_id', 'show', ['start_time', 'id'],
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_show_start_time_id', table_name='show',
+                      postgresql_concurrently=True)
+        op.drop_index('ix_artist_name_id', table_name='artist',
+                      postgresql_concurrently=True)
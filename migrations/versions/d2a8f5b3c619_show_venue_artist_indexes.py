@@ -0,0 +1,32 @@
+"""show venue/artist indexes
+
+Revision ID: d2a8f5b3c619
+Revises: c91f6a2d8e47
+Create Date: 2026-10-18 11:20:36.552180
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2a8f5b3c619'
+down_revision = 'c91f6a2d8e47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_show_venue_id_start_time', 'show', ['venue_id', 'start_time'],
+                        postgresql_concurrently=True)
+        op.create_index('ix_show_artist_id_start_time', 'show', ['artist_id', 'start_time'],
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_show_artist_id_start_time', table_name='show',
+                      postgresql_concurrently=True)
+        op.drop_index('ix_show_venue_id_start_time', table_name='show',
+                      postgresql_concurrently=True)
@@ -0,0 +1,53 @@
+"""show counters on venue and artist
+
+Revision ID: e5c7a1d94b20
+Revises: d2a8f5b3c619
+Create Date: 2026-10-18 19:52:08.317064
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5c7a1d94b20'
+down_revision = 'd2a8f5b3c619'
+branch_labels = None
+depends_on = None
+
+COUNTED = (('venue', 'venue_id'), ('artist', 'artist_id'))
+
+
+def upgrade():
+    for table, fk in COUNTED:
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(), nullable=False, server_default='0'))
+        op.add_column(table, sa.Column('past_shows_count', sa.Integer(), nullable=False, server_default='0'))
+        op.add_column(table, sa.Column('next_show_time', sa.DateTime(), nullable=True))
+        # same counts as counters.recount_all()
+        op.execute(sa.text(
+            'UPDATE {table} SET '
+            'upcoming_shows_count = (SELECT count(*) FROM show '
+            'WHERE show.{fk} = {table}.id AND show.start_time > :now), '
+            'past_shows_count = (SELECT count(*) FROM show '
+            'WHERE show.{fk} = {table}.id AND show.start_time <= :now), '
+            'next_show_time = (SELECT min(show.start_time) FROM show '
+            'WHERE show.{fk} = {table}.id AND show.start_time > :now)'
+            .format(table=table, fk=fk)).bindparams(now=datetime.now()))
+
+    with op.get_context().autocommit_block():
+        for table, _ in COUNTED:
+            op.create_index('ix_%s_next_show_time' % table, table, ['next_show_time'],
+                            postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for table, _ in COUNTED:
+            op.drop_index('ix_%s_next_show_time' % table, table_name=table,
+                          postgresql_concurrently=True)
+    for table, _ in COUNTED:
+        op.drop_column(table, 'next_show_time')
+        op.drop_column(table, 'past_shows_count')
+        op.drop_column(table, 'upcoming_shows_count')
@@ -0,0 +1,37 @@
+"""job queue
+
+Revision ID: e9a2b6d4f170
+Revises: c4e1f8a29d57
+Create Date: 2026-10-18 23:58:02.614093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e9a2b6d4f170'
+down_revision = 'c4e1f8a29d57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('job',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('task', sa.String(length=120), nullable=False),
+        sa.Column('args', sa.JSON(), nullable=False),
+        sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('run_at', sa.DateTime(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('failed_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_job_due', 'job', ['run_at', 'id'],
+        postgresql_where=sa.text('failed_at IS NULL'), sqlite_where=sa.text('failed_at IS NULL'))
+
+
+def downgrade():
+    op.drop_index('ix_job_due', table_name='job')
+    op.drop_table('job')
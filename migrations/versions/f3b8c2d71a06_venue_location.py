@@ -0,0 +1,59 @@
+"""venue location and geocode cache
+
+Revision ID: f3b8c2d71a06
+Revises: e5c7a1d94b20
+Create Date: 2026-10-18 21:14:37.902215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b8c2d71a06'
+down_revision = 'e5c7a1d94b20'
+branch_labels = None
+depends_on = None
+
+# as in geo.LOCATION_SQL
+LOCATION_SQL = 'geography(ST_SetSRID(ST_MakePoint(longitude, latitude), 4326))'
+
+Geohash = sa.String(12).with_variant(sa.String(12, collation='C'), 'postgresql')
+
+
+def postgis_installed():
+    bind = op.get_bind()
+    return bind.dialect.name == 'postgresql' and bind.exec_driver_sql(
+        "SELECT 1 FROM pg_extension WHERE extname = 'postgis'").first() is not None
+
+
+def upgrade():
+    op.add_column('venue', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('venue', sa.Column('longitude', sa.Float(), nullable=True))
+    op.add_column('venue', sa.Column('geohash', Geohash, nullable=True))
+    op.create_table('geocode',
+        sa.Column('city', sa.String(length=120), nullable=False),
+        sa.Column('state', sa.String(length=120), nullable=False),
+        sa.Column('latitude', sa.Float(), nullable=False),
+        sa.Column('longitude', sa.Float(), nullable=False),
+        sa.Column('geohash', Geohash, nullable=False),
+        sa.Column('source', sa.String(length=500), nullable=True),
+        sa.Column('loaded_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('city', 'state')
+    )
+
+    # venues get positions afterwards: flask geocode load / flask geocode venues
+    with op.get_context().autocommit_block():
+        op.create_index('ix_venue_geohash', 'venue', ['geohash'], postgresql_concurrently=True)
+        if postgis_installed():
+            op.execute('CREATE INDEX CONCURRENTLY ix_venue_location ON venue USING gist (%s)' % LOCATION_SQL)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute('DROP INDEX IF EXISTS ix_venue_location')
+        op.drop_index('ix_venue_geohash', table_name='venue', postgresql_concurrently=True)
+    op.drop_table('geocode')
+    op.drop_column('venue', 'geohash')
+    op.drop_column('venue', 'longitude')
+    op.drop_column('venue', 'latitude')
@@ -1,30 +1,84 @@
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import raiseload
 from datetime import datetime
 
-db = SQLAlchemy()
+from dbpool import PooledSQLAlchemy
+
+db = PooledSQLAlchemy()
+
+# PostgreSQL arrays; JSON lists on SQLite so the schema also builds for tests.
+Genres = ARRAY(db.String()).with_variant(db.JSON(), 'sqlite')
+
+# Compared byte by byte, so a geohash prefix is a key range (geo.py).
+Geohash = db.String(12).with_variant(db.String(12, collation='C'), 'postgresql')
+
+# pg_trgm backs the GIN trigram indexes used by search.py; btree_gist the
+# booking exclusion constraints of bookings.py.
+event.listen(db.metadata, 'before_create',
+	DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+event.listen(db.metadata, 'before_create',
+	DDL('CREATE EXTENSION IF NOT EXISTS btree_gist').execute_if(dialect='postgresql'))
+
+# A show keeps its venue and artist busy for duration_minutes.
+DEFAULT_SHOW_MINUTES = 120
+MAX_SHOW_MINUTES = 24 * 60
+
+
+def trigram_index(name, column):
+	return db.Index(name, column, postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'})
+
 
 class Venue(db.Model):
 	__tablename__ = 'venue'
+	__table_args__ = (
+		trigram_index('ix_venue_name_trgm', 'name'),
+		trigram_index('ix_venue_city_trgm', 'city'),
+		db.Index('ix_venue_genres', 'genres', postgresql_using='gin'),
+		# /venues pages through venues by area
+		db.Index('ix_venue_state_city_id', 'state', 'city', 'id'),
+		db.Index('ix_venue_next_show_time', 'next_show_time'),
+		# /venues/near without PostGIS (geo.py)
+		db.Index('ix_venue_geohash', 'geohash'),
+	)
 	id = db.Column(db.Integer, primary_key=True)
 	name = db.Column(db.String)
-	genres = db.Column(db.ARRAY(db.String()))
+	genres = db.Column(Genres)
 	address = db.Column(db.String(120))
-	city = db.Column(db.String(120))
-	state = db.Column(db.String(120))
+	# with id, the keyset pagination key of /venues: a NULL would end the
+	# paging at that row
+	city = db.Column(db.String(120), nullable=False)
+	state = db.Column(db.String(120), nullable=False)
 	phone = db.Column(db.String(120))
 	image_link = db.Column(db.String(500))
 	facebook_link = db.Column(db.String(120))
 	website_link = db.Column(db.String(120))
 	seeking_talent = db.Column(db.Boolean, default=False)
 	seeking_description = db.Column(db.String(500))
-	shows = db.relationship('Show', backref='venue', lazy='joined', cascade="all, delete")
+	# optional; set together by geo.locate()
+	latitude = db.Column(db.Float)
+	longitude = db.Column(db.Float)
+	geohash = db.Column(Geohash)
+	# show counters, maintained by counters.py
+	upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+	past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+	next_show_time = db.Column(db.DateTime)
+	shows = db.relationship('Show', backref='venue', lazy='select', cascade="all, delete")
 
 
 class Artist(db.Model):
 	__tablename__ = 'artist'
+	__table_args__ = (
+		trigram_index('ix_artist_name_trgm', 'name'),
+		trigram_index('ix_artist_city_trgm', 'city'),
+		db.Index('ix_artist_genres', 'genres', postgresql_using='gin'),
+		db.Index('ix_artist_name_id', 'name', 'id'),
+		db.Index('ix_artist_next_show_time', 'next_show_time'),
+	)
 	id = db.Column(db.Integer, primary_key=True)
-	name = db.Column(db.String)
-	genres = db.Column(db.ARRAY(db.String))
+	# with id, the keyset pagination key of /artists
+	name = db.Column(db.String, nullable=False)
+	genres = db.Column(Genres)
 	city = db.Column(db.String(120))
 	state = db.Column(db.String(120))
 	phone = db.Column(db.String(120))
@@ -33,13 +87,72 @@ class Artist(db.Model):
 	facebook_link = db.Column(db.String(120))
 	seeking_venue = db.Column(db.Boolean)
 	seeking_description = db.Column(db.String(500), default=False)
-	shows = db.relationship('Show', backref='artist', lazy='joined', cascade="all, delete")
+	# show counters, maintained by counters.py
+	upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+	past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+	next_show_time = db.Column(db.DateTime)
+	shows = db.relationship('Show', backref='artist', lazy='select', cascade="all, delete")
+
+
+class Geocode(db.Model):
+	"""Offline geocoding cache: place centroids loaded from a gazetteer."""
+	__tablename__ = 'geocode'
+	# normalized as by geo.place_key()
+	city = db.Column(db.String(120), primary_key=True)
+	state = db.Column(db.String(120), primary_key=True)
+	latitude = db.Column(db.Float, nullable=False)
+	longitude = db.Column(db.Float, nullable=False)
+	geohash = db.Column(Geohash, nullable=False)
+	source = db.Column(db.String(500))
+	loaded_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
 
 
 class Show(db.Model):
 	__tablename__ = 'show'
+	__table_args__ = (
+		db.Index('ix_show_start_time_id', 'start_time', 'id'),
+		# detail pages and search counts: shows of one venue / artist split
+		# on start_time; also serve the foreign key lookups
+		db.Index('ix_show_venue_id_start_time', 'venue_id', 'start_time'),
+		db.Index('ix_show_artist_id_start_time', 'artist_id', 'start_time'),
+		db.CheckConstraint('duration_minutes BETWEEN 1 AND %d' % MAX_SHOW_MINUTES,
+			name='ck_show_duration_minutes'),
+		# monthly range partitions on PostgreSQL (partitions.py); the primary
+		# key there is (id, start_time)
+		{'postgresql_partition_by': 'RANGE (start_time)', 'info': {'partition_key': 'start_time'}},
+	)
 	id = db.Column(db.Integer, primary_key=True)
 	artist_id = db.Column(db.Integer, db.ForeignKey(
 			'artist.id'), nullable=False)
 	venue_id = db.Column(db.Integer, db.ForeignKey('venue.id'), nullable=False)
 	start_time = db.Column(db.DateTime, nullable=False)
+	duration_minutes = db.Column(db.Integer, nullable=False,
+		default=DEFAULT_SHOW_MINUTES, server_default=str(DEFAULT_SHOW_MINUTES))
+
+
+class Job(db.Model):
+	"""A queued call of a jobs.py task (JOBS_BACKEND 'database')."""
+	__tablename__ = 'job'
+	__table_args__ = (
+		# workers claim the earliest due job that has not failed for good
+		db.Index('ix_job_due', 'run_at', 'id',
+			postgresql_where=db.text('failed_at IS NULL'), sqlite_where=db.text('failed_at IS NULL')),
+	)
+	id = db.Column(db.Integer, primary_key=True)
+	task = db.Column(db.String(120), nullable=False)
+	args = db.Column(db.JSON, nullable=False)
+	attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+	run_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+	created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+	last_error = db.Column(db.Text)
+	failed_at = db.Column(db.DateTime)
+
+
+# Relationships are loaded per query (selectinload / contains_eager in the
+# views). In test mode every other relationship access that would emit SQL
+# raises, so a lazy load hidden in a template fails loudly.
+def enable_raiseload(session):
+	@event.listens_for(session, 'do_orm_execute')
+	def _raiseload(state):
+		if state.is_select and not state.is_relationship_load:
+			state.statement = state.statement.options(raiseload('*', sql_only=True))
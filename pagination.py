@@ -0,0 +1,108 @@
+#----------------------------------------------------------------------------#
+# Keyset (cursor) pagination.
+#
+# A page is "the next N rows after this sort key", so every page costs one
+# index range scan no matter how deep it is. The sort key of the last row is
+# handed to the client as an opaque, URL-safe cursor token.
+#----------------------------------------------------------------------------#
+import base64
+import json
+from datetime import datetime
+
+from flask import abort, current_app, request, url_for
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Query
+
+from models import db
+
+
+def encode_cursor(values):
+	payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+	raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+	return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, columns):
+	if not token:
+		return None
+	try:
+		raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+		values = json.loads(raw)
+		if not isinstance(values, list) or len(values) != len(columns):
+			raise ValueError(token)
+		return [_cursor_value(column, value) for column, value in zip(columns, values)]
+	except (TypeError, ValueError):
+		abort(400, 'Invalid cursor')
+
+
+def _cursor_value(column, value):
+	"""``value`` as a parameter for ``column``; ValueError unless it has the column's type."""
+	python_type = _python_type(column)
+	# a forged token must not reach the driver as a dict or list
+	expected = {datetime: str, int: int, str: str}.get(python_type, (str, int, float))
+	if not isinstance(value, expected) or isinstance(value, bool):
+		raise ValueError(value)
+	return datetime.fromisoformat(value) if python_type is datetime else value
+
+
+def _python_type(column):
+	try:
+		return column.type.python_type
+	except (AttributeError, NotImplementedError):
+		return None
+
+
+def keyset_statement(query, columns, cursor, per_page):
+	"""``query`` (a Query or a select()) narrowed to the page after ``cursor``.
+
+	``query`` must select ``columns`` (in any position, under their own names)
+	and must not be ordered yet; rows come back ordered by ``columns``. One
+	extra row is fetched to tell whether there is a next page. ``columns``
+	must be NOT NULL: no row compares greater than a key holding a NULL, so
+	paging would stop there.
+	"""
+	after = decode_cursor(cursor, columns)
+	if after is not None:
+		query = query.filter(tuple_(*columns) > tuple_(*after))
+	return query.order_by(*columns).limit(per_page + 1)
+
+
+def keyset_rows(rows, columns, per_page):
+	"""Split the rows of a keyset_statement into (rows, next_cursor)."""
+	next_cursor = None
+	if len(rows) > per_page:
+		rows = rows[:per_page]
+		last = rows[-1]
+		next_cursor = encode_cursor([getattr(last, column.key) for column in columns])
+	return rows, next_cursor
+
+
+def keyset_page(query, columns, cursor, per_page):
+	"""Return (rows, next_cursor) for the page of ``query`` after ``cursor``."""
+	statement = keyset_statement(query, columns, cursor, per_page)
+	rows = statement.all() if isinstance(statement, Query) else db.session.execute(statement).all()
+	return keyset_rows(rows, columns, per_page)
+
+
+def page_size():
+	"""``?limit=`` if given, clamped to MAX_PAGE_SIZE; PAGE_SIZE otherwise."""
+	limit = request.args.get('limit', type=int) or current_app.config['PAGE_SIZE']
+	return max(1, min(limit, current_app.config['MAX_PAGE_SIZE']))
+
+
+def page_url(cursor=None, _external=False, **values):
+	"""This endpoint with the same arguments (filters, limit), at ``cursor``."""
+	args = request.args.to_dict(flat=False)
+	args.pop('after', None)
+	args.update(values)
+	if cursor:
+		args['after'] = cursor
+	return url_for(request.endpoint, _external=_external, **args)
+
+
+def link_header(next_cursor, **values):
+	"""RFC 8288 Link header pointing at the first and next pages."""
+	links = ['<%s>; rel="first"' % page_url(None, True, **values)]
+	if next_cursor:
+		links.append('<%s>; rel="next"' % page_url(next_cursor, True, **values))
+	return ', '.join(links)
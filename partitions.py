@@ -0,0 +1,219 @@
+#----------------------------------------------------------------------------#
+# Monthly partitions of the show table (PostgreSQL).
+#
+# show is partitioned by range of start_time: show_p2026_10 holds the shows
+# of October 2026, show_default whatever falls outside every partition. A
+# query bounded on start_time (/shows?from=&to=) only reads the months it
+# covers.
+#
+#   flask partitions roll [--every SECONDS]   keep PARTITION_MONTHS_AHEAD
+#                                             months ready; move rows out
+#                                             of show_default
+#   flask partitions archive --before 2024-01 detach older months into the
+#                                             PARTITION_ARCHIVE_SCHEMA schema
+#   flask partitions list
+#
+# Every partition carries the booking overlap constraints of bookings.py.
+# Archived months stay queryable as plain tables, but are no longer shows:
+# their venues' and artists' counters are recounted.
+#
+# SQLite has no partitions; the show table there is a plain table.
+#----------------------------------------------------------------------------#
+import re
+import time
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import PrimaryKeyConstraint, event, text
+from sqlalchemy.ext.compiler import compiles
+
+from models import db, Show
+from counters import recount
+from bookings import add_overlap_constraints
+
+DEFAULT_PARTITION = 'show_default'
+
+BOUNDS = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+@compiles(PrimaryKeyConstraint, 'postgresql')
+def _primary_key(constraint, compiler, **kw):
+	# a partitioned table's primary key has to hold the partition key. Only
+	# show's DDL says so: on SQLite id stays the rowid, and the ORM still
+	# identifies shows by id alone
+	table = constraint.table
+	if table is not Show.__table__ or not constraint.columns:
+		return compiler.visit_primary_key_constraint(constraint, **kw)
+	key = table.c[table.info['partition_key']]
+	columns = list(constraint.columns) + ([] if key.key in constraint.columns else [key])
+	sql = ''
+	if constraint.name is not None:
+		sql += 'CONSTRAINT %s ' % compiler.preparer.format_constraint(constraint)
+	sql += 'PRIMARY KEY (%s)' % ', '.join(compiler.preparer.quote(column.name) for column in columns)
+	return sql + compiler.define_constraint_deferrability(constraint)
+
+
+def _create_partitions(target, connection, **kw):
+	if connection.dialect.name == 'postgresql':
+		current = month_start(datetime.now())
+		ensure(connection, current, add_months(current, current_app.config['PARTITION_MONTHS_AHEAD']))
+
+
+event.listen(Show.__table__, 'after_create', _create_partitions)
+
+
+def month_start(value):
+	return datetime(value.year, value.month, 1)
+
+
+def add_months(month, months):
+	index = month.year * 12 + month.month - 1 + months
+	return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+	return 'show_p%04d_%02d' % (month.year, month.month)
+
+
+def is_partitioned(connection):
+	return connection.dialect.name == 'postgresql' and connection.exec_driver_sql(
+		"SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'show'::regclass").first() is not None
+
+
+def partitions(connection):
+	"""(name, lower, upper) of every partition, by month; show_default last, without bounds."""
+	found = []
+	for name, bound in connection.exec_driver_sql(
+			"SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+			"JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = 'show'::regclass"):
+		match = BOUNDS.search(bound)
+		if match:
+			found.append((name, datetime.fromisoformat(match.group(1)), datetime.fromisoformat(match.group(2))))
+		else:
+			found.append((name, None, None))
+	return sorted(found, key=lambda partition: (partition[1] is None, partition[1] or datetime.min))
+
+
+def create_partition(connection, month):
+	"""Add the partition of ``month``, taking its rows from show_default; False if it exists."""
+	name = partition_name(month)
+	if connection.execute(text('SELECT to_regclass(:name)'), {'name': name}).scalar():
+		return False
+	lower, upper = month, add_months(month, 1)
+	# created apart and attached, so rows already in show_default can move in
+	connection.exec_driver_sql('CREATE TABLE %s (LIKE show INCLUDING DEFAULTS INCLUDING CONSTRAINTS)' % name)
+	add_overlap_constraints(connection, name)
+	connection.execute(text(
+		'WITH moved AS (DELETE FROM %s WHERE start_time >= :lower AND start_time < :upper RETURNING *) '
+		'INSERT INTO %s SELECT * FROM moved' % (DEFAULT_PARTITION, name)), {'lower': lower, 'upper': upper})
+	connection.exec_driver_sql("ALTER TABLE show ATTACH PARTITION %s FOR VALUES FROM ('%s') TO ('%s')"
+		% (name, lower.isoformat(' '), upper.isoformat(' ')))
+	return True
+
+
+def ensure(connection, first, last):
+	"""Partitions for every month from ``first`` to ``last``; returns the new ones."""
+	if not connection.execute(text('SELECT to_regclass(:name)'), {'name': DEFAULT_PARTITION}).scalar():
+		connection.exec_driver_sql('CREATE TABLE %s PARTITION OF show DEFAULT' % DEFAULT_PARTITION)
+		add_overlap_constraints(connection, DEFAULT_PARTITION)
+	created = []
+	month = month_start(first)
+	while month <= last:
+		if create_partition(connection, month):
+			created.append(partition_name(month))
+		month = add_months(month, 1)
+	return created
+
+
+def roll_forward(connection, months_ahead, now=None):
+	"""Partitions from this month to ``months_ahead`` on, and for every month in show_default."""
+	current = month_start(now or datetime.now())
+	created = ensure(connection, current, add_months(current, months_ahead))
+	for month, in connection.exec_driver_sql(
+			"SELECT DISTINCT date_trunc('month', start_time) FROM %s" % DEFAULT_PARTITION).all():
+		created += ensure(connection, month, month)
+	return created
+
+
+def archive(connection, before, schema):
+	"""Detach the partitions of the months before ``before`` into ``schema``; returns their names."""
+	before = month_start(before)
+	quoted = connection.dialect.identifier_preparer.quote(schema)
+	connection.exec_driver_sql('CREATE SCHEMA IF NOT EXISTS %s' % quoted)
+	archived = []
+	for name, lower, upper in partitions(connection):
+		if upper is None or upper > before:
+			continue
+		connection.exec_driver_sql('ALTER TABLE show DETACH PARTITION %s' % name)
+		connection.exec_driver_sql('ALTER TABLE %s SET SCHEMA %s' % (name, quoted))
+		# history: venues and artists may go without their archived shows
+		for constraint, in connection.execute(text(
+				"SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:table) AND contype = 'f'"),
+				{'table': '%s.%s' % (quoted, name)}).all():
+			connection.exec_driver_sql('ALTER TABLE %s.%s DROP CONSTRAINT %s' % (quoted, name, constraint))
+		archived.append(name)
+	return archived
+
+
+#  Commands
+#  ----------------------------------------------------------------
+
+partitions_command = AppGroup('partitions', help='Maintain the monthly partitions of the show table.')
+
+
+def _connection():
+	connection = db.session.connection()
+	if not is_partitioned(connection):
+		raise click.ClickException('The show table is not partitioned (PostgreSQL, after the migration).')
+	return connection
+
+
+@partitions_command.command('list')
+def list_command():
+	"""Show the partitions and their row counts."""
+	connection = _connection()
+	for name, lower, upper in partitions(connection):
+		rows = connection.exec_driver_sql('SELECT count(*) FROM %s' % name).scalar()
+		click.echo('%-16s %-10s %-10s %9d' % (name, lower.date() if lower else 'default',
+			upper.date() if upper else '', rows))
+
+
+@partitions_command.command('roll')
+@click.option('--months', type=int, help='Months to keep ready ahead (PARTITION_MONTHS_AHEAD by default).')
+@click.option('--every', type=float, help='Keep running, rolling every this many seconds.')
+def roll_command(months, every):
+	"""Create the coming months' partitions."""
+	months = current_app.config['PARTITION_MONTHS_AHEAD'] if months is None else months
+	while True:
+		created = roll_forward(_connection(), months)
+		db.session.commit()
+		if created or not every:
+			click.echo('%d partitions created%s' % (len(created), ': ' + ', '.join(created) if created else ''))
+		if not every:
+			return
+		time.sleep(every)
+
+
+@partitions_command.command('archive')
+@click.option('--before', required=True, type=click.DateTime(['%Y-%m']),
+	help='First month to keep (YYYY-MM); the months before it are archived.')
+def archive_command(before):
+	"""Detach old months' partitions into the archive schema."""
+	connection = _connection()
+	schema = current_app.config['PARTITION_ARCHIVE_SCHEMA']
+	archived = archive(connection, before, schema)
+	pairs = set()
+	for name in archived:
+		pairs.update(connection.exec_driver_sql(
+			'SELECT DISTINCT venue_id, artist_id FROM %s.%s'
+			% (connection.dialect.identifier_preparer.quote(schema), name)).all())
+	recount({venue_id for venue_id, _ in pairs}, {artist_id for _, artist_id in pairs})
+	db.session.commit()
+	cache = current_app.extensions.get('fragment_cache')
+	if cache is not None:
+		for venue_id, artist_id in pairs:
+			cache.delete(*cache.show_keys(venue_id, artist_id))
+	click.echo('%d partitions archived to %s%s' % (len(archived), schema,
+		': ' + ', '.join(archived) if archived else ''))
@@ -0,0 +1,127 @@
+#----------------------------------------------------------------------------#
+# Read queries shared by the HTML views, the API and the async read path
+# (asgi.py). Each *_statement builds a select() that either kind of session
+# can execute; the *_from_rows functions shape the result.
+#----------------------------------------------------------------------------#
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import case, select
+
+from models import db, Venue, Artist, Show
+
+# Read model of the venue page: plain immutable records, no ORM state.
+VENUE_PAGE_COLUMNS = [
+	Venue.id, Venue.name, Venue.genres, Venue.address, Venue.city,
+	Venue.state, Venue.phone, Venue.image_link, Venue.facebook_link,
+	Venue.website_link, Venue.seeking_talent, Venue.seeking_description,
+]
+VenuePage = namedtuple('VenuePage', [column.key for column in VENUE_PAGE_COLUMNS] + [
+	'past_shows', 'upcoming_shows', 'past_shows_count', 'upcoming_shows_count'])
+VenueShow = namedtuple('VenueShow', 'artist_id artist_name artist_image_link start_time')
+
+ARTIST_PAGE_COLUMNS = [
+	Artist.id, Artist.name, Artist.genres, Artist.city, Artist.state,
+	Artist.phone, Artist.website_link, Artist.facebook_link,
+	Artist.seeking_venue, Artist.seeking_description, Artist.image_link,
+]
+
+SHOW_LIST_ORDER = [Show.start_time, Show.id]
+
+
+def artist_statement(artist_id):
+	return select(*ARTIST_PAGE_COLUMNS).where(Artist.id == artist_id)
+
+
+def artist_timeline_statement(artist_id, now):
+	# Only the columns the artist page shows are selected; a CASE on
+	# start_time tags each row, and the counts are taken in the same pass.
+	upcoming = case((Show.start_time > now, True), else_=False).label('upcoming')
+	return select(
+			Show.venue_id,
+			Venue.name.label('venue_name'),
+			Venue.image_link.label('venue_image_link'),
+			Show.start_time,
+			upcoming) \
+		.join(Venue, Venue.id == Show.venue_id) \
+		.where(Show.artist_id == artist_id) \
+		.order_by(Show.start_time, Show.id)
+
+
+def artist_timeline_from_rows(rows):
+	timeline = {"past_shows": [], "upcoming_shows": []}
+	for row in rows:
+		timeline["upcoming_shows" if row.upcoming else "past_shows"].append({
+			"venue_id": row.venue_id,
+			"venue_name": row.venue_name,
+			"venue_image_link": row.venue_image_link,
+			"start_time": row.start_time
+		})
+	timeline["past_shows_count"] = len(timeline["past_shows"])
+	timeline["upcoming_shows_count"] = len(timeline["upcoming_shows"])
+	return timeline
+
+
+def artist_timeline(artist_id, now=None):
+	"""Past and upcoming shows of an artist, from a single query."""
+	rows = db.session.execute(artist_timeline_statement(artist_id, now or datetime.now()))
+	return artist_timeline_from_rows(rows)
+
+
+def venue_page_statement(venue_id):
+	return select(
+			*VENUE_PAGE_COLUMNS,
+			Show.artist_id,
+			Artist.name.label('artist_name'),
+			Artist.image_link.label('artist_image_link'),
+			Show.start_time) \
+		.select_from(Venue) \
+		.outerjoin(Show, Show.venue_id == Venue.id) \
+		.outerjoin(Artist, Artist.id == Show.artist_id) \
+		.where(Venue.id == venue_id) \
+		.order_by(Show.start_time, Show.id)
+
+
+def venue_page_from_rows(rows, now):
+	if not rows:
+		return None
+
+	past_shows = []
+	upcoming_shows = []
+	for row in rows:
+		if row.start_time is None:
+			# venue without shows: the outer join yields one empty row
+			continue
+		show = VenueShow(row.artist_id, row.artist_name, row.artist_image_link, row.start_time)
+		(upcoming_shows if row.start_time > now else past_shows).append(show)
+
+	venue = rows[0][:len(VENUE_PAGE_COLUMNS)]
+	return VenuePage(*venue,
+		past_shows=tuple(past_shows),
+		upcoming_shows=tuple(upcoming_shows),
+		past_shows_count=len(past_shows),
+		upcoming_shows_count=len(upcoming_shows))
+
+
+def venue_page(venue_id, now=None):
+	"""The venue and its shows (with artist name and image) in one query.
+
+	Returns a VenuePage, or None if there is no such venue.
+	"""
+	rows = db.session.execute(venue_page_statement(venue_id)).all()
+	return venue_page_from_rows(rows, now or datetime.now())
+
+
+def show_list_statement(clauses=()):
+	"""Rows of /shows (facets.show_clauses), to be paged with pagination.keyset_statement."""
+	return select(
+			Show.id,
+			Show.start_time,
+			Show.venue_id,
+			Venue.name.label('venue_name'),
+			Show.artist_id,
+			Artist.name.label('artist_name'),
+			Artist.image_link.label('artist_image_link')) \
+		.join(Artist, Artist.id == Show.artist_id) \
+		.join(Venue, Venue.id == Show.venue_id) \
+		.where(*clauses)
@@ -0,0 +1,161 @@
+#----------------------------------------------------------------------------#
+# Read replicas.
+#
+# DB_REPLICAS (config.py) maps bind keys to replica URLs, SQLALCHEMY_BINDS
+# style; they are bound like any other bind, so their engines get the same
+# pool settings. Views marked @read_only run their queries on a healthy
+# replica, picked at random per request; every other view, and any flush,
+# uses the primary.
+#
+# Read-your-writes: once a request commits, the client gets a cookie that
+# keeps its reads on the primary for REPLICA_STICKY_SECONDS, long enough
+# for the replicas to replay the write.
+#
+# Health: a replica is checked at most every REPLICA_CHECK_INTERVAL seconds
+# by whichever request needs it (one at a time), and dropped while it is
+# unreachable or, on PostgreSQL, more than REPLICA_MAX_LAG_SECONDS behind.
+# A read-only view whose replica fails with an OperationalError is marked
+# down and run again on the primary.
+#----------------------------------------------------------------------------#
+import random
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+
+STICKY_COOKIE = 'fyyur_primary'
+
+# Seconds the replica is behind; 0 while it has replayed all it received.
+PG_REPLICA_LAG = (
+	"SELECT CASE WHEN NOT pg_is_in_recovery() "
+	"OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+	"ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END")
+
+
+class RoutingSession(SignallingSession):
+	"""Runs reads on the ``replica`` bind while one is set; flushes use the primary."""
+
+	def __init__(self, db, **options):
+		self.db = db
+		self.replica = None
+		SignallingSession.__init__(self, db, **options)
+
+	def get_bind(self, mapper=None, clause=None, **kw):
+		if self.replica is not None and not self._flushing:
+			return self.db.get_engine(self.app, bind=self.replica)
+		return SignallingSession.get_bind(self, mapper, clause)
+
+
+class ReplicaState(object):
+	__slots__ = ('healthy', 'lag', 'next_check', 'lock')
+
+	def __init__(self):
+		self.healthy = True
+		self.lag = None
+		self.next_check = 0.0
+		self.lock = threading.Lock()
+
+
+class ReplicaRouter(object):
+	def __init__(self, app=None):
+		self.db = None
+		self.app = None
+		self.replicas = {}
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		# after db.init_app(app)
+		self.db = app.extensions['sqlalchemy'].db
+		self.app = app
+		self.replicas = {key: ReplicaState() for key in app.config.get('DB_REPLICAS', {})}
+		self.sticky_seconds = app.config.get('REPLICA_STICKY_SECONDS', 10)
+		self.check_interval = app.config.get('REPLICA_CHECK_INTERVAL', 10)
+		self.max_lag = app.config.get('REPLICA_MAX_LAG_SECONDS', 5)
+		if self.replicas:
+			event.listen(RoutingSession, 'after_commit', self._committed)
+			app.after_request(self._set_sticky)
+		app.extensions['replica_router'] = self
+
+	def choose(self):
+		"""Bind key of a healthy replica for this request, or None for the primary."""
+		if not self.replicas or request.cookies.get(STICKY_COOKIE):
+			return None
+		healthy = [key for key, state in self.replicas.items() if self._healthy(key, state)]
+		return random.choice(healthy) if healthy else None
+
+	def _healthy(self, key, state):
+		# the others keep the last verdict while one request checks
+		if time.monotonic() >= state.next_check and state.lock.acquire(blocking=False):
+			try:
+				self.check(key)
+			finally:
+				state.lock.release()
+		return state.healthy
+
+	def check(self, key):
+		state = self.replicas[key]
+		engine = self.db.get_engine(self.app, bind=key)
+		try:
+			with engine.connect() as connection:
+				if engine.dialect.name == 'postgresql':
+					lag = float(connection.exec_driver_sql(PG_REPLICA_LAG).scalar())
+				else:
+					connection.exec_driver_sql('SELECT 1')
+					lag = 0.0
+			state.lag = lag
+			state.healthy = lag <= self.max_lag
+		except SQLAlchemyError as e:
+			self.app.logger.warning('replica %s failed its health check: %s', key, e)
+			state.lag = None
+			state.healthy = False
+		state.next_check = time.monotonic() + self.check_interval
+		return state.healthy
+
+	def mark_down(self, key):
+		state = self.replicas[key]
+		state.healthy = False
+		state.lag = None
+		state.next_check = time.monotonic() + self.check_interval
+
+	def status(self):
+		return {key: (state.healthy, state.lag) for key, state in self.replicas.items()}
+
+	def _committed(self, session):
+		if has_request_context():
+			g.db_committed = True
+
+	def _set_sticky(self, response):
+		if g.pop('db_committed', False):
+			response.set_cookie(STICKY_COOKIE, '1', max_age=self.sticky_seconds, httponly=True, samesite='Lax')
+		return response
+
+
+def read_only(view):
+	"""Run ``view``'s queries on a replica. The view must not write.
+
+	The choice holds for the request's session until it is removed at the
+	end of the request, so streamed responses read from the replica too.
+	"""
+	@wraps(view)
+	def wrapper(*args, **kwargs):
+		router = current_app.extensions.get('replica_router')
+		if router is None or not router.replicas:
+			return view(*args, **kwargs)
+		session = router.db.session()
+		session.replica = router.choose()
+		try:
+			return view(*args, **kwargs)
+		except OperationalError:
+			if session.replica is None:
+				raise
+			current_app.logger.warning('replica %s failed; reading from the primary', session.replica)
+			router.mark_down(session.replica)
+			session.rollback()
+			session.replica = None
+			return view(*args, **kwargs)
+	return wrapper
@@ -0,0 +1,154 @@
+#----------------------------------------------------------------------------#
+# Venue / artist search.
+#
+# PostgreSQL: pg_trgm GIN indexes on name and city (declared on the models)
+# serve the ILIKE '%term%' filter, and results are ranked by similarity().
+# SQLite: an external-content FTS5 table with the trigram tokenizer, kept in
+# sync by triggers, stands in for the trigram indexes in local tests.
+# Genres match when the term names a genre exactly (case-insensitive).
+# Results can be narrowed further, and faceted by genre, with facets.py.
+#----------------------------------------------------------------------------#
+from datetime import datetime
+
+from sqlalchemy import DDL, event, func, literal, literal_column, or_, select, table, text
+
+from models import db, Venue, Artist
+from counters import upcoming_count
+from facets import GENRES, NO_FILTERS, facet_list, filter_clauses, genre_facets_statement, genres_clause
+
+# the trigram tokenizer cannot match anything shorter
+FTS_MIN_LENGTH = 3
+
+FTS_COLUMNS = ('name', 'city')
+
+
+def _fts_name(model):
+	return '%s_search' % model.__tablename__
+
+
+def _install_fts(model):
+	name = _fts_name(model)
+	source = model.__tablename__
+	columns = ', '.join(FTS_COLUMNS)
+	new_values = ', '.join('new.%s' % column for column in FTS_COLUMNS)
+	old_values = ', '.join('old.%s' % column for column in FTS_COLUMNS)
+	statements = [
+		"CREATE VIRTUAL TABLE %s USING fts5(%s, content='%s', content_rowid='id', tokenize='trigram')"
+			% (name, columns, source),
+		"CREATE TRIGGER %s_ai AFTER INSERT ON %s BEGIN "
+			"INSERT INTO %s(rowid, %s) VALUES (new.id, %s); END"
+			% (name, source, name, columns, new_values),
+		"CREATE TRIGGER %s_ad AFTER DELETE ON %s BEGIN "
+			"INSERT INTO %s(%s, rowid, %s) VALUES ('delete', old.id, %s); END"
+			% (name, source, name, name, columns, old_values),
+		"CREATE TRIGGER %s_au AFTER UPDATE ON %s BEGIN "
+			"INSERT INTO %s(%s, rowid, %s) VALUES ('delete', old.id, %s); "
+			"INSERT INTO %s(rowid, %s) VALUES (new.id, %s); END"
+			% (name, source, name, name, columns, old_values, name, columns, new_values),
+		"INSERT INTO %s(%s) VALUES ('rebuild')" % (name, name),
+	]
+	for statement in statements:
+		event.listen(model.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+	event.listen(model.__table__, 'before_drop',
+		DDL('DROP TABLE IF EXISTS %s' % name).execute_if(dialect='sqlite'))
+
+
+for _model in (Venue, Artist):
+	_install_fts(_model)
+
+
+def _like_pattern(search_term):
+	escaped = search_term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+	return '%' + escaped + '%'
+
+
+def match(model, search_term, backend=None):
+	"""Return (joins, where clause, rank) for a search on ``model``.
+
+	Rows with a higher rank are better matches; rank is None when there is
+	nothing to rank by. ``backend`` overrides the
+	dialect-based choice; 'like' is the plain unindexed ILIKE scan.
+	"""
+	backend = backend or db.engine.dialect.name
+	search_term = search_term.strip()
+	if not search_term:
+		return [], literal(True), None
+
+	pattern = _like_pattern(search_term)
+	genre = GENRES.get(search_term.lower())
+	clauses = []
+	joins = []
+
+	if backend == 'postgresql':
+		clauses += [model.name.ilike(pattern, escape='\\'), model.city.ilike(pattern, escape='\\')]
+		rank = func.greatest(func.similarity(model.name, search_term), func.similarity(model.city, search_term))
+	elif backend == 'sqlite' and len(search_term) >= FTS_MIN_LENGTH:
+		fts = table(_fts_name(model), literal_column('rowid'), literal_column('rank'))
+		matched = select(literal_column('rowid').label('id'), literal_column('rank').label('rank')) \
+			.select_from(fts) \
+			.where(text('%s MATCH :query' % fts.name).bindparams(query='"%s"' % search_term.replace('"', '""'))) \
+			.subquery()
+		joins.append((matched, matched.c.id == model.id))
+		clauses.append(matched.c.id.isnot(None))
+		# bm25: more negative is better
+		rank = -func.coalesce(matched.c.rank, 0)
+	else:
+		clauses += [model.name.ilike(pattern, escape='\\'), model.city.ilike(pattern, escape='\\')]
+		rank = None
+
+	if genre:
+		clauses.append(genres_clause(model, [genre]))
+
+	return joins, or_(*clauses), rank
+
+
+def search_statement(model, show_fk, search_term, page, per_page, backend=None, filters=NO_FILTERS):
+	# One query per page: matching rows, their upcoming show count (the
+	# counter kept on the row, see counters.py) and the total number of
+	# matches (a window count).
+	joins, clause, rank = match(model, search_term, backend)
+	now = datetime.now()
+	statement = select(
+			model.id,
+			model.name,
+			upcoming_count(model, show_fk, now).label('num_upcoming_shows'),
+			func.count().over().label('total'))
+	for target, onclause in joins:
+		statement = statement.outerjoin(target, onclause)
+	return statement \
+		.where(clause, *filter_clauses(model, show_fk, filters, now)) \
+		.order_by(*([rank.desc()] if rank is not None else []), model.name, model.id) \
+		.limit(per_page).offset((max(page, 1) - 1) * per_page)
+
+
+def search_facets_statement(model, show_fk, search_term, filters=NO_FILTERS, backend=None):
+	"""Genre facets of all the matches of a search (see facets.py)."""
+	joins, clause, _ = match(model, search_term, backend)
+	return genre_facets_statement(model, [clause] + filter_clauses(model, show_fk, filters), joins)
+
+
+def search_results(rows, page, per_page):
+	page = max(page, 1)
+	count = rows[0].total if rows else 0
+	return {
+		"count": count,
+		"page": page,
+		"has_prev": page > 1,
+		"has_next": page * per_page < count,
+		"data": [{
+			"id": row.id,
+			"name": row.name,
+			"num_upcoming_shows": row.num_upcoming_shows
+		} for row in rows]
+	}
+
+
+def search_with_upcoming_counts(model, show_fk, search_term, page, per_page, backend=None,
+		filters=NO_FILTERS, facets=False):
+	rows = db.session.execute(
+		search_statement(model, show_fk, search_term, page, per_page, backend, filters)).all()
+	results = search_results(rows, page, per_page)
+	if facets:
+		results['facets'] = facet_list(db.session.execute(
+			search_facets_statement(model, show_fk, search_term, filters, backend)))
+	return results
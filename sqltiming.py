@@ -0,0 +1,159 @@
+#----------------------------------------------------------------------------#
+# Per-request SQL instrumentation.
+#
+# Cursor events on every engine time each statement. Inside a request the
+# count, the total time and the slowest few statements are kept on `g`,
+# sent back as a Server-Timing header and logged as one JSON line per
+# request ("fyyur.requests" logger). With SLOW_QUERY_LOG set, statements
+# slower than SLOW_QUERY_THRESHOLD_MS go to that file, with the plan from
+# EXPLAIN when SLOW_QUERY_EXPLAIN is set; their parameters (user data) only
+# with SLOW_QUERY_LOG_PARAMETERS.
+#----------------------------------------------------------------------------#
+import heapq
+import json
+import logging
+import re
+import time
+from logging import FileHandler, Formatter, StreamHandler
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+request_log = logging.getLogger('fyyur.requests')
+slow_query_log = logging.getLogger('fyyur.slow_query')
+
+# only these are EXPLAINed; EXPLAIN of a write is left to a human
+READ_STATEMENT = re.compile(r'\s*(SELECT|WITH)\b', re.IGNORECASE)
+
+
+class RequestQueries(object):
+	__slots__ = ('started', 'count', 'seconds', 'slowest')
+
+	def __init__(self):
+		self.started = time.perf_counter()
+		self.count = 0
+		self.seconds = 0.0
+		# min-heap of (seconds, statement), the N slowest so far
+		self.slowest = []
+
+	def add(self, statement, seconds, keep):
+		self.count += 1
+		self.seconds += seconds
+		if len(self.slowest) < keep:
+			heapq.heappush(self.slowest, (seconds, statement))
+		elif seconds > self.slowest[0][0]:
+			heapq.heapreplace(self.slowest, (seconds, statement))
+
+
+def current_queries():
+	"""The running request's RequestQueries, or None outside a request."""
+	return g.get('sql_queries') if has_request_context() else None
+
+
+class QueryTimer(object):
+	def __init__(self, app=None):
+		self.threshold = None
+		self.explain = False
+		self.keep = 3
+		self.log_parameters = False
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		self.threshold = app.config.get('SLOW_QUERY_THRESHOLD_MS', 100) / 1000.0
+		self.explain = app.config.get('SLOW_QUERY_EXPLAIN', app.debug)
+		self.keep = app.config.get('SQL_TIMING_SLOWEST', 3)
+		self.log_parameters = app.config.get('SLOW_QUERY_LOG_PARAMETERS', False)
+
+		if app.config.get('SLOW_QUERY_LOG') and not slow_query_log.handlers:
+			handler = FileHandler(app.config['SLOW_QUERY_LOG'])
+			handler.setFormatter(Formatter('%(asctime)s %(message)s'))
+			slow_query_log.addHandler(handler)
+			slow_query_log.setLevel(logging.INFO)
+		if app.config.get('SQL_REQUEST_LOG') and not request_log.handlers:
+			request_log.addHandler(StreamHandler())
+			request_log.setLevel(logging.INFO)
+
+		event.listen(Engine, 'before_cursor_execute', self._before)
+		event.listen(Engine, 'after_cursor_execute', self._after)
+		app.before_request(self._start_request)
+		app.after_request(self._finish_request)
+
+	# the start time rides on the statement's execution context, so a
+	# statement that fails (no after_cursor_execute) leaves nothing behind
+
+	def _before(self, conn, cursor, statement, parameters, context, executemany):
+		if context is not None:
+			context._fyyur_query_started = time.perf_counter()
+
+	def _after(self, conn, cursor, statement, parameters, context, executemany):
+		started = getattr(context, '_fyyur_query_started', None)
+		if started is None:
+			return
+		seconds = time.perf_counter() - started
+		queries = current_queries()
+		if queries is not None:
+			queries.add(statement, seconds, self.keep)
+		if seconds >= self.threshold:
+			self._log_slow(conn, cursor, statement, parameters, executemany, seconds)
+
+	def _log_slow(self, conn, cursor, statement, parameters, executemany, seconds):
+		entry = {
+			'ms': round(seconds * 1000, 2),
+			'statement': statement,
+			'path': request.path if has_request_context() else None,
+		}
+		if self.log_parameters:
+			entry['parameters'] = repr(parameters)[:500]
+		if self.explain and not executemany and READ_STATEMENT.match(statement):
+			entry['plan'] = self._explain(conn, statement, parameters)
+		slow_query_log.info(json.dumps(entry, default=str))
+
+	@staticmethod
+	def _explain(conn, statement, parameters):
+		sqlite = conn.dialect.name == 'sqlite'
+		cursor = conn.connection.cursor()
+		try:
+			# a failed EXPLAIN must not abort the request's transaction
+			if not sqlite:
+				cursor.execute('SAVEPOINT explain_slow_query')
+			try:
+				cursor.execute(('EXPLAIN QUERY PLAN ' if sqlite else 'EXPLAIN ') + statement, parameters)
+				return [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+			except Exception as e:
+				if not sqlite:
+					cursor.execute('ROLLBACK TO SAVEPOINT explain_slow_query')
+				return ['EXPLAIN failed: %s' % e]
+			finally:
+				if not sqlite:
+					cursor.execute('RELEASE SAVEPOINT explain_slow_query')
+		except Exception as e:
+			return ['EXPLAIN failed: %s' % e]
+		finally:
+			cursor.close()
+
+	def _start_request(self):
+		g.sql_queries = RequestQueries()
+
+	def _finish_request(self, response):
+		queries = g.pop('sql_queries', None)
+		if queries is None:
+			return response
+		total_ms = (time.perf_counter() - queries.started) * 1000
+		db_ms = queries.seconds * 1000
+		response.headers.add('Server-Timing', 'db;dur=%.2f;desc="%d queries", app;dur=%.2f' % (
+			db_ms, queries.count, total_ms))
+		if request_log.isEnabledFor(logging.INFO):
+			request_log.info(json.dumps({
+				'method': request.method,
+				'path': request.path,
+				'endpoint': request.endpoint,
+				'status': response.status_code,
+				'ms': round(total_ms, 2),
+				'queries': queries.count,
+				'db_ms': round(db_ms, 2),
+				'slowest': [{'ms': round(seconds * 1000, 2), 'statement': statement[:300]}
+					for seconds, statement in sorted(queries.slowest, reverse=True)],
+			}))
+		return response
@@ -0,0 +1,59 @@
+#----------------------------------------------------------------------------#
+# Test fixtures: the app on a SQLite database seeded by benchmarks/seed.py.
+#
+#   python -m pytest
+#----------------------------------------------------------------------------#
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# read by config.py when the app is imported
+DATABASE = os.path.join(tempfile.mkdtemp(prefix='fyyur-tests-'), 'fyyur.db')
+os.environ['FYYUR_DATABASE_URL'] = 'sqlite:///' + DATABASE
+os.environ['FYYUR_TESTING'] = '1'
+os.environ['FYYUR_SQL_REQUEST_LOG'] = '0'
+os.environ['FYYUR_JOBS_BACKEND'] = 'inline'
+
+VENUES = 60
+ARTISTS = 120
+SHOWS = 2000
+
+
+@pytest.fixture(scope='session')
+def app():
+	from app import app
+	from models import db
+	from benchmarks.seed import reset
+
+	app.config['WTF_CSRF_ENABLED'] = False
+	with app.app_context():
+		reset(venues=VENUES, artists=ARTISTS, shows=SHOWS)
+		db.session.remove()
+	return app
+
+
+@pytest.fixture
+def client(app):
+	return app.test_client()
+
+
+@contextmanager
+def recorded_statements():
+	"""The SQL statements run inside the block, on any engine."""
+	statements = []
+
+	def record(conn, cursor, statement, parameters, context, executemany):
+		statements.append(statement)
+
+	event.listen(Engine, 'before_cursor_execute', record)
+	try:
+		yield statements
+	finally:
+		event.remove(Engine, 'before_cursor_execute', record)
@@ -0,0 +1,55 @@
+import base64
+import json
+
+import pytest
+
+from pagination import encode_cursor
+
+
+def forged(values):
+	raw = json.dumps(values).encode('utf-8')
+	return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+LISTS = ['/venues', '/artists', '/shows', '/api/v1/venues', '/api/v1/artists', '/api/v1/shows']
+
+BAD_CURSORS = {
+	'/venues': [[{'a': 1}, [2], 3], ['CA', 'San Francisco', '3'], ['CA', 'San Francisco', True],
+		['CA', 'San Francisco', 3.5], ['CA', None, 3], ['CA', 3]],
+	'/artists': [[{'a': 1}, 3], [['Name'], 3], ['Name', '3'], 'Name'],
+	'/shows': [[{'a': 1}, 3], ['tomorrow', 3], [20261018, 3], ['2026-10-18T20:00:00', [3]]],
+}
+
+
+def cases():
+	for url in LISTS:
+		for values in BAD_CURSORS[url.replace('/api/v1', '')]:
+			yield url, values
+
+
+@pytest.mark.parametrize('url, values', list(cases()))
+def test_forged_cursor_is_a_400(client, url, values):
+	response = client.get(url, query_string={'after': forged(values)})
+	assert response.status_code == 400
+
+
+@pytest.mark.parametrize('url', LISTS)
+def test_garbage_cursor_is_a_400(client, url):
+	assert client.get(url, query_string={'after': 'not a cursor!'}).status_code == 400
+
+
+@pytest.mark.parametrize('url, values', [
+	('/api/v1/venues', ['CA', 'San Francisco', 3]),
+	('/api/v1/artists', ['M', 3]),
+	('/api/v1/shows', ['2020-01-01T00:00:00', 3]),
+])
+def test_well_formed_cursor_pages_on(client, url, values):
+	response = client.get(url, query_string={'after': encode_cursor(values)})
+	assert response.status_code == 200
+
+
+def test_next_cursor_round_trips(client):
+	first = client.get('/api/v1/shows', query_string={'limit': 5}).get_json()
+	second = client.get('/api/v1/shows', query_string={'limit': 5, 'after': first['next']}).get_json()
+	assert second['data']
+	assert {row['id'] for row in first['data']}.isdisjoint(row['id'] for row in second['data'])
@@ -0,0 +1,18 @@
+import pytest
+
+from benchmarks import query_plans
+
+
+@pytest.fixture(scope='module')
+def checked_pages(app):
+	with app.app_context():
+		return query_plans.pages()
+
+
+@pytest.mark.parametrize('page', range(4), ids=['show_venue', 'show_artist', 'search_venues', 'search_artists'])
+def test_show_is_read_through_an_index(app, client, checked_pages, page):
+	name, method, url, data = checked_pages[page]
+	with app.app_context():
+		scans = query_plans.check(client, method, url, data)
+	assert scans is not None, '%s: no statement reads show' % name
+	assert not scans, '\n\n'.join('%s\n%s' % scan for scan in scans)
@@ -0,0 +1,112 @@
+import pytest
+from flask import Flask
+from sqlalchemy import text
+
+from models import db
+from replicas import STICKY_COOKIE, ReplicaRouter, read_only
+
+STICKY_SECONDS = 10
+
+
+@pytest.fixture
+def replica_app(tmp_path):
+	"""An app on two SQLite databases, each saying which one it is."""
+	urls = {name: 'sqlite:///%s' % (tmp_path / ('%s.db' % name)) for name in ('primary', 'replica1')}
+	app = Flask(__name__)
+	app.config.update(
+		SQLALCHEMY_DATABASE_URI=urls['primary'],
+		SQLALCHEMY_BINDS={'replica1': urls['replica1']},
+		SQLALCHEMY_TRACK_MODIFICATIONS=False,
+		DB_REPLICAS={'replica1': urls['replica1']},
+		REPLICA_STICKY_SECONDS=STICKY_SECONDS,
+		REPLICA_CHECK_INTERVAL=60,
+		REPLICA_MAX_LAG_SECONDS=5,
+	)
+	db.init_app(app)
+	router = ReplicaRouter(app)
+
+	@app.route('/read')
+	@read_only
+	def read():
+		return db.session.execute(text('SELECT name FROM whoami')).scalar()
+
+	@app.route('/write', methods=['POST'])
+	def write():
+		db.session.execute(text("UPDATE whoami SET name = name"))
+		db.session.commit()
+		return 'ok'
+
+	with app.app_context():
+		for bind, name in ((None, 'primary'), ('replica1', 'replica1')):
+			with db.get_engine(app, bind=bind).begin() as connection:
+				connection.execute(text('CREATE TABLE whoami (name VARCHAR)'))
+				connection.execute(text('INSERT INTO whoami VALUES (:name)'), {'name': name})
+	yield app, router
+	with app.app_context():
+		for bind in (None, 'replica1'):
+			db.get_engine(app, bind=bind).dispose()
+
+
+def read(client):
+	response = client.get('/read')
+	assert response.status_code == 200
+	return response.get_data(as_text=True)
+
+
+def test_read_only_views_use_the_replica(replica_app):
+	app, router = replica_app
+	assert read(app.test_client()) == 'replica1'
+	assert router.status() == {'replica1': (True, 0.0)}
+
+
+def test_writes_stick_the_client_to_the_primary(replica_app):
+	app, router = replica_app
+	client = app.test_client()
+	response = client.post('/write')
+	cookie = response.headers['Set-Cookie']
+	assert cookie.startswith(STICKY_COOKIE + '=')
+	assert 'Max-Age=%d' % STICKY_SECONDS in cookie
+	assert read(client) == 'primary'
+	# other clients still read from the replica
+	assert read(app.test_client()) == 'replica1'
+
+
+def test_reads_set_no_sticky_cookie(replica_app):
+	app, router = replica_app
+	response = app.test_client().get('/read')
+	assert 'Set-Cookie' not in response.headers
+
+
+def test_a_lagging_replica_is_skipped(replica_app):
+	app, router = replica_app
+	router.max_lag = -1
+	assert read(app.test_client()) == 'primary'
+	assert router.status() == {'replica1': (False, 0.0)}
+
+
+def test_an_unreachable_replica_is_skipped(replica_app, tmp_path):
+	app, router = replica_app
+	# a new URL gives the bind a new engine
+	app.config['SQLALCHEMY_BINDS'] = {'replica1': 'sqlite:///%s' % (tmp_path / 'missing' / 'replica1.db')}
+	assert read(app.test_client()) == 'primary'
+	assert router.status() == {'replica1': (False, None)}
+
+
+def test_a_marked_down_replica_waits_for_its_next_check(replica_app):
+	app, router = replica_app
+	router.mark_down('replica1')
+	client = app.test_client()
+	assert read(client) == 'primary'
+	router.replicas['replica1'].next_check = 0
+	assert read(client) == 'replica1'
+
+
+def test_a_failing_replica_is_marked_down_and_the_view_runs_on_the_primary(replica_app):
+	app, router = replica_app
+	with app.app_context():
+		with db.get_engine(app, bind='replica1').begin() as connection:
+			connection.execute(text('DROP TABLE whoami'))
+	client = app.test_client()
+	assert read(client) == 'primary'
+	assert router.status() == {'replica1': (False, None)}
+	assert read(client) == 'primary'
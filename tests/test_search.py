@@ -0,0 +1,54 @@
+import pytest
+from sqlalchemy import select
+
+from conftest import recorded_statements
+from facets import NO_FILTERS
+from models import db, Venue, Artist, Show
+from search import search_with_upcoming_counts
+
+SEARCHED = [(Venue, Show.venue_id), (Artist, Show.artist_id)]
+
+
+@pytest.mark.parametrize('model, show_fk', SEARCHED)
+@pytest.mark.parametrize('search_term', [
+	'Blue',   # full-text match
+	'Bl',     # too short for the trigram index: LIKE
+	'Jazz',   # a genre as well
+	'',
+])
+def test_search_page_is_one_query(app, model, show_fk, search_term):
+	with app.app_context():
+		with recorded_statements() as statements:
+			results = search_with_upcoming_counts(model, show_fk, search_term, 1, 10)
+	assert len(statements) == 1, statements
+	assert results['data']
+	assert len(results['data']) <= 10
+
+
+@pytest.mark.parametrize('model, show_fk', SEARCHED)
+def test_later_pages_are_one_query(app, model, show_fk):
+	with app.app_context():
+		first = search_with_upcoming_counts(model, show_fk, '', 1, 10)
+		with recorded_statements() as statements:
+			second = search_with_upcoming_counts(model, show_fk, '', 2, 10)
+	assert len(statements) == 1, statements
+	assert second['count'] == first['count']
+	assert second['has_prev']
+	assert not {row['id'] for row in first['data']} & {row['id'] for row in second['data']}
+
+
+@pytest.mark.parametrize('model, show_fk', SEARCHED)
+def test_genre_term_and_genre_filter_are_both_applied(app, model, show_fk):
+	# 'Jazz' matches the Jazz genre; ?genre=Blues must still hold
+	filters = NO_FILTERS._replace(genres=('Blues',))
+	with app.app_context():
+		rows = db.session.execute(select(model.id, model.name, model.city, model.genres)).all()
+		results = search_with_upcoming_counts(model, show_fk, 'Jazz', 1, 1000, filters=filters, facets=True)
+	expected = {row.id for row in rows if 'Blues' in row.genres and (
+		'Jazz' in row.genres or 'jazz' in ('%s %s' % (row.name, row.city)).lower())}
+	assert expected
+	assert {row['id'] for row in results['data']} == expected
+	assert results['count'] == len(expected)
+	facets = {facet['genre']: facet['count'] for facet in results['facets']}
+	assert facets['Blues'] == len(expected)
+	assert facets['Jazz'] == sum(1 for row in rows if row.id in expected and 'Jazz' in row.genres)
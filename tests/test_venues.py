@@ -0,0 +1,41 @@
+import pytest
+
+from models import db, Venue
+
+VENUE_FORM = {
+	'name': 'The Coordinates Club', 'city': 'San Francisco', 'state': 'CA',
+	'address': '1 Market St', 'phone': '415-000-0000', 'genres': 'Jazz',
+	'image_link': '', 'facebook_link': '', 'website_link': '', 'seeking_description': '',
+}
+
+
+def venue_named(app, name):
+	with app.app_context():
+		venue = db.session.query(Venue).filter_by(name=name).one_or_none()
+		db.session.remove()
+		return venue
+
+
+@pytest.mark.parametrize('latitude, longitude', [('91', '0'), ('0', '-181'), ('north', '0')])
+def test_create_rejects_bad_coordinates(app, client, latitude, longitude):
+	form = dict(VENUE_FORM, name='Nowhere %s %s' % (latitude, longitude), latitude=latitude, longitude=longitude)
+	response = client.post('/venues/create', data=form)
+	assert response.status_code == 400
+	assert b'Venue can not be listed' in response.data
+	assert venue_named(app, form['name']) is None
+
+
+def test_create_places_the_venue(app, client):
+	response = client.post('/venues/create', data=dict(VENUE_FORM, latitude='37.79', longitude='-122.39'))
+	assert response.status_code == 200
+	venue = venue_named(app, VENUE_FORM['name'])
+	assert (venue.latitude, venue.longitude) == (37.79, -122.39)
+	assert venue.geohash.startswith('9q8')
+
+
+def test_edit_rejects_bad_coordinates(app, client):
+	form = dict(VENUE_FORM, name='Renamed', latitude='-90.5', longitude='10')
+	response = client.post('/venues/1/edit', data=form)
+	assert response.status_code == 400
+	assert b'Venue can not be edited, latitude' in response.data
+	assert venue_named(app, 'Renamed') is None